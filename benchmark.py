@@ -0,0 +1,600 @@
+#!/usr/bin/env python
+
+import argparse
+import multiprocessing
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+import torch
+
+from nets.attention_model import AttentionModel
+from nets.v_estimator import V_Estimator, V_EstimatorShared
+from nets.v_estimator3 import V_Estimator3
+from nets.critic_ensemble import CriticEnsemble
+from utils import load_problem, compile_model
+from utils.random_data import random_obs, random_episodes
+
+
+# Shared harness: every benchmark times variants of the same work per graph size and prints one line per graph size
+# with the time of each variant and its speedup over the first one. Equivalence of the variants is tested in tests/.
+
+def time_call(fn, repeats, warmup=3):
+    for _ in range(warmup):
+        fn()
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - t0) / repeats
+
+
+def time_settings(fn, module, attribute, values, repeats, warmup=1):
+    """
+    Seconds per call of fn with module.<attribute> set to each of the values, the attribute is restored afterwards
+
+    :return: dict of the seconds per call by value
+    """
+    default = getattr(module, attribute)
+    times = {}
+    try:
+        for value in values:
+            setattr(module, attribute, value)
+            times[value] = time_call(fn, repeats, warmup)
+    finally:
+        setattr(module, attribute, default)
+    return times
+
+
+def graph_sizes(opts):
+    """The graph sizes to benchmark, with the same seed for each"""
+    for graph_size in opts.graph_size:
+        torch.manual_seed(0)
+        yield graph_size
+
+
+def report(graph_size, times, rate=None, **fields):
+    """
+    Prints the seconds per call of the variants of a benchmark (dict by name), with the speedups over the first
+    variant, followed by further fields
+
+    :param rate: (items per call, unit) to print items per second instead of milliseconds per call
+    """
+    baseline = next(iter(times.values()))
+    parts = [f"n={graph_size:5d}"]
+    for i, (name, t) in enumerate(times.items()):
+        value = f"{rate[0] / t:9.1f} {rate[1]}" if rate is not None else f"{t * 1e3:9.2f}ms"
+        parts.append(f"{name}: {value}" + (f" ({baseline / t:5.2f}x)" if i > 0 else ""))
+    parts += [f"{name}: {value}" for name, value in fields.items()]
+    print("  ".join(parts))
+
+
+def in_fresh_process(fn, *args):
+    """Result of fn(*args) in a spawned process, so that its peak resident memory only covers this call"""
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(fn, args)
+
+
+def peak_memory(fn):
+    """Result of fn, the growth of the peak resident memory of the process in MB during the call, and its seconds"""
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    result = fn()
+    t = time.perf_counter() - t0
+    return result, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024, t
+
+
+def create_networks(opts, problem):
+    actor = AttentionModel(opts.embedding_dim, opts.embedding_dim, problem, n_encode_layers=opts.n_encode_layers,
+                           normalization='instance')
+    critic1 = V_Estimator(embedding_dim=opts.critics_embedding_dim, problem=problem)
+    critic3 = V_Estimator3(embedding_dim=opts.critics_embedding_dim, problem=problem)
+    return {'actor': actor, 'critic v1': critic1, 'critic v3': critic3}
+
+
+def actor_critic_loss(actor, critic, obs, returns):
+    """Policy gradient loss of the most likely actions, plus the value loss of the critic (if any)"""
+    logits, _ = actor(obs)
+    log_p = torch.log_softmax(logits, dim=-1).max(dim=-1)[0]
+    if critic is None:
+        return -(log_p * returns).mean()
+    values = critic(obs)
+    return -(log_p * (returns - values.detach())).mean() + (returns - values).pow(2).mean()
+
+
+def greedy_tours(actor, problem_name, instances):
+    from utils.rollout import rollout
+
+    with torch.no_grad():
+        return rollout(actor, problem_name, instances, 'greedy')[2]
+
+
+def create_sac_policy(opts, problem, actor, ensemble_critics=False):
+    from custom_classes.discrete_sac import DiscreteSACPolicy_custom
+
+    critic1, critic2 = (V_Estimator3(embedding_dim=opts.critics_embedding_dim, problem=problem, q_outputs=True)
+                        for _ in range(2))
+    if ensemble_critics:
+        critic1, critic2 = CriticEnsemble([critic1, critic2]), None
+    return DiscreteSACPolicy_custom(actor, torch.optim.Adam(actor.parameters(), lr=1e-5),
+                                    critic1, torch.optim.Adam(critic1.parameters(), lr=1e-5),
+                                    critic2, torch.optim.Adam(critic2.parameters(), lr=1e-5) if critic2 is not None else None,
+                                    alpha=0.01)
+
+
+def fill_replay_buffer(buffer, problem_name, n_episodes, graph_size):
+    """Adds n_episodes random episodes of graph_size steps, one per buffer, the last transition of each is done"""
+    import numpy as np
+    from tianshou.data import Batch
+
+    episodes = random_episodes(problem_name, n_episodes, graph_size + 1)
+    for step in range(graph_size):
+        rows = slice(step * n_episodes, (step + 1) * n_episodes)
+        next_rows = slice((step + 1) * n_episodes, (step + 2) * n_episodes)
+        buffer.add(Batch(
+            obs={key: value[rows] for key, value in episodes.items()},
+            act=np.random.randint(graph_size, size=n_episodes),
+            rew=np.zeros(n_episodes),
+            terminated=np.full(n_episodes, step == graph_size - 1),
+            truncated=np.zeros(n_episodes, dtype=bool),
+            obs_next={key: value[next_rows] for key, value in episodes.items()},
+            info={}
+        ))
+    return buffer
+
+
+def bench_compile(opts):
+    """
+    Step latency of eager vs. torch.compile'd networks, as the collectors call them once per env step
+    """
+    problem = load_problem(opts.problem)
+    for graph_size in graph_sizes(opts):
+        eager = create_networks(opts, problem)
+        torch.manual_seed(0)
+        compiled = {name: compile_model(net) for name, net in create_networks(opts, problem).items()}
+        obs = random_obs(opts.problem, opts.batch_size, graph_size, step=graph_size // 2)
+
+        for name in eager:
+            eager[name].eval()
+            compiled[name].eval()
+            with torch.no_grad():
+                report(graph_size, {f'{name} eager': time_call(lambda: eager[name](obs), opts.repeats),
+                                    'compiled': time_call(lambda: compiled[name](obs), opts.repeats)})
+
+
+def bench_precision(opts):
+    """
+    Training throughput (forward + backward of actor and v3 critic) in fp32 vs. bf16 autocast.
+    As a proxy for convergence, the bf16 gradients are compared against the fp32 gradients of the same batch.
+    """
+    problem = load_problem(opts.problem)
+    for graph_size in graph_sizes(opts):
+        networks = create_networks(opts, problem)
+        actor, critic = networks['actor'], networks['critic v3']
+        params = list(actor.parameters()) + list(critic.parameters())
+        obs = random_obs(opts.problem, opts.batch_size, graph_size, step=graph_size // 2)
+        returns = -torch.rand(opts.batch_size) * graph_size
+
+        def train_step(precision):
+            with torch.autocast(device_type='cpu', dtype=torch.bfloat16, enabled=precision == 'bf16'):
+                loss = actor_critic_loss(actor, critic, obs, returns)
+            for param in params:
+                param.grad = None
+            loss.backward()
+            return torch.cat([param.grad.flatten() for param in params if param.grad is not None])
+
+        grads = {precision: train_step(precision) for precision in ('fp32', 'bf16')}
+        cosine = torch.nn.functional.cosine_similarity(grads['fp32'], grads['bf16'], dim=0).item()
+        times = {precision: time_call(lambda: train_step(precision), opts.repeats) for precision in ('fp32', 'bf16')}
+        report(graph_size, times, rate=(opts.batch_size, 'obs/s'), **{'grad cosine similarity': f'{cosine:.4f}'})
+
+
+def bench_share_encoder(opts):
+    """
+    Time of an actor-critic learning step (forward + backward of actor and critic on the same observations)
+    with a separate v3 critic vs. a critic head on the actor's cached encoding (--share_encoder)
+    """
+    problem = load_problem(opts.problem)
+    for graph_size in graph_sizes(opts):
+        networks = create_networks(opts, problem)
+        actor = networks['actor']
+        critics = {
+            'separate critic': networks['critic v3'],
+            'shared encoder': V_EstimatorShared(actor, embedding_dim=opts.critics_embedding_dim, problem=problem)
+        }
+        actor.cache_encoding = True
+        obs = random_obs(opts.problem, opts.batch_size, graph_size, step=graph_size // 2)
+        returns = -torch.rand(opts.batch_size) * graph_size
+
+        # the optimizer step invalidates the actor's cached encoding, as in the policies' learn functions
+        optimizer = torch.optim.SGD([param for network in (actor, *critics.values()) for param in network.parameters()],
+                                    lr=1e-6)
+
+        def learn_step(critic):
+            loss = actor_critic_loss(actor, critic, obs, returns)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            actor.clear_encoding_cache()
+
+        report(graph_size, {name: time_call(lambda: learn_step(critic), opts.repeats) for name, critic in critics.items()})
+
+
+def bench_sac_update(opts):
+    """
+    SAC updates per second (target Q-values, twin critic and actor losses) on a replay buffer of random episodes,
+    with separate twin critics vs. one stacked critic ensemble (--ensemble_critics)
+    """
+    from tianshou.data import VectorReplayBuffer
+
+    problem = load_problem(opts.problem)
+    for graph_size in graph_sizes(opts):
+        buffer = fill_replay_buffer(VectorReplayBuffer(total_size=opts.batch_size * graph_size, buffer_num=opts.batch_size),
+                                    opts.problem, opts.batch_size, graph_size)
+        times = {}
+        for name, ensemble_critics in (('twin critics', False), ('ensemble', True)):
+            torch.manual_seed(0)
+            policy = create_sac_policy(opts, problem, create_networks(opts, problem)['actor'], ensemble_critics)
+            times[name] = time_call(lambda: policy.update(opts.batch_size, buffer), opts.repeats)
+        report(graph_size, times, rate=(1, 'updates/s'))
+
+
+def bench_offpolicy_grouping(opts):
+    """
+    SAC updates per second with v3 critics on a replay buffer of random episodes, encoding every transition, every
+    instance of a minibatch once (--group_instances), and additionally sampling minibatches in groups of
+    --episode_group_size transitions per episode
+    """
+    import numpy as np
+    from custom_classes.replay_buffer import EpisodeGroupedVectorReplayBuffer
+
+    problem = load_problem(opts.problem)
+    for graph_size in graph_sizes(opts):
+        policy = create_sac_policy(opts, problem, create_networks(opts, problem)['actor'])
+        buffer = fill_replay_buffer(
+            EpisodeGroupedVectorReplayBuffer(total_size=opts.batch_size * graph_size, buffer_num=opts.batch_size),
+            opts.problem, opts.batch_size, graph_size)
+
+        times, n_instances = {}, {}
+        for name, group_instances, group_size in (('per transition', False, 1), ('grouped', True, 1),
+                                                  (f'{opts.episode_group_size} per episode', True,
+                                                   opts.episode_group_size)):
+            for network in (policy.actor, policy.critic1, policy.critic2):
+                network.group_instances = group_instances
+            buffer.group_size = group_size
+            n_instances[name] = np.mean([len(np.unique(buffer.sample_indices(opts.batch_size) // graph_size))
+                                         for _ in range(100)])
+            times[name] = time_call(lambda: policy.update(opts.batch_size, buffer), opts.repeats, warmup=1)
+        report(graph_size, times, rate=(1, 'updates/s'),
+               **{f'instances per minibatch of {opts.batch_size}': ' / '.join(f'{n:.1f}' for n in n_instances.values())})
+
+
+def bench_reinforce(opts):
+    """
+    Training episodes per second of REINFORCE with tianshou DummyVectorEnv envs collecting the episodes before each
+    update (the PG path) vs. tensor rollouts of whole batches (utils/rollout.py)
+    """
+    import tianshou as ts
+    from problems.tsp.tsp_env_optimized import TSP_env_optimized
+    from problems.op.op_env_optimized import OP_env_optimized
+    from utils.rollout import random_instances, rollout
+
+    problem = load_problem(opts.problem)
+    env_opts = argparse.Namespace(device=torch.device('cpu'), data_distribution=None)
+    for graph_size in graph_sizes(opts):
+        actor = create_networks(opts, problem)['actor']
+        optimizer = torch.optim.Adam(actor.parameters(), lr=1e-6)
+
+        def tensor_step():
+            instances = random_instances(opts.problem, opts.batch_size, graph_size)
+            cost, log_likelihood, _ = rollout(actor, opts.problem, instances)
+            loss = ((cost - cost.mean()) * log_likelihood).mean()
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+        env_class = {'tsp': TSP_env_optimized, 'op': OP_env_optimized}[opts.problem]
+        envs = ts.env.DummyVectorEnv([lambda: env_class(env_opts, graph_size) for _ in range(opts.batch_size)])
+        policy = ts.policy.PGPolicy(actor, optimizer, lambda logits: torch.distributions.Categorical(logits=logits))
+        collector = ts.data.Collector(policy, envs, ts.data.VectorReplayBuffer(opts.batch_size * (graph_size + 1), opts.batch_size))
+
+        def env_step():
+            collector.collect(n_episode=opts.batch_size)
+            policy.update(0, collector.buffer, batch_size=opts.batch_size * graph_size, repeat=1)
+            collector.reset_buffer()
+
+        report(graph_size, {'tianshou envs': time_call(env_step, max(opts.repeats // 10, 1), warmup=1),
+                            'tensor rollouts': time_call(tensor_step, opts.repeats)},
+               rate=(opts.batch_size, 'episodes/s'))
+
+
+def bench_knn(opts):
+    """
+    Greedy decoding time and mean cost with the candidates of each step restricted to the k nearest neighbours of the
+    current node (--knn_candidates), vs. all nodes. With --policy_path the actor of a saved policy is used.
+    """
+    from utils.rollout import random_instances, greedy_costs
+
+    problem = load_problem(opts.problem)
+    for graph_size in graph_sizes(opts):
+        actor = create_networks(opts, problem)['actor']
+        if opts.policy_path:
+            state_dict = torch.load(opts.policy_path, map_location='cpu')
+            actor.load_state_dict({key[len('actor.'):]: value for key, value in state_dict.items() if key.startswith('actor.')})
+        actor.eval()
+        instances = random_instances(opts.problem, opts.batch_size, graph_size)
+
+        def mean_cost():
+            return greedy_costs(actor, opts.problem, instances).mean().item()
+
+        ks = [0] + opts.knn_candidates
+        costs = {}
+        for k in ks:
+            actor.knn_candidates = k
+            costs[k] = mean_cost()
+        times = time_settings(mean_cost, actor, 'knn_candidates', ks, opts.repeats)
+        report(graph_size, {f'k={k}' if k > 0 else 'all nodes': t for k, t in times.items()},
+               **{'gap of the mean cost to all nodes': ' / '.join(
+                   f'{(costs[k] - costs[0]) / abs(costs[0]) * 100:+.2f}%' for k in opts.knn_candidates)})
+
+
+def bench_debug_checks(opts):
+    """
+    Greedy decoding time with the per step NaN and visited checks of the decoder (--debug_checks 1) vs. without
+    """
+    from utils.rollout import random_instances, greedy_costs
+
+    problem = load_problem(opts.problem)
+    for graph_size in graph_sizes(opts):
+        actor = create_networks(opts, problem)['actor'].eval()
+        instances = random_instances(opts.problem, opts.batch_size, graph_size)
+        times = time_settings(lambda: greedy_costs(actor, opts.problem, instances), actor, 'debug_checks',
+                              (True, False), opts.repeats)
+        report(graph_size, {'with checks': times[True], 'without': times[False]})
+
+
+def bench_forced_moves(opts):
+    """
+    Time of the actor forward passes of all steps of a batch of episodes, as in the collectors, with vs. without
+    skipping the rows with a single feasible action (--skip_forced_moves)
+    """
+    problem = load_problem(opts.problem)
+    for graph_size in graph_sizes(opts):
+        actor = create_networks(opts, problem)['actor'].eval()
+        # one observation batch per step of the same episodes
+        episodes = random_episodes(opts.problem, opts.batch_size, graph_size)
+        steps = [{key: value[step * opts.batch_size:(step + 1) * opts.batch_size] for key, value in episodes.items()}
+                 for step in range(graph_size)]
+
+        def collect():
+            with torch.no_grad():
+                for obs in steps:
+                    actor(obs)
+
+        times = time_settings(collect, actor, 'skip_forced_moves', (False, True), opts.repeats)
+        report(graph_size, {'all steps': times[False], 'skipping forced moves': times[True]})
+
+
+def bench_compact_decoding(opts):
+    """
+    Greedy decoding time of tensor rollouts with the decoder keys of all nodes in every step vs. compacted to the
+    feasible nodes every --compact_every steps
+    """
+    from utils.rollout import random_instances
+
+    problem = load_problem(opts.problem)
+    for graph_size in graph_sizes(opts):
+        actor = create_networks(opts, problem)['actor'].eval()
+        instances = random_instances(opts.problem, opts.batch_size, graph_size)
+        times = time_settings(lambda: greedy_tours(actor, opts.problem, instances), actor, 'compact_every',
+                              (0, opts.compact_every), opts.repeats)
+        report(graph_size, {'all nodes': times[0], f'compacted every {opts.compact_every} steps': times[opts.compact_every]})
+
+
+def bench_fold_projections(opts):
+    """
+    Time of a decoding step halfway through the tours and of greedy tensor rollouts with the step context and output
+    projections of the decoder applied in every step vs. folded into the precomputed node data
+    """
+    from utils.rollout import random_instances, initial_state, state_obs
+
+    problem = load_problem(opts.problem)
+    for graph_size in graph_sizes(opts):
+        actor = create_networks(opts, problem)['actor'].eval()
+        instances = random_instances(opts.problem, opts.batch_size, graph_size)
+        with torch.no_grad():
+            state = initial_state(opts.problem, instances)
+            embeddings = actor.encode(state_obs(opts.problem, state, instances))
+            for _ in range(graph_size // 2):
+                if state.all_finished():
+                    break
+                obs = state_obs(opts.problem, state, instances)
+                state = state.update(actor._get_logits(actor._precompute(embeddings), obs)[0][:, 0].argmax(-1))
+            obs = state_obs(opts.problem, state, instances)
+            fixed = {fold: actor._precompute(embeddings, fold_projections=fold) for fold in (False, True)}
+
+            step_times = {name: time_call(lambda: actor._get_logits(fixed[fold], obs), opts.repeats * 10, warmup=1)
+                          for name, fold in (('step', False), ('folded', True))}
+        times = time_settings(lambda: greedy_tours(actor, opts.problem, instances), actor, 'fold_projections',
+                              (False, True), opts.repeats)
+        report(graph_size, step_times)
+        report(graph_size, {'rollout': times[False], 'folded': times[True]})
+
+
+def bench_sparse_encoder(opts):
+    """
+    Time of encoding a batch with the actor's dense encoder vs. the sparse encoder, in which each node attends to
+    its --encoder_knn nearest nodes only
+    """
+    from nets.graph_encoder import node_coords
+
+    problem = load_problem(opts.problem)
+    for graph_size in graph_sizes(opts):
+        actor = create_networks(opts, problem)['actor'].eval()
+        obs = random_obs(opts.problem, opts.batch_size, graph_size, step=0)
+        init_embed, coords = actor._init_embed(obs), node_coords(obs, actor.is_orienteering)
+
+        def encode():
+            with torch.no_grad():
+                actor.embedder(init_embed, coords=coords)
+
+        times = time_settings(encode, actor.embedder, 'knn_neighbours', (0, opts.encoder_knn), opts.repeats)
+        report(graph_size, {'dense': times[0], f'k={opts.encoder_knn}': times[opts.encoder_knn]})
+
+
+def bench_group_instances(opts):
+    """
+    Time of an actor learning step (forward + backward) on all steps of --batch_size episodes, encoding each step
+    vs. each instance only once (--group_instances)
+    """
+    problem = load_problem(opts.problem)
+    for graph_size in graph_sizes(opts):
+        actor = create_networks(opts, problem)['actor']
+        obs = random_episodes(opts.problem, opts.batch_size, graph_size)
+        returns = -torch.rand(len(obs['loc'])) * graph_size
+
+        def learn_step():
+            actor.zero_grad()
+            actor_critic_loss(actor, None, obs, returns).backward()
+
+        times = time_settings(learn_step, actor, 'group_instances', (False, True), opts.repeats)
+        report(graph_size, {'per step': times[False], 'per instance': times[True]})
+
+
+def _checkpoint_train_step(opts, graph_size, checkpoint_layers):
+    torch.manual_seed(0)
+    networks = create_networks(opts, load_problem(opts.problem))
+    actor, critic = networks['actor'], networks['critic v3']
+    actor.embedder.checkpoint_layers = critic.embedder.checkpoint_layers = checkpoint_layers
+    obs = random_obs(opts.problem, opts.batch_size, graph_size, step=graph_size // 2)
+    returns = -torch.rand(opts.batch_size) * graph_size
+
+    def train_step():
+        loss = actor_critic_loss(actor, critic, obs, returns)
+        actor.zero_grad(set_to_none=True)
+        critic.zero_grad(set_to_none=True)
+        loss.backward()
+
+    _, peak_mb, _ = peak_memory(train_step)
+    return peak_mb, time_call(train_step, opts.repeats, warmup=0)
+
+
+def bench_checkpoint(opts):
+    """
+    Peak memory of a training step (forward + backward of actor and v3 critic) and training throughput without and
+    with activation checkpointing of the encoders (--checkpoint_encoder), each in a fresh process
+    """
+    for graph_size in opts.graph_size:
+        results = {layers: in_fresh_process(_checkpoint_train_step, opts, graph_size, layers)
+                   for layers in [0] + opts.checkpoint_layers}
+        report(graph_size, {f'checkpoint_layers={layers}': t for layers, (_, t) in results.items()},
+               rate=(opts.batch_size, 'obs/s'),
+               **{'peak memory of a step': ' / '.join(f'{peak_mb:.1f}MB' for peak_mb, _ in results.values())})
+
+
+def _encode_peak_memory(opts, graph_size, memory_budget):
+    torch.manual_seed(0)
+    actor = create_networks(opts, load_problem(opts.problem))['actor'].eval()
+    actor.embedder.attention_memory_budget = memory_budget
+    obs = random_obs(opts.problem, opts.batch_size, graph_size, step=0)
+    with torch.no_grad():
+        _, peak_mb, t = peak_memory(lambda: actor.encode(obs))
+    return peak_mb, t
+
+
+def bench_chunked_attention(opts):
+    """
+    Peak memory and time of encoding large instances without gradients with dense attention vs. attention
+    computed in chunks under a memory budget (--memory_budget MB, as --eval_memory_budget in evaluations),
+    each in a fresh process
+    """
+    for graph_size in opts.graph_size:
+        results = {name: in_fresh_process(_encode_peak_memory, opts, graph_size, memory_budget)
+                   for name, memory_budget in (('dense', None),
+                                               (f'budget {opts.memory_budget}MB', opts.memory_budget * 2 ** 20))}
+        report(graph_size, {name: t for name, (_, t) in results.items()},
+               **{'peak memory': ' / '.join(f'{peak_mb:.1f}MB' for peak_mb, _ in results.values())})
+
+
+# modules imported by the subcommands of run.py, besides run.py itself
+STARTUP_IMPORTS = {
+    'run.py --help': None,
+    'import run': [],
+    'train REINFORCE': ['tianshou', 'torch.utils.tensorboard', 'utils.rollout'],
+    'train PPO': ['tianshou', 'torch.utils.tensorboard', 'problems.tsp.tsp_env_optimized', 'problems.op.op_env_optimized',
+                  'custom_classes.actor_critic', 'nets.v_estimator', 'nets.v_estimator3'],
+    'evaluate': ['tianshou', 'torch.utils.tensorboard', 'problems.tsp.tsp_env_optimized', 'problems.op.op_env_optimized',
+                 'custom_classes.pg', 'custom_classes.actor_critic', 'custom_classes.discrete_sac', 'nets.v_estimator',
+                 'nets.v_estimator3', 'nets.critic_ensemble', 'utils.rollout', 'utils.augmentation', 'utils.solution_log'],
+    # all of the above, as imported at module load before the imports were deferred to the subcommands
+    'eager imports': ['tianshou', 'torch.utils.tensorboard', 'problems.tsp.tsp_env', 'problems.tsp.tsp_env_optimized',
+                      'problems.op.op_env_optimized', 'custom_classes.random', 'custom_classes.pg',
+                      'custom_classes.actor_critic', 'custom_classes.discrete_sac', 'nets.v_estimator',
+                      'nets.v_estimator3', 'nets.critic_ensemble', 'nets.argmaxembed', 'utils.rollout',
+                      'utils.augmentation', 'utils.solution_log', 'tqdm'],
+}
+
+
+def bench_startup(opts):
+    """
+    Wall time of fresh interpreters importing run.py and the modules each subcommand imports, i.e. the startup cost
+    of a run.py invocation before any work is done
+    """
+    for name, modules in STARTUP_IMPORTS.items():
+        if modules is None:
+            command = [sys.executable, 'run.py', '--help']
+        else:
+            command = [sys.executable, '-c', '; '.join(f'import {module}' for module in ['run'] + modules)]
+        times = []
+        for _ in range(opts.repeats):
+            t0 = time.perf_counter()
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            times.append(time.perf_counter() - t0)
+        print(f"{name:16s} {statistics.median(times):7.3f}s median of {opts.repeats} (min {min(times):.3f}s)")
+
+
+BENCHMARKS = {
+    'compile': bench_compile,
+    'precision': bench_precision,
+    'share_encoder': bench_share_encoder,
+    'sac_update': bench_sac_update,
+    'offpolicy_grouping': bench_offpolicy_grouping,
+    'reinforce': bench_reinforce,
+    'checkpoint': bench_checkpoint,
+    'chunked_attention': bench_chunked_attention,
+    'knn': bench_knn,
+    'debug_checks': bench_debug_checks,
+    'forced_moves': bench_forced_moves,
+    'compact_decoding': bench_compact_decoding,
+    'fold_projections': bench_fold_projections,
+    'sparse_encoder': bench_sparse_encoder,
+    'group_instances': bench_group_instances,
+    'startup': bench_startup,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="CPU micro benchmarks for the attention model and critics",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="benchmarks:\n" + "\n".join(f"  {name:20s}{' '.join(bench.__doc__.split())}"
+                                           for name, bench in BENCHMARKS.items()))
+    parser.add_argument('benchmark', choices=BENCHMARKS.keys(), help="Which benchmark to run")
+    parser.add_argument('--problem', default='tsp', help="The problem to solve, 'tsp' or 'op'")
+    parser.add_argument('--graph_size', nargs="+", type=int, default=[20, 50, 100], help="Graph sizes to benchmark")
+    parser.add_argument('--batch_size', type=int, default=64, help="Number of observations per network call")
+    parser.add_argument('--embedding_dim', type=int, default=128, help='Dimension of input embedding of the actor')
+    parser.add_argument('--critics_embedding_dim', type=int, default=64, help='Dimension of input embedding of critics')
+    parser.add_argument('--n_encode_layers', type=int, default=5, help='Number of layers in the encoder')
+    parser.add_argument('--episode_group_size', type=int, default=4, help="Transitions per episode in a minibatch for offpolicy_grouping")
+    parser.add_argument('--repeats', type=int, default=20, help="Number of timed calls per measurement")
+    parser.add_argument('--knn_candidates', nargs="+", type=int, default=[10, 20], help="Numbers of decoding candidates for knn")
+    parser.add_argument('--encoder_knn', type=int, default=20, help="Number of neighbours of each node in the sparse encoder for sparse_encoder")
+    parser.add_argument('--compact_every', type=int, default=10, help="Steps between compactions of the decoder keys for compact_decoding")
+    parser.add_argument('--checkpoint_layers', nargs="+", type=int, default=[1, 5], help="Layers per checkpointed segment for checkpoint")
+    parser.add_argument('--memory_budget', type=int, default=256, help="Attention memory budget in MB for chunked_attention")
+    parser.add_argument('--policy_path', default=None, help="Saved policy whose actor is used for knn, instead of an untrained one")
+    opts = parser.parse_args()
+
+    BENCHMARKS[opts.benchmark](opts)
@@ -0,0 +1,88 @@
+from typing import Any, Dict, Optional
+
+import numpy as np
+import torch
+
+from tianshou.data import Batch, ReplayBuffer, to_torch_as
+from tianshou.policy import A2CPolicy, BasePolicy, PPOPolicy
+
+
+class EncodingCacheMixin:
+    """Clears the encodings an actor with cache_encoding keeps for the critics sharing its encoder after each update.
+
+    They hold the autograd graph of the update, which would otherwise stay in memory until the next update.
+    """
+
+    def update(self, sample_size: int, buffer: Optional[ReplayBuffer], **kwargs: Any) -> Dict[str, Any]:
+        try:
+            return super().update(sample_size, buffer, **kwargs)
+        finally:
+            if getattr(self.actor, 'cache_encoding', False):
+                self.actor.clear_encoding_cache()
+
+
+class EpisodicValuesMixin:
+    """Computes the critic values of on-policy batches with a single critic pass per observation.
+
+    On-policy batches hold whole episodes in temporal order, so obs_next of a step is the obs of the following
+    step and V(s') can be taken from V(s) of that step. Only steps whose following step is not part of the batch
+    (last step of an unfinished or truncated episode) need a critic pass on obs_next, terminal states have value 0.
+    Apart from that, this is the same computation as A2CPolicy._compute_returns.
+    """
+
+    def _critic_values(self, obs: Batch) -> torch.Tensor:
+        values = []
+        for start in range(0, len(obs), self._batch):
+            values.append(self.critic(obs[start:start + self._batch]))
+        return torch.cat(values, dim=0).flatten()
+
+    def _compute_returns(
+        self, batch: Batch, buffer: ReplayBuffer, indices: np.ndarray
+    ) -> Batch:
+        with torch.no_grad():
+            batch.v_s = self._critic_values(batch.obs)  # old value
+        v_s = batch.v_s.cpu().numpy()
+
+        # position of each buffer index in the batch, -1 for transitions outside of it
+        position = np.full(buffer.maxsize, -1)
+        position[indices] = np.arange(len(indices))
+        next_indices = buffer.next(indices)
+        has_value = BasePolicy.value_mask(buffer, indices)
+        from_batch = has_value & (next_indices != indices) & (position[next_indices] >= 0)
+        from_critic = np.flatnonzero(has_value & ~from_batch)
+
+        v_s_ = np.zeros_like(v_s)
+        v_s_[from_batch] = v_s[position[next_indices[from_batch]]]
+        if len(from_critic) > 0:
+            with torch.no_grad():
+                v_s_[from_critic] = self._critic_values(batch.obs_next[from_critic]).cpu().numpy()
+
+        if self._rew_norm:  # unnormalize v_s & v_s_
+            v_s = v_s * np.sqrt(self.ret_rms.var + self._eps)
+            v_s_ = v_s_ * np.sqrt(self.ret_rms.var + self._eps)
+        unnormalized_returns, advantages = self.compute_episodic_return(
+            batch,
+            buffer,
+            indices,
+            v_s_,
+            v_s,
+            gamma=self._gamma,
+            gae_lambda=self._lambda
+        )
+        if self._rew_norm:
+            batch.returns = unnormalized_returns / \
+                np.sqrt(self.ret_rms.var + self._eps)
+            self.ret_rms.update(unnormalized_returns)
+        else:
+            batch.returns = unnormalized_returns
+        batch.returns = to_torch_as(batch.returns, batch.v_s)
+        batch.adv = to_torch_as(advantages, batch.v_s)
+        return batch
+
+
+class A2CPolicy_custom(EncodingCacheMixin, EpisodicValuesMixin, A2CPolicy):
+    pass
+
+
+class PPOPolicy_custom(EncodingCacheMixin, EpisodicValuesMixin, PPOPolicy):
+    pass
@@ -7,8 +7,10 @@ from torch.distributions import Categorical
 from tianshou.data import Batch, ReplayBuffer, to_torch
 from tianshou.policy import SACPolicy
 
+from custom_classes.actor_critic import EncodingCacheMixin
 
-class DiscreteSACPolicy_custom(SACPolicy):
+
+class DiscreteSACPolicy_custom(EncodingCacheMixin, SACPolicy):
     """Implementation of SAC for Discrete Action Settings. arXiv:1910.07207.
     :param torch.nn.Module actor: the actor network following the rules in
         :class:`~tianshou.policy.BasePolicy`. (s -> logits)
@@ -17,8 +19,9 @@ class DiscreteSACPolicy_custom(SACPolicy):
     :param torch.optim.Optimizer critic1_optim: the optimizer for the first
         critic network.
     :param torch.nn.Module critic2: the second critic network. (s -> Q(s))
+        None if critic1 is a CriticEnsemble, which evaluates all critics at once.
     :param torch.optim.Optimizer critic2_optim: the optimizer for the second
-        critic network.
+        critic network. None if critic2 is None.
     :param float tau: param for soft update of the target network. Default to 0.005.
     :param float gamma: discount factor, in [0, 1]. Default to 0.99.
     :param (float, torch.Tensor, torch.optim.Optimizer) or float alpha: entropy
@@ -40,8 +43,8 @@ class DiscreteSACPolicy_custom(SACPolicy):
         actor_optim: torch.optim.Optimizer,
         critic1: torch.nn.Module,
         critic1_optim: torch.optim.Optimizer,
-        critic2: torch.nn.Module,
-        critic2_optim: torch.optim.Optimizer,
+        critic2: Optional[torch.nn.Module],
+        critic2_optim: Optional[torch.optim.Optimizer],
         tau: float = 0.005,
         gamma: float = 0.99,
         alpha: Union[float, Tuple[float, torch.Tensor, torch.optim.Optimizer]] = 0.2,
@@ -54,7 +57,7 @@ class DiscreteSACPolicy_custom(SACPolicy):
             actor_optim,
             critic1,
             critic1_optim,
-            critic2,
+            critic2 if critic2 is not None else torch.nn.Identity(),  # placeholder for the target copy
             critic2_optim,
             tau,
             gamma,
@@ -66,6 +69,22 @@ class DiscreteSACPolicy_custom(SACPolicy):
             **kwargs
         )
         self._alpha: Union[float, torch.Tensor]
+        if critic2 is None:
+            self.critic2 = self.critic2_old = None
+
+    def train(self, mode: bool = True) -> "DiscreteSACPolicy_custom":
+        self.training = mode
+        self.actor.train(mode)
+        self.critic1.train(mode)
+        if self.critic2 is not None:
+            self.critic2.train(mode)
+        return self
+
+    def sync_weight(self) -> None:
+        if self.critic2 is None:
+            self.critic1_old.polyak_update_(self.critic1, self.tau)
+        else:
+            super().sync_weight()
 
     def forward(  # type: ignore
         self,
@@ -87,19 +106,40 @@ class DiscreteSACPolicy_custom(SACPolicy):
         
         return Batch(logits=logits, act=act, state=hidden, dist=dist, not_done_mask=not_done_mask)
 
+    def _critic_inputs(self, obs) -> Dict[str, torch.Tensor]:
+        # critics that build their input features themselves (V_Estimator) share them, as all critics see the same obs
+        build_input = getattr(self.critic1, 'build_input', None)
+        return {} if build_input is None else {'inputs': build_input(obs)}
+
+    def _critic_values(
+        self, critic1: torch.nn.Module, critic2: Optional[torch.nn.Module], obs: Batch,
+        critic_inputs: Dict[str, torch.Tensor]
+    ) -> torch.Tensor:
+        """Q-values of all critics stacked, (n_critics, batch_size, n_actions)."""
+        if critic2 is None:
+            return critic1(obs, **critic_inputs)
+        return torch.stack((critic1(obs, **critic_inputs), critic2(obs, **critic_inputs)))
+
     def _target_q(self, buffer: ReplayBuffer, indices: np.ndarray) -> torch.Tensor:
         batch = buffer[indices]  # batch.obs: s_{t+n}
-        obs_next_result = self(batch, input="obs_next", are_next_obs=True)
-        dist = obs_next_result.dist
 
-        target_q = torch.zeros(len(batch), device=obs_next_result.logits.device)
-        not_done_targets = dist.probs * torch.min(
-            self.critic1_old(batch.obs_next),
-            self.critic2_old(batch.obs_next),
-        )[obs_next_result.not_done_mask]
+        # values of terminal states are zero, so only the remaining rows are passed through the networks
+        not_done_mask = np.logical_not(batch.done)
+        target_q = torch.zeros(len(batch), device=next(self.actor.parameters()).device)
+        if not not_done_mask.any():
+            return target_q
+
+        obs_next = batch.obs_next[not_done_mask]
+        logits, _ = self.actor(obs_next)
+        dist = Categorical(logits=logits)
+
+        critic_inputs = self._critic_inputs(obs_next)
+        not_done_targets = dist.probs * self._critic_values(
+            self.critic1_old, self.critic2_old, obs_next, critic_inputs
+        ).amin(dim=0)
 
         not_done_targets = not_done_targets.sum(dim=-1) + self._alpha * dist.entropy()
-        target_q[obs_next_result.not_done_mask] = not_done_targets
+        target_q[torch.as_tensor(not_done_mask, device=target_q.device)] = not_done_targets
 
         return target_q
 
@@ -110,32 +150,27 @@ class DiscreteSACPolicy_custom(SACPolicy):
             batch.act[:, np.newaxis], device=target_q.device, dtype=torch.long
         )
 
-        # critic 1
-        current_q1 = self.critic1(batch.obs).gather(1, act).flatten()
-        td1 = current_q1 - target_q
-        critic1_loss = (td1.pow(2) * weight).mean()
+        # critics, the losses are independent, so a single backward pass computes the gradients of all of them
+        critic_inputs = self._critic_inputs(batch.obs)
+        current_q = self._critic_values(self.critic1, self.critic2, batch.obs, critic_inputs)
+
+        td = current_q.gather(2, act.expand(len(current_q), -1, -1)).squeeze(-1) - target_q
+        critic_losses = (td.pow(2) * weight).mean(dim=-1)
 
         self.critic1_optim.zero_grad()
-        critic1_loss.backward()
+        if self.critic2_optim is not None:
+            self.critic2_optim.zero_grad()
+        critic_losses.sum().backward()
         self.critic1_optim.step()
+        if self.critic2_optim is not None:
+            self.critic2_optim.step()
+        batch.weight = td.mean(dim=0)  # prio-buffer
 
-        # critic 2
-        current_q2 = self.critic2(batch.obs).gather(1, act).flatten()
-        td2 = current_q2 - target_q
-        critic2_loss = (td2.pow(2) * weight).mean()
-
-        self.critic2_optim.zero_grad()
-        critic2_loss.backward()
-        self.critic2_optim.step()
-        batch.weight = (td1 + td2) / 2.0  # prio-buffer
-
-        # actor
+        # actor, using the Q-values of the critic forward pass above, i.e. of the critics before their optimizer step
+        # rather than after it
         dist = self(batch).dist
         entropy = dist.entropy()
-        with torch.no_grad():
-            current_q1a = self.critic1(batch.obs)
-            current_q2a = self.critic2(batch.obs)
-            q = torch.min(current_q1a, current_q2a)
+        q = current_q.amin(dim=0).detach()
         actor_loss = -(self._alpha * entropy + (dist.probs * q).sum(dim=-1)).mean()
         self.actor_optim.zero_grad()
         actor_loss.backward()
@@ -153,8 +188,7 @@ class DiscreteSACPolicy_custom(SACPolicy):
 
         result = {
             "loss/actor": actor_loss.item(),
-            "loss/critic1": critic1_loss.item(),
-            "loss/critic2": critic2_loss.item(),
+            **{f"loss/critic{i + 1}": loss.item() for i, loss in enumerate(critic_losses)},
         }
         if self._is_auto_alpha:
             result["loss/alpha"] = alpha_loss.item()
@@ -0,0 +1,56 @@
+import numpy as np
+
+from tianshou.data import VectorReplayBuffer
+
+
+class EpisodeGroupedVectorReplayBuffer(VectorReplayBuffer):
+    """VectorReplayBuffer whose minibatches consist of groups of transitions of the same episode.
+
+    Each group is drawn by sampling a transition uniformly (as VectorReplayBuffer does) and adding group_size - 1
+    other transitions of its episode, without replacement as long as the episode is long enough. Minibatches then
+    hold about batch_size / group_size instead of up to batch_size different instances, which networks with
+    group_instances encode only once, trading sample diversity for encoder throughput.
+    :param int group_size: transitions per episode in a minibatch, 1 for uniform sampling. Default to 1.
+    """
+
+    def __init__(self, total_size: int, buffer_num: int, group_size: int = 1, **kwargs) -> None:
+        super().__init__(total_size, buffer_num, **kwargs)
+        self.group_size = group_size
+
+    def episode_indices(self, index: np.ndarray) -> np.ndarray:
+        """Indices of the (stored part of the) episodes of the transitions, (len(index), longest episode length),
+        padded with -1."""
+        start = np.asarray(index)
+        while True:
+            prev = self.prev(start)
+            if np.array_equal(prev, start):
+                break
+            start = prev
+
+        episodes, current = [start], start
+        while True:
+            # next returns the index itself at the end of an episode
+            following = self.next(current)
+            ongoing = following != current
+            if not ongoing.any():
+                break
+            episodes.append(np.where(ongoing & (episodes[-1] >= 0), following, -1))
+            current = following
+        return np.stack(episodes, axis=1)
+
+    def sample_indices(self, batch_size: int) -> np.ndarray:
+        if self.group_size <= 1 or batch_size <= 0:
+            return super().sample_indices(batch_size)
+
+        n_groups = -(-batch_size // self.group_size)
+        episodes = self.episode_indices(super().sample_indices(n_groups))
+        if episodes.shape[1] < self.group_size:
+            episodes = np.pad(episodes, ((0, 0), (0, self.group_size - episodes.shape[1])), constant_values=-1)
+        lengths = (episodes >= 0).sum(axis=1, keepdims=True)
+
+        # random permutations of the steps of each episode, steps beyond its length are drawn with replacement
+        keys = np.where(episodes >= 0, np.random.rand(*episodes.shape), np.inf)
+        positions = np.argsort(keys, axis=1)[:, :self.group_size]
+        positions = np.where(positions < lengths, positions,
+                             (np.random.rand(*positions.shape) * lengths).astype(int))
+        return np.take_along_axis(episodes, positions, axis=1).flatten()[:batch_size]
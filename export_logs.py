@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+
+import argparse
+import time
+
+from utils.metrics_store import MetricsStore
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incrementally exports the scalars of the TensorBoard event files in a "
+                                                 "log directory to a columnar metrics store and csvs")
+    parser.add_argument('--log_dir', default='log_dir', help="Directory with one subdirectory of event files per run")
+    parser.add_argument('--csv_dir', default=None, help="Where to write the csvs, defaults to <log_dir>/csvs")
+    parser.add_argument('--no_csvs', action='store_true', help="Only update the metrics store")
+    parser.add_argument('--processes', type=int, default=None, help="Number of processes parsing event files, defaults to the number of CPUs")
+    opts = parser.parse_args()
+
+    t0 = time.time()
+    store = MetricsStore(opts.log_dir)
+    updated_runs = store.update(processes=opts.processes)
+    if not opts.no_csvs:
+        store.write_csvs(updated_runs, opts.csv_dir)
+    print(f"Exported new scalars of {len(updated_runs)} runs in {time.time() - t0:.2f}s, "
+          f"{len(store.columns['value'])} scalars of {len(store.run_names)} runs in {store.path}")
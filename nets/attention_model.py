@@ -4,7 +4,7 @@ from torch.utils.checkpoint import checkpoint
 import math
 from typing import NamedTuple
 
-from nets.graph_encoder import GraphAttentionEncoder
+from nets.graph_encoder import GraphAttentionEncoder, node_coords, instance_index, mask_value
 from torch.nn import DataParallel
 from utils.functions import sample_many
 
@@ -21,6 +21,10 @@ class AttentionModelFixed(NamedTuple):
     glimpse_key: torch.Tensor
     glimpse_val: torch.Tensor
     logit_key: torch.Tensor
+    knn: torch.Tensor = None  # (batch_size, graph_size, k) decoding candidates of each node, see knn_candidates
+    # (batch_size, graph_size, n_slots, embed_dim) step context projections of the nodes, with the decoder projections
+    # folded into the precomputation (see _fold_projections), in which case logit_key is multiplied by project_out
+    step_context_nodes: torch.Tensor = None
 
     def __getitem__(self, key):
         assert torch.is_tensor(key) or isinstance(key, slice)
@@ -29,7 +33,9 @@ class AttentionModelFixed(NamedTuple):
             context_node_projected=self.context_node_projected[key],
             glimpse_key=self.glimpse_key[:, key],  # dim 0 are the heads
             glimpse_val=self.glimpse_val[:, key],  # dim 0 are the heads
-            logit_key=self.logit_key[key]
+            logit_key=self.logit_key[key],
+            knn=self.knn[key] if self.knn is not None else None,
+            step_context_nodes=self.step_context_nodes[key] if self.step_context_nodes is not None else None
         )
 
 
@@ -45,7 +51,16 @@ class AttentionModel(nn.Module):
                  mask_inner=True,
                  mask_logits=True,
                  normalization='batch',
-                 n_heads=8):
+                 n_heads=8,
+                 debug_checks=False,
+                 knn_candidates=0,
+                 encoder_knn=0,
+                 encoder_global_tokens=0,
+                 checkpoint_encoder=0,
+                 group_instances=False,
+                 skip_forced_moves=False,
+                 compact_every=0,
+                 fold_projections=False):
         super(AttentionModel, self).__init__()
 
         self.embedding_dim = embedding_dim
@@ -62,6 +77,22 @@ class AttentionModel(nn.Module):
 
         self.mask_inner = mask_inner
         self.mask_logits = mask_logits
+        # NaN/visited asserts force a host sync per decoding step, only for debugging
+        self.debug_checks = debug_checks
+        # decode over the k nearest neighbours of the current node only, 0 for all nodes
+        self.knn_candidates = knn_candidates
+        # encode the rows of the same instance (e.g. the steps of an episode in a learner batch) only once
+        self.group_instances = group_instances
+        # rows with a single feasible action get it without running the network, not for Q-value outputs (DQN)
+        self.skip_forced_moves = skip_forced_moves
+        # tensor rollouts (utils.rollout) restrict the decoder keys to the feasible nodes every this many steps, 0 never
+        self.compact_every = compact_every
+        # tensor rollouts fold the step context and output projections of the decoder into the precomputed node data
+        self.fold_projections = fold_projections
+        # with critics sharing the encoder, the embeddings of an observation are computed only once per update (see
+        # create_critic), the policy clears the cache after each update
+        self.cache_encoding = False
+        self._encoding_cache = []
 
         self.problem = problem
         self.n_heads = n_heads
@@ -96,7 +127,10 @@ class AttentionModel(nn.Module):
             n_heads=n_heads,
             embed_dim=embedding_dim,
             n_layers=self.n_encode_layers,
-            normalization=normalization
+            normalization=normalization,
+            knn_neighbours=encoder_knn,
+            n_global_tokens=encoder_global_tokens,
+            checkpoint_layers=checkpoint_encoder
         )
 
         # For each node we compute (glimpse key, glimpse value, logit key) so 3 * embedding_dim
@@ -110,20 +144,130 @@ class AttentionModel(nn.Module):
     
 
 
+    def __getstate__(self):
+        # copies (e.g. target networks and baselines made with deepcopy) start with an empty cache, the cached
+        # encodings are not graph leaves and can't be copied
+        state = self.__dict__.copy()
+        state['_encoding_cache'] = []
+        return state
+
+    def clear_encoding_cache(self):
+        """Drops the cached encodings, together with the autograd graph of the update they hold"""
+        self._encoding_cache = []
+
     def encode(self, obs, state=None, info=None):
-        embeddings, _ = self.embedder(self._init_embed(obs))
-        return embeddings
+        embeddings, inverse, _ = self._encode_instances(obs)
+        return embeddings if inverse is None else embeddings[inverse]
+
+    def encode_with_candidates(self, obs):
+        """
+        Node embeddings of the rows of the observations together with their decoding candidates (None without
+        knn_candidates), to pass both to decode in all steps of the same instances
+
+        :return: embeddings (batch_size, graph_size, embed_dim), candidates (batch_size, graph_size, k) or None
+        """
+        embeddings, inverse, knn = self._encode_instances(obs)
+        if inverse is None:
+            return embeddings, knn
+        return embeddings[inverse], knn[inverse] if knn is not None else None
 
-    def decode(self, obs, embeddings, state=None):
-        logits, mask = self._inner(obs, embeddings)
+    def _encode_instances(self, obs):
+        """
+        Node embeddings and decoding candidates of the instances of the observations, with group_instances only of
+        the unique instances
+
+        :return: embeddings (n_instances, graph_size, embed_dim), decoding candidates (n_instances, graph_size, k) or
+            None without knn_candidates, instance of each row (batch_size,) or None if the embeddings are per row
+        """
+        if not self.cache_encoding:
+            return self._embed_instances(obs)
+
+        # the same obs tensors are passed to actor and critics within an update, the key is invalidated by
+        # in-place changes of the inputs, optimizer steps on the parameters, and changes of the grad or train mode
+        loc = obs['loc']
+        key = (loc._version, sum(param._version for param in self.parameters()), torch.is_grad_enabled(), self.training)
+        for cached_loc, cached_key, encoding in self._encoding_cache:
+            if cached_loc is loc and cached_key == key:
+                return encoding
+
+        encoding = self._embed_instances(obs)
+        # keep the obs and next obs of the current batch
+        self._encoding_cache = [(loc, key, encoding)] + self._encoding_cache[:1]
+        return encoding
+
+    def _embed_instances(self, obs):
+        init_embed, coords = self._init_embed(obs), node_coords(obs, self.is_orienteering)
+        rows, inverse = self._instance_index(obs) if self.group_instances else (None, None)
+        if rows is not None:
+            init_embed, coords = init_embed[rows], coords[rows]
+        embeddings, _ = self.embedder(init_embed, coords=coords)
+        # the candidates only depend on the coordinates, they are computed once per instance like the embeddings
+        knn = self._knn_index(coords) if self.knn_candidates > 0 else None
+        return embeddings, inverse, knn
+
+    def _instance_index(self, obs):
+        # the node features the encoder sees, see _init_embed
+        features = [obs['loc']]
+        if self.is_vrp or self.is_orienteering or self.is_pctsp:
+            features += [obs['depot']] + [obs[feat] for feat in self._node_features()]
+        return instance_index(torch.cat([feature.reshape(feature.size(0), -1) for feature in features], 1))
+
+    def decode(self, obs, embeddings, state=None, inverse=None, knn=None):
+        """
+        :param knn: decoding candidates of the instances of the embeddings, see encode_with_candidates. With
+            knn_candidates, they are computed from obs if not given
+        """
+        if self.skip_forced_moves:
+            rows = self._unforced_rows(obs)
+            if rows is not None:
+                if inverse is not None:
+                    inverse = inverse[rows]
+                else:
+                    embeddings = embeddings[rows]
+                    knn = knn[rows] if knn is not None else None
+                row_logits = self._decode(self._select_rows(obs, rows), embeddings, inverse, knn) \
+                    if len(rows) > 0 else None
+                return self._with_forced_moves(obs, rows, row_logits), state
+        return self._decode(obs, embeddings, inverse, knn), state
+
+    def _decode(self, obs, embeddings, inverse=None, knn=None):
+        logits, mask = self._inner(obs, embeddings, inverse, knn)
         
         if self.output_probs:
-            probs = nn.functional.softmax(logits.squeeze(), dim=1)
-            return probs, state
+            return nn.functional.softmax(logits.squeeze(), dim=1)
 
-        logits = logits.view(obs['loc'].shape[0], -1)
+        return logits.view(obs['loc'].shape[0], -1)
 
-        return logits, state # next hidden state
+    def _unforced_rows(self, obs):
+        """
+        Rows of the observations with more than one (or no) feasible action, None if there is no forced row
+        """
+        mask = obs['action_mask']
+        forced = (~mask).view(mask.size(0), -1).sum(-1) == 1
+        if not forced.any():
+            return None
+        return (~forced).nonzero()[:, 0]
+
+    def _with_forced_moves(self, obs, rows, row_logits):
+        """
+        Logits (or probabilities) of all rows, those of rows computed by the network and in all other rows the logits
+        of a distribution that selects their only feasible action
+        """
+        mask = obs['action_mask']
+        feasible = ~mask.view(mask.size(0), -1)
+        if self.output_probs:
+            outputs = feasible.float()
+        else:
+            outputs = torch.full(feasible.size(), mask_value(torch.float32), device=mask.device).masked_fill(feasible, 0)
+        if row_logits is None:
+            return outputs
+        return outputs.index_put((rows,), row_logits.to(outputs.dtype))
+
+    @staticmethod
+    def _select_rows(obs, rows):
+        if isinstance(obs, dict):
+            return {key: value[rows] for key, value in obs.items()}
+        return obs[rows]  # tianshou Batch
 
     # will only be used for STE as this will receive embeddings for first_a and prev_a instead of indices
     def decode_STE(self, obs, embeddings, state=None):
@@ -143,20 +287,34 @@ class AttentionModel(nn.Module):
         :param input: state_tsp with batch dimension
         :return:
         """
-        embeddings = self.encode(obs, state, info)
-        return self.decode(obs, embeddings, state)
-
+        if self.skip_forced_moves and not self.cache_encoding:
+            rows = self._unforced_rows(obs)
+            if rows is not None:
+                row_logits = self._forward(self._select_rows(obs, rows)) if len(rows) > 0 else None
+                return self._with_forced_moves(obs, rows, row_logits), state
+            return self._forward(obs), state
+        # critics sharing the encoder get the encoding of all rows, so only the decoder skips forced moves
+        embeddings, inverse, knn = self._encode_instances(obs)
+        return self.decode(obs, embeddings, state, inverse, knn)
+
+    def _forward(self, obs):
+        embeddings, inverse, knn = self._encode_instances(obs)
+        return self._decode(obs, embeddings, inverse, knn)
+
+
+    def _node_features(self):
+        # node features embedded in addition to the coordinates, for the problems with a depot
+        if self.is_vrp:
+            return ('demand', )
+        elif self.is_orienteering:
+            return ('prize', )
+        assert self.is_pctsp
+        return ('deterministic_prize', 'penalty')
 
     def _init_embed(self, input):
 
         if self.is_vrp or self.is_orienteering or self.is_pctsp:
-            if self.is_vrp:
-                features = ('demand', )
-            elif self.is_orienteering:
-                features = ('prize', )
-            else:
-                assert self.is_pctsp
-                features = ('deterministic_prize', 'penalty')
+            features = self._node_features()
             return torch.cat(
                 (
                     self.init_embed_depot(input['depot'])[:, None, :],
@@ -170,12 +328,19 @@ class AttentionModel(nn.Module):
         # TSP
         return self.init_embed(input['loc'])
 
-    def _inner(self, obs, embeddings):
+    def _inner(self, obs, embeddings, inverse=None, knn=None):
         # Compute keys, values for the glimpse and keys for the logits once as they can be reused in every step
-        fixed = self._precompute(embeddings)
+        fixed = self._precompute(embeddings, knn=knn)
+        if inverse is not None:
+            # embeddings of the unique instances, the projections are computed once per instance as well
+            fixed = fixed[inverse]
+        if self.knn_candidates > 0 and fixed.knn is None:
+            # decoding candidates that were not computed with the encoding
+            fixed = fixed._replace(knn=self._knn_index(node_coords(obs, self.is_orienteering)))
 
         # Perform single decoding step
-        assert(not torch.all(obs['visited']))
+        if self.debug_checks:
+            assert(not torch.all(obs['visited']))
         logits, mask = self._get_logits(fixed, obs)
 
         return logits, mask
@@ -185,7 +350,8 @@ class AttentionModel(nn.Module):
         fixed = self._precompute(embeddings)
 
         # Perform single decoding step
-        assert(not torch.all(obs['visited']))
+        if self.debug_checks:
+            assert(not torch.all(obs['visited']))
         logits, mask = self._get_logits_STE(fixed, obs)
 
         return logits, mask
@@ -200,12 +366,12 @@ class AttentionModel(nn.Module):
         return sample_many(
             lambda input: self._inner(*input),  # Need to unpack tuple into arguments
             lambda input, pi: self.problem.get_costs(input[0], pi),  # Don't need embeddings as input to get_costs
-            (input, self.embedder(self._init_embed(input))[0]),  # Pack input with embeddings (additional input)
+            (input, self.embedder(self._init_embed(input), coords=node_coords(input, self.is_orienteering))[0]),  # Pack input with embeddings (additional input)
             batch_rep, iter_rep
         )
 
 
-    def _precompute(self, embeddings, num_steps=1):
+    def _precompute(self, embeddings, num_steps=1, knn=None, fold_projections=False):
         # The fixed context projection of the graph embedding is calculated only once for efficiency
         graph_embed = embeddings.mean(1)
         # fixed context = (batch_size, 1, embed_dim) to make broadcastable with parallel timesteps
@@ -221,7 +387,72 @@ class AttentionModel(nn.Module):
             self._make_heads(glimpse_val_fixed, num_steps),
             logit_key_fixed.contiguous()
         )
-        return AttentionModelFixed(embeddings, fixed_context, *fixed_attention_node_data)
+        fixed = AttentionModelFixed(embeddings, fixed_context, *fixed_attention_node_data, knn=knn)
+        # dynamic int8 quantized layers (see quantize_for_inference) also quantize their inputs, they are not folded
+        if fold_projections and isinstance(self.project_out, nn.Linear) \
+                and isinstance(self.project_step_context, nn.Linear):
+            return self._fold_projections(fixed)
+        return fixed
+
+    def _fold_projections(self, fixed):
+        """
+        Folds the linear projections of the decoder steps into the precomputed node data, which pays off when the same
+        precomputation is used for many steps (tensor rollouts). project_step_context of the concatenated context node
+        embeddings is the sum of the projections of the single embeddings, so they are projected once per node and a
+        step gathers and adds them. As glimpse . k = (heads W_out^T) . k = heads . (k W_out), project_out is
+        multiplied into the logit keys and the logits are computed from the attention heads directly.
+        The results are the same up to floating point rounding.
+        """
+        assert not (self.is_vrp or self.is_pctsp), "Folded projections are only supported for the TSP and OP"
+        embed_dim = fixed.node_embeddings.size(-1)
+        weight = self.project_step_context.weight  # (embed_dim, step_context_dim)
+        # the embedding slots of the step context: first and current node (TSP) or current node (OP)
+        n_slots = weight.size(1) // embed_dim
+        step_context_nodes = torch.einsum(
+            'bni,osi->bnso', fixed.node_embeddings, weight[:, :n_slots * embed_dim].view(-1, n_slots, embed_dim))
+        return fixed._replace(
+            step_context_nodes=step_context_nodes,
+            logit_key=torch.matmul(fixed.logit_key, self.project_out.weight)
+        )
+
+    def _folded_step_context(self, fixed, obs):
+        """
+        project_step_context of the step context from the projections of _fold_projections
+
+        :return: (batch_size, 1, embed_dim)
+        """
+        nodes = fixed.step_context_nodes
+        batch_size = nodes.size(0)
+        weight = self.project_step_context.weight
+        batch = torch.arange(batch_size, device=nodes.device)
+        current_node = obs['prev_a'].view(batch_size).long().clamp(min=0)
+        if self.is_orienteering:
+            remaining_length = obs['remaining_length'].view(batch_size, 1).to(nodes.dtype)
+            context = nodes[batch, current_node, 0] + remaining_length * weight[:, -1]
+        else:  # TSP
+            first_node = obs['first_a'].view(batch_size).long().clamp(min=0)
+            context = nodes[batch, first_node, 0] + nodes[batch, current_node, 1]
+            progress = torch.sum(obs['visited'], dim=1).view(batch_size, 1)
+            context = torch.where(progress == 0, torch.matmul(weight, self.W_placeholder), context)
+        return context[:, None, :]
+
+    @torch.no_grad()
+    def _knn_index(self, coords):
+        """
+        Decoding candidates of each node: the indices of its knn_candidates nearest other nodes.
+        For the OP the depot is node 0 and always the first candidate, so tours can always be ended.
+
+        :param coords: (batch_size, graph_size, 2) node coordinates, see node_coords
+        :return: (batch_size, graph_size, k)
+        """
+        coords = coords.float()
+        dist = torch.cdist(coords, coords)
+        dist.diagonal(dim1=1, dim2=2).fill_(math.inf)
+        k = self.knn_candidates
+        if self.is_orienteering:
+            dist[:, :, 0] = -1
+            k += 1
+        return dist.topk(min(k, coords.size(1)), dim=-1, largest=False)[1]
 
     def _get_logits_topk(self, fixed, state, k=None):
         logits, _ = self._get_logits(fixed, state)
@@ -239,8 +470,12 @@ class AttentionModel(nn.Module):
     def _get_logits(self, fixed, obs):
 
         # Compute query = context node embedding
-        query = fixed.context_node_projected + \
-                self.project_step_context(self._get_parallel_step_context(fixed.node_embeddings, obs))
+        folded = fixed.step_context_nodes is not None
+        if folded:
+            query = fixed.context_node_projected + self._folded_step_context(fixed, obs)
+        else:
+            query = fixed.context_node_projected + \
+                    self.project_step_context(self._get_parallel_step_context(fixed.node_embeddings, obs))
 
         # Compute keys and values for the nodes
         glimpse_K, glimpse_V, logit_K = self._get_attention_node_data(fixed, obs)
@@ -249,12 +484,51 @@ class AttentionModel(nn.Module):
         mask = obs['action_mask']
 
         # Compute logits (unnormalized logits)
-        logits, glimpse = self._one_to_many_logits(query, glimpse_K, glimpse_V, logit_K, mask)
+        if fixed.knn is not None:
+            logits, glimpse = self._candidate_logits(fixed.knn, obs, query, glimpse_K, glimpse_V, logit_K, mask, folded)
+        else:
+            logits, glimpse = self._one_to_many_logits(query, glimpse_K, glimpse_V, logit_K, mask, folded)
 
-        assert not torch.isnan(logits).any()
+        if self.debug_checks:
+            assert not torch.isnan(logits).any()
 
         return logits, mask
 
+    def _candidate_logits(self, knn, obs, query, glimpse_K, glimpse_V, logit_K, mask, folded=False):
+        """
+        Glimpse and logits over the decoding candidates of the current node only, all other nodes get the logits of
+        masked nodes. Rows without a current node (first TSP step) or with all candidates masked use all nodes.
+        """
+        batch_size, num_steps, graph_size = mask.size()
+        assert num_steps == 1, "Candidate decoding is only supported for single steps"
+        current_node = obs['prev_a'].view(batch_size).long()
+        k = knn.size(-1)
+
+        # (batch_size, 1, k)
+        candidates = knn.gather(1, current_node.clamp(min=0)[:, None, None].expand(batch_size, 1, k))
+        candidate_mask = mask.gather(-1, candidates)
+        logits, glimpse = self._one_to_many_logits(
+            query,
+            glimpse_K.gather(3, candidates[None, :, :, :, None].expand(*glimpse_K.size()[:3], k, glimpse_K.size(-1))),
+            glimpse_V.gather(3, candidates[None, :, :, :, None].expand(*glimpse_V.size()[:3], k, glimpse_V.size(-1))),
+            logit_K.gather(2, candidates[:, :, :, None].expand(*logit_K.size()[:2], k, logit_K.size(-1))),
+            candidate_mask,
+            folded
+        )
+        logits = logits.new_full((batch_size, num_steps, graph_size), mask_value(logits.dtype)) \
+            .scatter(-1, candidates, logits)
+
+        fallback = candidate_mask.view(batch_size, k).all(-1)
+        if not self.is_orienteering:
+            fallback = fallback | (obs['visited'].view(batch_size, -1).sum(-1) == 0)
+        rows = fallback.nonzero()[:, 0]
+        if len(rows) > 0:
+            full_logits, full_glimpse = self._one_to_many_logits(
+                query[rows], glimpse_K[:, rows], glimpse_V[:, rows], logit_K[rows], mask[rows], folded)
+            logits = logits.index_put((rows,), full_logits)
+            glimpse = glimpse.index_put((rows,), full_glimpse.to(glimpse.dtype))
+        return logits, glimpse
+
     def _get_logits_STE(self, fixed, obs):
 
         # Compute query = context node embedding
@@ -270,7 +544,8 @@ class AttentionModel(nn.Module):
         # Compute logits (unnormalized logits)
         logits, glimpse = self._one_to_many_logits(query, glimpse_K, glimpse_V, logit_K, mask)
 
-        assert not torch.isnan(logits).any()
+        if self.debug_checks:
+            assert not torch.isnan(logits).any()
 
         return logits, mask
 
@@ -340,8 +615,7 @@ class AttentionModel(nn.Module):
             # need to create context for each sample individually
             placeholders = self.W_placeholder[None, None, :].view(1, -1).expand(batch_size, self.W_placeholder.size(-1))
 
-            indices = torch.cat((first_a, current_node), 1)[:, :, None]
-            indices[indices < 0] = 0
+            indices = torch.cat((first_a, current_node), 1)[:, :, None].clamp(min=0)
             indices = indices.expand(batch_size, 2, embeddings.size(-1))
             # indices have shape (batch_size, 2, embeddings_size) and embeddings (batch_size, #nodes, embedding_size); this way I can gather whole vectors
             values = embeddings.gather(1, indices).view(batch_size, -1)
@@ -381,7 +655,11 @@ class AttentionModel(nn.Module):
 
         return contexts
 
-    def _one_to_many_logits(self, query, glimpse_K, glimpse_V, logit_K, mask):
+    def _one_to_many_logits(self, query, glimpse_K, glimpse_V, logit_K, mask, folded=False):
+        """
+        With folded, logit_K holds the logit keys multiplied by project_out (see _fold_projections) and the attention
+        heads take the place of the glimpse
+        """
         batch_size, num_steps, embed_dim = query.size()
         key_size = val_size = embed_dim // self.n_heads
 
@@ -389,33 +667,34 @@ class AttentionModel(nn.Module):
         glimpse_Q = query.view(batch_size, num_steps, self.n_heads, 1, key_size).permute(2, 0, 1, 3, 4)
 
         # Batch matrix multiplication to compute compatibilities (n_heads, batch_size, num_steps, graph_size)
-        compatibility = torch.matmul(glimpse_Q, glimpse_K.transpose(-2, -1)) / math.sqrt(glimpse_Q.size(-1))
+        # Masking and softmax are done in fp32 under autocast. Masked entries get a constant instead of an offset from
+        # the batch minimum, so no reduction couples the instances of the batch
+        compatibility = (torch.matmul(glimpse_Q, glimpse_K.transpose(-2, -1)) / math.sqrt(glimpse_Q.size(-1))).float()
 
         if self.mask_inner:
             assert self.mask_logits, "Cannot mask inner without masking logits"
-            min_comp_value = torch.min(compatibility).detach() # detach cuz cant backpropagate here through mask
-            compatibility[mask[None, :, :, None, :].expand_as(compatibility)] = min_comp_value-1_000_000 # -math.inf #min_comp_value-1_000_000
+            compatibility = compatibility.masked_fill(mask[None, :, :, None, :].expand_as(compatibility), mask_value(compatibility.dtype))
 
         # Batch matrix multiplication to compute heads (n_heads, batch_size, num_steps, val_size)
         heads = torch.matmul(torch.softmax(compatibility, dim=-1), glimpse_V)
 
         # Project to get glimpse/updated context node embedding (batch_size, num_steps, embedding_dim)
-        glimpse = self.project_out(
-            heads.permute(1, 2, 3, 0, 4).contiguous().view(-1, num_steps, 1, self.n_heads * val_size))
+        glimpse = heads.permute(1, 2, 3, 0, 4).contiguous().view(-1, num_steps, 1, self.n_heads * val_size)
+        if not folded:
+            glimpse = self.project_out(glimpse)
 
         # Now projecting the g nce this can be absorbed into project_out
         # final_Q = self.project_glimpse(glimpse)
         final_Q = glimpse
         # Batch matrix multiplication to compute logits (batch_size, num_steps, graph_size)
         # logits = 'compatibility'
-        logits = torch.matmul(final_Q, logit_K.transpose(-2, -1)).squeeze(-2) / math.sqrt(final_Q.size(-1))
+        logits = (torch.matmul(final_Q, logit_K.transpose(-2, -1)).squeeze(-2) / math.sqrt(final_Q.size(-1))).float()
 
         # From the logits compute the probabilities by clipping, masking and softmax
         if self.tanh_clipping > 0:
             logits = torch.tanh(logits) * self.tanh_clipping
         if self.mask_logits:
-            min_logits_value = torch.min(logits).detach() # detach cuz cant backpropagate here through mask
-            logits[mask] = min_comp_value-1_000_000 # -math.inf #min_logits_value-1_000_000
+            logits = logits.masked_fill(mask, mask_value(logits.dtype))
             # can't mask with -inf as tianshou might input observations of done envs where all entries would become -inf
             # this might then fail at some softmax or gradients will become too high at some point
 
@@ -0,0 +1,89 @@
+import copy
+
+import torch
+from torch import nn
+from torch.func import stack_module_state, functional_call, vmap
+
+
+def _stacked_name(name):
+    # parameter names of nn.Module can't contain dots
+    return name.replace('.', '__')
+
+
+class CriticEnsemble(nn.Module):
+    """
+    K structurally identical critics with their parameters stacked along a leading dimension, evaluated in one
+    vectorized pass (torch.func.vmap over functional_call of a parameterless copy of the first critic).
+    Returns the outputs of all critics stacked, (n_critics, batch_size, ...).
+    """
+
+    def __init__(self, critics):
+        super(CriticEnsemble, self).__init__()
+
+        self.n_critics = len(critics)
+        params, buffers = stack_module_state(critics)
+        self._param_names = list(params.keys())
+        self._buffer_names = list(buffers.keys())
+        for name, param in params.items():
+            self.register_parameter(_stacked_name(name), nn.Parameter(param))
+        for name, buffer in buffers.items():
+            self.register_buffer(_stacked_name(name), buffer)
+
+        # only used for its forward function, the weights are given by the stacked parameters.
+        # Data dependent asserts can't run inside vmap
+        base = copy.deepcopy(critics[0]).to('meta')
+        base.debug_checks = False
+        object.__setattr__(self, '_base', base)  # not registered, so it is neither in parameters() nor the state dict
+
+    @property
+    def build_input(self):
+        # critics that build their own input features share them across the ensemble
+        return self._base.build_input
+
+    def train(self, mode=True):
+        self._base.train(mode)
+        return super(CriticEnsemble, self).train(mode)
+
+    def forward(self, obs, state=None, info=None, **kwargs):
+        params = {name: getattr(self, _stacked_name(name)) for name in self._param_names}
+        buffers = {name: getattr(self, _stacked_name(name)) for name in self._buffer_names}
+
+        def critic_forward(params, buffers):
+            return functional_call(self._base, (params, buffers), (obs,), kwargs)
+
+        return vmap(critic_forward, randomness='different')(params, buffers)
+
+    @torch.no_grad()
+    def polyak_update_(self, source, tau):
+        """
+        Moves the parameters of this (target) ensemble towards the parameters of source by tau. Only parameters are
+        moved, buffers (the running statistics of batch normalization) keep their values, as in tianshou's
+        soft_update of separate target critics
+        """
+        for target_param, param in zip(self.parameters(), source.parameters()):
+            target_param.lerp_(param, tau)
+
+
+def stack_critic_state_dicts(state_dicts):
+    """
+    Converts the state dicts of separate critics into the state dict of a CriticEnsemble of them
+    """
+    return {
+        _stacked_name(name): torch.stack([state_dict[name] for state_dict in state_dicts])
+        for name in state_dicts[0]
+    }
+
+
+def convert_twin_critics_state_dict(policy_state_dict):
+    """
+    Converts a SAC policy checkpoint with separate critic1/critic2 (and target) modules
+    into a checkpoint of a policy whose critic1 is a CriticEnsemble of both and critic2 is None
+    """
+    def critic_state_dict(prefix):
+        return {name[len(prefix):]: value for name, value in policy_state_dict.items() if name.startswith(prefix)}
+
+    converted = {name: value for name, value in policy_state_dict.items() if not name.startswith(('critic1', 'critic2'))}
+    for suffix in ('', '_old'):
+        stacked = stack_critic_state_dicts([critic_state_dict(f'critic1{suffix}.'), critic_state_dict(f'critic2{suffix}.')])
+        converted.update({f'critic1{suffix}.{name}': value for name, value in stacked.items()})
+    return converted
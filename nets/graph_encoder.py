@@ -1,6 +1,7 @@
 import torch
 import numpy as np
 from torch import nn
+from torch.utils.checkpoint import checkpoint
 import math
 
 
@@ -10,8 +11,131 @@ class SkipConnection(nn.Module):
         super(SkipConnection, self).__init__()
         self.module = module
 
-    def forward(self, input):
-        return input + self.module(input)
+    def forward(self, input, **kwargs):
+        return input + self.module(input, **kwargs)
+
+
+def node_coords(obs, is_orienteering):
+    """
+    Coordinates of the nodes of observations in the order of the node embeddings, i.e. with the depot first for the OP
+
+    :return: (batch_size, graph_size (+1 for the depot), 2)
+    """
+    if is_orienteering:
+        return torch.cat((obs['depot'][:, None, :], obs['loc']), 1)
+    return obs['loc']
+
+
+def mask_value(dtype):
+    """
+    Value of masked compatibilities and logits: a constant far below all unmasked values, but finite and
+    representable in dtype, as rows in which everything is masked (observations of done envs) would become NaN with -inf
+    """
+    return max(-1e9, torch.finfo(dtype).min)
+
+
+@torch.no_grad()
+def instance_index(features):
+    """
+    Groups the rows of a batch by instance, i.e. by identical encoder input features
+
+    :param features: (batch_size, ...) encoder input features of each row
+    :return: first row of each instance (n_instances,) and instance of each row (batch_size,), both None if all
+        rows are different instances
+    """
+    features = features.reshape(features.size(0), -1)
+    _, inverse = torch.unique(features, dim=0, return_inverse=True)
+    n_instances = int(inverse.max()) + 1
+    if n_instances == features.size(0):
+        return None, None
+    rows = torch.arange(len(inverse), device=inverse.device)
+    first = inverse.new_full((n_instances,), len(inverse)).scatter_reduce_(0, inverse, rows, 'amin')
+    return first, inverse
+
+
+@torch.no_grad()
+def knn_graph(coords, k):
+    """
+    Indices of the k nearest nodes of each node, including the node itself
+
+    :param coords: (batch_size, graph_size, 2)
+    :return: (batch_size, graph_size, min(k, graph_size))
+    """
+    coords = coords.float()
+    return torch.cdist(coords, coords).topk(min(k, coords.size(1)), dim=-1, largest=False)[1]
+
+
+def sparse_attention_heads(Q, K, V, neighbours, norm_factor):
+    """
+    Attention of each query to its neighbours only. The keys and values of the neighbours are gathered, so time and
+    memory are O(n_query * k) instead of O(n_query * graph_size). Queries after the first neighbours.size(1) ones
+    (global tokens) attend to all nodes.
+
+    :param Q: queries (n_heads, batch_size, n_query, key_size)
+    :param K: keys (n_heads, batch_size, graph_size, key_size), V: values (n_heads, batch_size, graph_size, val_size)
+    :param neighbours: (batch_size, n_sparse, k) indices of the nodes that each of the first n_sparse queries attends to
+    :return: heads (n_heads, batch_size, n_query, val_size)
+    """
+    n_heads, batch_size, n_query, _ = Q.size()
+    _, n_sparse, k = neighbours.size()
+    index = neighbours.reshape(1, batch_size, n_sparse * k, 1)
+    # (n_heads, batch_size, n_sparse, k, key/val_size)
+    K_neighbours = K.gather(2, index.expand(n_heads, batch_size, n_sparse * k, K.size(-1))).view(n_heads, batch_size, n_sparse, k, -1)
+    V_neighbours = V.gather(2, index.expand(n_heads, batch_size, n_sparse * k, V.size(-1))).view(n_heads, batch_size, n_sparse, k, -1)
+
+    # (n_heads, batch_size, n_sparse, k)
+    compatibility = norm_factor * torch.matmul(K_neighbours, Q[:, :, :n_sparse, :, None]).squeeze(-1)
+    heads = torch.matmul(torch.softmax(compatibility, dim=-1)[:, :, :, None, :], V_neighbours).squeeze(-2)
+
+    if n_sparse < n_query:
+        attn = torch.softmax(norm_factor * torch.matmul(Q[:, :, n_sparse:], K.transpose(2, 3)), dim=-1)
+        heads = torch.cat((heads, torch.matmul(attn, V)), 2)
+    return heads
+
+
+def chunked_attention_heads(Q, K, V, norm_factor, memory_budget):
+    """
+    Dense attention computed in blocks of queries and keys, so that the compatibilities of a block take at most
+    about memory_budget bytes instead of the (n_heads, batch_size, n_query, graph_size) compatibility tensor.
+    Only for inference, the blocks are updated in place.
+    The softmax is reduced online over the key blocks (running maximum and normalizer), which gives the same
+    result as the full softmax up to floating point rounding.
+
+    :param Q: queries (n_heads, batch_size, n_query, key_size)
+    :param K: keys (n_heads, batch_size, graph_size, key_size), V: values (n_heads, batch_size, graph_size, val_size)
+    :return: heads (n_heads, batch_size, n_query, val_size)
+    """
+    n_heads, batch_size, n_query, _ = Q.size()
+    graph_size = K.size(2)
+    row_bytes = n_heads * batch_size * Q.element_size()
+    key_chunk = int(max(1, min(graph_size, memory_budget // row_bytes)))
+    query_chunk = int(max(1, memory_budget // (row_bytes * key_chunk)))
+
+    heads = []
+    for query_start in range(0, n_query, query_chunk):
+        Q_block = Q[:, :, query_start:query_start + query_chunk]
+        max_compatibility = normalizer = weighted_values = None
+        for key_start in range(0, graph_size, key_chunk):
+            K_block = K[:, :, key_start:key_start + key_chunk]
+            V_block = V[:, :, key_start:key_start + key_chunk]
+            # in place, only one block of compatibilities is held at a time (this path is only used without gradients)
+            weights = torch.matmul(Q_block, K_block.transpose(2, 3)).mul_(norm_factor)
+            block_max = weights.max(dim=-1, keepdim=True)[0]
+            if max_compatibility is None:
+                max_compatibility = block_max
+                weights.sub_(max_compatibility).exp_()
+                normalizer = weights.sum(dim=-1, keepdim=True)
+                weighted_values = torch.matmul(weights, V_block)
+            else:
+                # rescale what was accumulated with the previous maximum to the new maximum
+                new_max = torch.max(max_compatibility, block_max)
+                scale = torch.exp(max_compatibility - new_max)
+                weights.sub_(new_max).exp_()
+                normalizer = normalizer * scale + weights.sum(dim=-1, keepdim=True)
+                weighted_values = weighted_values * scale + torch.matmul(weights, V_block)
+                max_compatibility = new_max
+        heads.append(weighted_values / normalizer)
+    return torch.cat(heads, 2)
 
 
 class MultiHeadAttention(nn.Module):
@@ -52,13 +176,17 @@ class MultiHeadAttention(nn.Module):
             stdv = 1. / math.sqrt(param.size(-1))
             param.data.uniform_(-stdv, stdv)
 
-    def forward(self, q, h=None, mask=None):
+    def forward(self, q, h=None, mask=None, neighbours=None, memory_budget=None):
         """
 
         :param q: queries (batch_size, n_query, input_dim)
         :param h: data (batch_size, graph_size, input_dim)
         :param mask: mask (batch_size, n_query, graph_size) or viewable as that (i.e. can be 2 dim if n_query == 1)
         Mask should contain 1 if attention is not possible (i.e. mask is negative adjacency)
+        :param neighbours: optional (batch_size, n_sparse, k) indices of the nodes the queries attend to, see
+        sparse_attention_heads
+        :param memory_budget: optional number of bytes, the attention is computed in chunks if the compatibilities
+        would take more, see chunked_attention_heads
         :return:
         """
         if h is None:
@@ -84,23 +212,29 @@ class MultiHeadAttention(nn.Module):
         K = torch.matmul(hflat, self.W_key).view(shp)
         V = torch.matmul(hflat, self.W_val).view(shp)
 
-        # Calculate compatibility (n_heads, batch_size, n_query, graph_size)
-        compatibility = self.norm_factor * torch.matmul(Q, K.transpose(2, 3))
+        if neighbours is not None:
+            assert mask is None, "Masks are not supported by the sparse attention"
+            heads = sparse_attention_heads(Q, K, V, neighbours, self.norm_factor)
+        elif mask is None and memory_budget is not None and Q[..., :1].numel() * graph_size * Q.element_size() > memory_budget:
+            heads = chunked_attention_heads(Q, K, V, self.norm_factor, memory_budget)
+        else:
+            # Calculate compatibility (n_heads, batch_size, n_query, graph_size)
+            compatibility = self.norm_factor * torch.matmul(Q, K.transpose(2, 3))
 
-        # Optionally apply mask to prevent attention
-        if mask is not None:
-            mask = mask.view(1, batch_size, n_query, graph_size).expand_as(compatibility)
-            compatibility[mask] = -np.inf
+            # Optionally apply mask to prevent attention
+            if mask is not None:
+                mask = mask.view(1, batch_size, n_query, graph_size).expand_as(compatibility)
+                compatibility[mask] = -np.inf
 
-        attn = torch.softmax(compatibility, dim=-1)
+            attn = torch.softmax(compatibility, dim=-1)
 
-        # If there are nodes with no neighbours then softmax returns nan so we fix them to 0
-        if mask is not None:
-            attnc = attn.clone()
-            attnc[mask] = 0
-            attn = attnc
+            # If there are nodes with no neighbours then softmax returns nan so we fix them to 0
+            if mask is not None:
+                attnc = attn.clone()
+                attnc[mask] = 0
+                attn = attnc
 
-        heads = torch.matmul(attn, V)
+            heads = torch.matmul(attn, V)
 
         out = torch.mm(
             heads.permute(1, 2, 0, 3).contiguous().view(-1, self.n_heads * self.val_dim),
@@ -119,6 +253,77 @@ class MultiHeadAttention(nn.Module):
         return out
 
 
+class LinearMultiHeadAttention(nn.Module):
+    """
+    MultiHeadAttention with the per head weight tensors packed into nn.Linear layers.
+    Computes the same function, but the projections can be picked up by dynamic quantization.
+    """
+
+    def __init__(self, attention):
+        super(LinearMultiHeadAttention, self).__init__()
+
+        self.n_heads = attention.n_heads
+        self.input_dim = attention.input_dim
+        self.embed_dim = attention.embed_dim
+        self.val_dim = attention.val_dim
+        self.key_dim = attention.key_dim
+        self.norm_factor = attention.norm_factor
+
+        def packed(weight):
+            # (n_heads, in_dim, out_dim) -> (n_heads * out_dim, in_dim) weight of nn.Linear
+            n_heads, in_dim, out_dim = weight.size()
+            linear = nn.Linear(in_dim, n_heads * out_dim, bias=False)
+            linear.weight.data.copy_(weight.detach().permute(1, 0, 2).reshape(in_dim, n_heads * out_dim).t())
+            return linear
+
+        self.project_query = packed(attention.W_query)
+        self.project_key = packed(attention.W_key)
+        self.project_val = packed(attention.W_val)
+
+        self.project_out = nn.Linear(self.n_heads * self.val_dim, self.embed_dim, bias=False)
+        self.project_out.weight.data.copy_(attention.W_out.detach().reshape(-1, self.embed_dim).t())
+
+    def forward(self, q, h=None, mask=None, neighbours=None, memory_budget=None):
+        if h is None:
+            h = q  # compute self-attention
+
+        batch_size, graph_size, input_dim = h.size()
+        n_query = q.size(1)
+
+        hflat = h.contiguous().view(-1, input_dim)
+        qflat = q.contiguous().view(-1, input_dim)
+
+        # (n_heads, batch_size, n_query/graph_size, key/val_size)
+        Q = self.project_query(qflat).view(batch_size, n_query, self.n_heads, -1).permute(2, 0, 1, 3)
+        K = self.project_key(hflat).view(batch_size, graph_size, self.n_heads, -1).permute(2, 0, 1, 3)
+        V = self.project_val(hflat).view(batch_size, graph_size, self.n_heads, -1).permute(2, 0, 1, 3)
+
+        if neighbours is not None:
+            assert mask is None, "Masks are not supported by the sparse attention"
+            heads = sparse_attention_heads(Q, K, V, neighbours, self.norm_factor)
+        elif mask is None and memory_budget is not None and Q[..., :1].numel() * graph_size * Q.element_size() > memory_budget:
+            heads = chunked_attention_heads(Q, K, V, self.norm_factor, memory_budget)
+        else:
+            compatibility = self.norm_factor * torch.matmul(Q, K.transpose(2, 3))
+
+            if mask is not None:
+                mask = mask.view(1, batch_size, n_query, graph_size).expand_as(compatibility)
+                compatibility[mask] = -np.inf
+
+            attn = torch.softmax(compatibility, dim=-1)
+
+            if mask is not None:
+                attnc = attn.clone()
+                attnc[mask] = 0
+                attn = attnc
+
+            heads = torch.matmul(attn, V)
+
+        return self.project_out(
+            heads.permute(1, 2, 0, 3).contiguous().view(-1, self.n_heads * self.val_dim)
+        ).view(batch_size, n_query, self.embed_dim)
+
+
 class Normalization(nn.Module):
 
     def __init__(self, embed_dim, normalization='batch'):
@@ -144,6 +349,13 @@ class Normalization(nn.Module):
             param.data.uniform_(-stdv, stdv)
 
     def forward(self, input):
+        if input.dtype in (torch.float16, torch.bfloat16):
+            # statistics over the batch/instance are not accurate enough in low precision, normalize in fp32
+            with torch.autocast(device_type=input.device.type, enabled=False):
+                return self._normalize(input.float()).to(input.dtype)
+        return self._normalize(input)
+
+    def _normalize(self, input):
         if isinstance(self.normalizer, nn.BatchNorm1d):
             return self.normalizer(input.view(-1, input.size(-1))).view(*input.size())
         elif isinstance(self.normalizer, nn.InstanceNorm1d):
@@ -181,6 +393,14 @@ class MultiHeadAttentionLayer(nn.Sequential):
             Normalization(embed_dim, normalization)
         )
 
+    def forward(self, input, neighbours=None, memory_budget=None):
+        # only the attention takes the neighbours of the sparse encoder and the memory budget
+        attention, *modules = self
+        h = attention(input, neighbours=neighbours, memory_budget=memory_budget)
+        for module in modules:
+            h = module(h)
+        return h
+
 
 class GraphAttentionEncoder(nn.Module):
     def __init__(
@@ -190,7 +410,10 @@ class GraphAttentionEncoder(nn.Module):
             n_layers,
             node_dim=None,
             normalization='batch',
-            feed_forward_hidden=512
+            feed_forward_hidden=512,
+            knn_neighbours=0,
+            n_global_tokens=0,
+            checkpoint_layers=0
     ):
         super(GraphAttentionEncoder, self).__init__()
 
@@ -202,16 +425,81 @@ class GraphAttentionEncoder(nn.Module):
             for _ in range(n_layers)
         ))
 
-    def forward(self, x, mask=None):
+        # Sparse encoder: each node attends only to its knn_neighbours nearest nodes (0 for all nodes) and to the
+        # learned global tokens, which attend to all nodes and are passed on from layer to layer
+        self.knn_neighbours = knn_neighbours
+        self.n_global_tokens = n_global_tokens
+        if n_global_tokens > 0:
+            self.global_tokens = nn.Parameter(torch.Tensor(n_global_tokens, embed_dim))
+            self.global_tokens.data.uniform_(-1, 1)
+
+        # Activation checkpointing: in training, only the inputs of segments of checkpoint_layers layers are kept for
+        # the backward pass and the activations within the segments are recomputed (0 to keep all activations)
+        self.checkpoint_layers = checkpoint_layers
+        # Without gradients, dense attention whose compatibilities would take more than this many bytes is computed
+        # in chunks (None for no limit), set by the evaluation for large instances
+        self.attention_memory_budget = None
+
+    def forward(self, x, mask=None, coords=None):
+        """
+        :param coords: (batch_size, graph_size, 2) node coordinates, needed for the neighbours of the sparse encoder
+        """
 
         assert mask is None, "TODO mask not yet supported!"
 
         # Batch multiply to get initial embeddings of nodes
         h = self.init_embed(x.view(-1, x.size(-1))).view(*x.size()[:2], -1) if self.init_embed is not None else x
-
-        h = self.layers(h)
+        batch_size, graph_size, embed_dim = h.size()
+
+        neighbours = None
+        if self.knn_neighbours > 0:
+            assert coords is not None, "The sparse encoder needs the coordinates of the nodes"
+            neighbours = knn_graph(coords, self.knn_neighbours)
+            if self.n_global_tokens > 0:
+                # the global tokens follow the nodes
+                global_index = torch.arange(graph_size, graph_size + self.n_global_tokens, device=h.device)
+                neighbours = torch.cat((neighbours, global_index.expand(batch_size, graph_size, -1)), -1)
+        if self.n_global_tokens > 0:
+            h = torch.cat((h, self.global_tokens.to(h.dtype).expand(batch_size, -1, -1)), 1)
+
+        if self.checkpoint_layers > 0 and torch.is_grad_enabled():
+            for start in range(0, len(self.layers), self.checkpoint_layers):
+                h = self._checkpointed_layers(h, neighbours, start, start + self.checkpoint_layers)
+        else:
+            memory_budget = None if torch.is_grad_enabled() else self.attention_memory_budget
+            h = self._apply_layers(h, neighbours, 0, len(self.layers), memory_budget)
+        h = h[:, :graph_size]
 
         return (
             h,  # (batch_size, graph_size, embed_dim)
             h.mean(dim=1),  # average to get embedding of graph, (batch_size, embed_dim)
         )
+
+    def _checkpointed_layers(self, h, neighbours, start, end):
+        """
+        Applies the layers start:end in a checkpointed segment. Batch normalization would update its running
+        statistics again when the segment is recomputed in the backward pass, so they are restored after it.
+        """
+        buffers = [buffer for module in self.layers[start:end].modules()
+                   if isinstance(module, nn.BatchNorm1d) and module.track_running_stats for buffer in module.buffers()]
+        calls = []
+
+        def segment(h, neighbours):
+            calls.append(None)
+            if len(calls) == 1 or len(buffers) == 0:
+                return self._apply_layers(h, neighbours, start, end)
+            statistics = [buffer.clone() for buffer in buffers]
+            try:
+                return self._apply_layers(h, neighbours, start, end)
+            finally:
+                # also when the recomputation stops early, once all tensors for the backward pass are recomputed
+                with torch.no_grad():
+                    for buffer, saved in zip(buffers, statistics):
+                        buffer.copy_(saved)
+
+        return checkpoint(segment, h, neighbours, use_reentrant=False)
+
+    def _apply_layers(self, h, neighbours, start, end, memory_budget=None):
+        for layer in self.layers[start:end]:
+            h = layer(h, neighbours=neighbours, memory_budget=memory_budget)
+        return h
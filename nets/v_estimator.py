@@ -4,13 +4,52 @@ from torch.utils.checkpoint import checkpoint
 import math
 from typing import NamedTuple
 
-from nets.graph_encoder import GraphAttentionEncoder
+from nets.graph_encoder import GraphAttentionEncoder, node_coords
 from torch.nn import DataParallel
 from utils.functions import sample_many
 
 from problems.tsp.state_tsp import StateTSP
 from utils import move_to
 
+def critic_node_features(obs, is_orienteering, invert_visited=False):
+    """
+    Builds the per node input features of the critics directly on the device of the observations
+    TSP: x, y, visited, first_a, prev_a (one hot)
+    OP: x, y, is_depot, visited, prev_a (one hot), remaining_len
+
+    :return: (batch_size, graph_size (+1 for the depot), node_dim)
+    """
+    loc = obs['loc']
+    batch_size = loc.size(0)
+
+    if is_orienteering:
+        n_loc = loc.size(1) + 1
+        features = loc.new_zeros(batch_size, n_loc, 6)
+        features[:, 0, :2] = obs['depot']
+        features[:, 1:, :2] = loc
+        features[:, 0, 2] = 1
+        visited_col, prev_a_col = 3, 4
+        features[:, :, 5] = obs['remaining_length'].view(batch_size, 1)
+    else:
+        n_loc = loc.size(1)
+        features = loc.new_zeros(batch_size, n_loc, 5)
+        features[:, :, :2] = loc
+        visited_col, prev_a_col = 2, 4
+
+    visited = obs['visited'].view(batch_size, n_loc).to(features.dtype)
+    features[:, :, visited_col] = 1 - visited if invert_visited else visited
+
+    # one hot encodings of the important actions, rows without an action yet (prev_a == -1) stay zero vectors
+    prev_a = obs['prev_a'].view(batch_size, 1)
+    is_action = (prev_a >= 0).to(features.dtype)
+    features[:, :, prev_a_col].scatter_(1, prev_a.clamp(min=0), is_action)
+    if not is_orienteering:
+        first_a = obs['first_a'].view(batch_size, 1)
+        features[:, :, 3].scatter_(1, first_a.clamp(min=0), is_action)
+
+    return features
+
+
 class V_Estimator(nn.Module):
 
     def __init__(self,
@@ -22,7 +61,10 @@ class V_Estimator(nn.Module):
                  q_outputs=False,
                  n_encode_layers=5,
                  normalization='instance', #instance, batch, none
-                 n_heads=8):
+                 n_heads=8,
+                 encoder_knn=0,
+                 encoder_global_tokens=0,
+                 checkpoint_encoder=0):
         super(V_Estimator, self).__init__()
 
         self.activation_function = { 'leaky': torch.nn.LeakyReLU(negative_slope=0.2), 'relu': torch.nn.ReLU() }[activation_str]
@@ -52,83 +94,27 @@ class V_Estimator(nn.Module):
             n_heads=n_heads,
             embed_dim=embedding_dim, # input_dim==embedding_dim as MultiHeadAttentionLayer are used internally
             n_layers=n_encode_layers,
-            normalization=normalization
+            normalization=normalization,
+            knn_neighbours=encoder_knn,
+            n_global_tokens=encoder_global_tokens,
+            checkpoint_layers=checkpoint_encoder
         )
 
 
 
-    def forward(self, obs, state=None, info=None):
-        if self.is_orienteering:
-            loc = torch.cat((obs['depot'][:, None, :], obs['loc']), dim=1)
-            batch_size, n_loc, _ = loc.shape
-
-            # transform visited tensor into the correct format
-            visited = obs['visited'].view(batch_size, -1, 1).to(device=loc.device)
-            if self.invert_visited:
-                visited = torch.logical_not(visited)
-
-            # get the values (= city indices) of last action
-            prev_a_idx = obs['prev_a'].view(batch_size, -1)
-            # no -1's, every problem starts at 0 (depot)
-            prev_a = torch.nn.functional.one_hot(prev_a_idx, num_classes=n_loc).view(-1, n_loc, 1).type(torch.float)
-            prev_a = prev_a.to(device=loc.device)
-
-            is_depot = torch.zeros((batch_size, n_loc, 1), dtype=torch.float, device=loc.device)
-            is_depot[:, 0, 0] = 1
-
-            remaining_len = obs['remaining_length'][:, None, None].expand(-1, n_loc,-1)
-
-            my_input = torch.cat((loc, is_depot, visited, prev_a, remaining_len), 2)
-        else:
-            loc = obs['loc']
-            batch_size, n_loc, _ = loc.shape
-
-            # transform visited tensor into the correct format
-            visited = obs['visited'].view(batch_size, -1, 1).to(device=loc.device)
-            if self.invert_visited:
-                visited = torch.logical_not(visited)
-            # get the values (= city indices) of important actions
-            prev_a_idx = obs['prev_a'].view(batch_size, -1)
-            first_a_idx = obs['first_a'].view(batch_size, -1)
-
-            # prepare arrays for one-hot representations of important actions
-            prev_a = torch.zeros((batch_size, n_loc, 1), dtype=torch.float)
-            first_a = torch.zeros((batch_size, n_loc, 1), dtype=torch.float)
-
-            # where prev_a is -1, one hot vector would not be able to be created -> keep those as zero vectors
-            mask = prev_a_idx.squeeze()!=-1
-            # create one-hot vectors for all valid values
-            replacement_prev_a = torch.nn.functional.one_hot(prev_a_idx[mask], num_classes=n_loc).view(-1, n_loc, 1).type(torch.float)
-            replacement_first_a = torch.nn.functional.one_hot(first_a_idx[mask], num_classes=n_loc).view(-1, n_loc, 1).type(torch.float)
-
-            # move all tensors to device
-            prev_a = prev_a.to(device=loc.device)
-            first_a = first_a.to(device=loc.device)
-            replacement_prev_a = replacement_prev_a.to(device=loc.device)
-            replacement_first_a = replacement_first_a.to(device=loc.device)
-
-            # assign one-hot vectors to the correct positions
-            prev_a[mask] = replacement_prev_a
-            first_a[mask] = replacement_first_a
-
-            # possible extension to include aggregations of neighbors
-            #distances = torch.cdist(loc, loc)
-            #distances[distances==0] = torch.median(distances, dim=2).values.flatten()
-
-            #min_distances = torch.min(distances, dim=2).values.view(batch_size, -1, 1)
-            #max_distances = torch.max(distances, dim=2).values.view(batch_size, -1, 1)
-            #mean_distances = torch.mean(distances, dim=2).view(batch_size, -1, 1)
-
-            # concatenate all the prepared inputs
-            my_input = torch.cat((loc, visited, first_a, prev_a), 2) # , min_distances, max_distances, mean_distances
+    def build_input(self, obs):
+        return critic_node_features(obs, self.is_orienteering, self.invert_visited)
 
+    def forward(self, obs, state=None, info=None, inputs=None):
+        # inputs can be passed in to share them between several critics that see the same observations
+        my_input = self.build_input(obs) if inputs is None else inputs
 
         e = self._init_embed(my_input)
-        embeddings, _ = self.embedder(e) # embedder is a graph attention encoder
+        embeddings, _ = self.embedder(e, coords=node_coords(obs, self.is_orienteering)) # embedder is a graph attention encoder
 
         embeddings = self.activation_function(self.node_embed_fc1(embeddings))
         embeddings = self.activation_function(self.node_embed_fc2(embeddings))
-        node_values = self.node_embed_to_value(embeddings).squeeze() # squeeze removes dimensions of size 1
+        node_values = self.node_embed_to_value(embeddings).squeeze(-1).float() # values are fp32 under autocast
 
         if self.q_outputs:
             return node_values * (-1 if self.negate_outputs else 1)
@@ -138,4 +124,51 @@ class V_Estimator(nn.Module):
        
 
     def _init_embed(self, input):
-        return self.init_embed(input)
\ No newline at end of file
+        return self.init_embed(input)
+
+class _SharedModule:
+    """
+    Holds a module without registering it as a submodule, so its parameters are not part of the owner's
+    parameters() and state dict, and copies of the owner (e.g. target critics) keep referring to the same module
+    """
+
+    def __init__(self, module):
+        self.module = module
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class V_EstimatorShared(V_Estimator):
+    """
+    Critic head on top of the node embeddings of the actor's encoder, together with the per node input features of
+    V_Estimator for the dynamic parts of the state. With the actor's cache_encoding, actor and critics share the
+    encoding of an observation.
+    With detach=True the critic losses do not change the actor's encoder.
+    """
+
+    def __init__(self,
+                 actor,
+                 embedding_dim,
+                 problem,
+                 detach=True,
+                 n_encode_layers=1,
+                 **kwargs):
+        super(V_EstimatorShared, self).__init__(embedding_dim, problem, n_encode_layers=n_encode_layers, **kwargs)
+
+        self.detach = detach
+        self._actor = _SharedModule(actor)
+
+        node_dim = self.init_embed.in_features
+        self.init_embed = nn.Linear(actor.embedding_dim + node_dim, embedding_dim)
+
+    @property
+    def actor(self):
+        return self._actor.module
+
+    def build_input(self, obs):
+        node_embeddings = self.actor.encode(obs)
+        if self.detach:
+            node_embeddings = node_embeddings.detach()
+        node_features = critic_node_features(obs, self.is_orienteering, self.invert_visited)
+        return torch.cat((node_embeddings.to(node_features.dtype), node_features), dim=-1)
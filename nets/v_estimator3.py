@@ -4,7 +4,7 @@ from torch.utils.checkpoint import checkpoint
 import math
 from typing import NamedTuple
 
-from nets.graph_encoder import GraphAttentionEncoder
+from nets.graph_encoder import GraphAttentionEncoder, node_coords, instance_index, mask_value
 from torch.nn import DataParallel
 from utils.functions import sample_many
 
@@ -49,7 +49,12 @@ class V_Estimator3(nn.Module):
                  mask_inner=False,
                  mask_logits=False,
                  normalization='instance',
-                 n_heads=8):
+                 n_heads=8,
+                 debug_checks=False,
+                 encoder_knn=0,
+                 encoder_global_tokens=0,
+                 checkpoint_encoder=0,
+                 group_instances=False):
         super(V_Estimator3, self).__init__()
 
         self.q_outputs = q_outputs
@@ -69,6 +74,10 @@ class V_Estimator3(nn.Module):
 
         self.mask_inner = mask_inner
         self.mask_logits = mask_logits
+        # NaN/visited asserts force a host sync per decoding step, only for debugging
+        self.debug_checks = debug_checks
+        # encode the rows of the same instance (e.g. transitions of the same episode in a minibatch) only once
+        self.group_instances = group_instances
 
         self.problem = problem
         self.n_heads = n_heads
@@ -103,7 +112,10 @@ class V_Estimator3(nn.Module):
             n_heads=n_heads,
             embed_dim=embedding_dim,
             n_layers=self.n_encode_layers,
-            normalization=normalization
+            normalization=normalization,
+            knn_neighbours=encoder_knn,
+            n_global_tokens=encoder_global_tokens,
+            checkpoint_layers=checkpoint_encoder
         )
 
         # For each node we compute (glimpse key, glimpse value, logit key) so 3 * embedding_dim
@@ -118,11 +130,32 @@ class V_Estimator3(nn.Module):
 
 
     def encode(self, obs, state=None, info=None):
-        embeddings, _ = self.embedder(self._init_embed(obs))
-        return embeddings
+        embeddings, inverse = self._encode_instances(obs)
+        return embeddings if inverse is None else embeddings[inverse]
 
-    def decode(self, obs, embeddings, state=None):
-        logits, mask = self._inner(obs, embeddings)
+    def _encode_instances(self, obs):
+        """
+        Node embeddings of the instances of the observations, with group_instances only of the unique instances
+
+        :return: embeddings (n_instances, graph_size, embed_dim), instance of each row (batch_size,) or None if the
+            embeddings are per row
+        """
+        init_embed, coords = self._init_embed(obs), node_coords(obs, self.is_orienteering)
+        rows, inverse = self._instance_index(obs) if self.group_instances else (None, None)
+        if rows is not None:
+            init_embed, coords = init_embed[rows], coords[rows]
+        embeddings, _ = self.embedder(init_embed, coords=coords)
+        return embeddings, inverse
+
+    def _instance_index(self, obs):
+        # the node features the encoder sees, see _init_embed
+        features = [obs['loc']]
+        if self.is_vrp or self.is_orienteering or self.is_pctsp:
+            features += [obs['depot']] + [obs[feat] for feat in self._node_features()]
+        return instance_index(torch.cat([feature.reshape(feature.size(0), -1) for feature in features], 1))
+
+    def decode(self, obs, embeddings, state=None, inverse=None):
+        logits, mask = self._inner(obs, embeddings, inverse)
         
         if self.output_probs:
             probs = nn.functional.softmax(logits.squeeze(), dim=1)
@@ -143,22 +176,25 @@ class V_Estimator3(nn.Module):
         :param input: state_tsp with batch dimension
         :return:
         """
-        embeddings = self.encode(obs, state, info)
-        return self.decode(obs, embeddings, state)
+        embeddings, inverse = self._encode_instances(obs)
+        return self.decode(obs, embeddings, state, inverse)
+
 
 
 
+    def _node_features(self):
+        # node features embedded in addition to the coordinates, for the problems with a depot
+        if self.is_vrp:
+            return ('demand', )
+        elif self.is_orienteering:
+            return ('prize', )
+        assert self.is_pctsp
+        return ('deterministic_prize', 'penalty')
 
     def _init_embed(self, input):
 
         if self.is_vrp or self.is_orienteering or self.is_pctsp:
-            if self.is_vrp:
-                features = ('demand', )
-            elif self.is_orienteering:
-                features = ('prize', )
-            else:
-                assert self.is_pctsp
-                features = ('deterministic_prize', 'penalty')
+            features = self._node_features()
             return torch.cat(
                 (
                     self.init_embed_depot(input['depot'])[:, None, :],
@@ -172,12 +208,16 @@ class V_Estimator3(nn.Module):
         # TSP
         return self.init_embed(input['loc'])
 
-    def _inner(self, obs, embeddings):
+    def _inner(self, obs, embeddings, inverse=None):
         # Compute keys, values for the glimpse and keys for the logits once as they can be reused in every step
         fixed = self._precompute(embeddings)
+        if inverse is not None:
+            # embeddings of the unique instances, the projections are computed once per instance as well
+            fixed = fixed[inverse]
 
         # Perform single decoding step
-        assert(not torch.all(obs['visited']))
+        if self.debug_checks:
+            assert(not torch.all(obs['visited']))
         logits, mask = self._get_logits(fixed, obs)
 
         return logits, mask
@@ -192,7 +232,7 @@ class V_Estimator3(nn.Module):
         return sample_many(
             lambda input: self._inner(*input),  # Need to unpack tuple into arguments
             lambda input, pi: self.problem.get_costs(input[0], pi),  # Don't need embeddings as input to get_costs
-            (input, self.embedder(self._init_embed(input))[0]),  # Pack input with embeddings (additional input)
+            (input, self.embedder(self._init_embed(input), coords=node_coords(input, self.is_orienteering))[0]),  # Pack input with embeddings (additional input)
             batch_rep, iter_rep
         )
 
@@ -243,7 +283,8 @@ class V_Estimator3(nn.Module):
         # Compute logits (unnormalized logits)
         logits, glimpse = self._one_to_many_logits(query, glimpse_K, glimpse_V, logit_K, mask)
 
-        assert not torch.isnan(logits).any()
+        if self.debug_checks:
+            assert not torch.isnan(logits).any()
 
         return logits, mask
 
@@ -314,8 +355,7 @@ class V_Estimator3(nn.Module):
             # need to create context for each sample individually
             placeholders = self.W_placeholder[None, None, :].view(1, -1).expand(batch_size, self.W_placeholder.size(-1))
 
-            indices = torch.cat((first_a, current_node), 1)[:, :, None]
-            indices[indices < 0] = 0
+            indices = torch.cat((first_a, current_node), 1)[:, :, None].clamp(min=0)
             indices = indices.expand(batch_size, 2, embeddings.size(-1))
             # indices have shape (batch_size, 2, embeddings_size) and embeddings (batch_size, #nodes, embedding_size); this way I can gather whole vectors
             values = embeddings.gather(1, indices).view(batch_size, -1)
@@ -332,12 +372,13 @@ class V_Estimator3(nn.Module):
         glimpse_Q = query.view(batch_size, num_steps, self.n_heads, 1, key_size).permute(2, 0, 1, 3, 4)
 
         # Batch matrix multiplication to compute compatibilities (n_heads, batch_size, num_steps, graph_size)
-        compatibility = torch.matmul(glimpse_Q, glimpse_K.transpose(-2, -1)) / math.sqrt(glimpse_Q.size(-1))
+        # Masking and softmax are done in fp32 under autocast. Masked entries get a constant instead of an offset from
+        # the batch minimum, so no reduction couples the instances of the batch
+        compatibility = (torch.matmul(glimpse_Q, glimpse_K.transpose(-2, -1)) / math.sqrt(glimpse_Q.size(-1))).float()
 
         if self.mask_inner:
             assert self.mask_logits, "Cannot mask inner without masking logits"
-            min_comp_value = torch.min(compatibility).detach() # detach cuz cant backpropagate here through mask
-            compatibility[mask[None, :, :, None, :].expand_as(compatibility)] = min_comp_value-1_000_000
+            compatibility = compatibility.masked_fill(mask[None, :, :, None, :].expand_as(compatibility), mask_value(compatibility.dtype))
 
         # Batch matrix multiplication to compute heads (n_heads, batch_size, num_steps, val_size)
         heads = torch.matmul(torch.softmax(compatibility, dim=-1), glimpse_V)
@@ -351,14 +392,13 @@ class V_Estimator3(nn.Module):
         final_Q = glimpse
         # Batch matrix multiplication to compute logits (batch_size, num_steps, graph_size)
         # logits = 'compatibility'
-        logits = torch.matmul(final_Q, logit_K.transpose(-2, -1)).squeeze(-2) / math.sqrt(final_Q.size(-1))
+        logits = (torch.matmul(final_Q, logit_K.transpose(-2, -1)).squeeze(-2) / math.sqrt(final_Q.size(-1))).float()
 
         # From the logits compute the probabilities by clipping, masking and softmax
         if self.tanh_clipping > 0:
             logits = torch.tanh(logits) * self.tanh_clipping
         if self.mask_logits:
-            min_logits_value = torch.min(logits).detach() # detach cuz cant backpropagate here through mask
-            logits[mask] = min_logits_value-1_000_000
+            logits = logits.masked_fill(mask, mask_value(logits.dtype))
             # can't mask with -inf as tianshou might input observations of done envs where all entries would become -inf
             # this might then fail at some softmax or gradients will become too high at some point
 
@@ -1,7 +1,6 @@
 import os
 import time
 import argparse
-import torch
 import random
 import itertools
 import csv
@@ -24,6 +23,20 @@ def get_options(args=None):
     parser.add_argument('--tanh_clipping', type=float, default=0.0,
                         help='Clip the parameters to within +- this value using tanh. '
                              'Set to 0 to not perform any clipping.')
+    parser.add_argument('--compile_model', type=int, default=False, help='Run encoders and decoders of actor and critics through torch.compile')
+    parser.add_argument('--precision', type=str, default='fp32', help="Precision of actor and critic computations, 'fp32' (default) or 'bf16' autocast")
+    parser.add_argument('--debug_checks', type=int, default=False, help="Check the actor and critic decoders for NaN logits and observations without unvisited nodes in every step, which costs a host sync per step")
+    parser.add_argument('--checkpoint_encoder', type=int, default=0, help="Recompute the activations of the actor and critic encoders in the backward pass instead of keeping them, in checkpointed segments of this many layers (0: keep all activations)")
+    parser.add_argument('--group_instances', type=int, default=False, help="Encode each instance only once per forward pass of the actor and v3 critics, instead of once per transition of its episode in learner batches and minibatches")
+    parser.add_argument('--episode_group_size', type=int, default=1, help="DQN and SAC minibatches consist of groups of this many transitions of the same episode, so that --group_instances encodes fewer instances (1: uniform sampling)")
+    parser.add_argument('--skip_forced_moves', type=int, default=False, help="Select the only feasible action of an observation without running the actor (e.g. the last TSP step), in training except for DQN and in evaluations")
+    parser.add_argument('--compact_every', type=int, default=0, help="Restrict the decoder keys and values of tensor rollouts (REINFORCE, multi-start and augmented evaluations) to the nodes that can still be selected, every this many steps (0: never)")
+    parser.add_argument('--fold_decoder_projections', type=int, default=False, help="Fold the step context and output projections of the decoder into the node projections precomputed once per instance in tensor rollouts (REINFORCE, multi-start and augmented evaluations), same results up to rounding")
+    parser.add_argument('--knn_candidates', type=int, default=0, help="Decode over the k nearest neighbours of the current node only, falling back to all nodes when all of them are visited (0: all nodes)")
+    parser.add_argument('--encoder_knn', type=int, default=0, help="Sparse actor encoder, in which each node attends only to its k nearest nodes (0: dense attention to all nodes)")
+    parser.add_argument('--encoder_global_tokens', type=int, default=0, help="Number of learned global tokens of the actor encoder, attended to by all nodes and attending to all nodes")
+    parser.add_argument('--critic_encoder_knn', type=int, default=0, help="Sparse critic encoders, in which each node attends only to its k nearest nodes (0: dense attention to all nodes)")
+    parser.add_argument('--critic_encoder_global_tokens', type=int, default=0, help="Number of learned global tokens of the critic encoders")
 
     # Training
     parser.add_argument('--rl_algorithm', type=str, default='PG', help="Set the RL algorithm to use.")
@@ -62,9 +75,17 @@ def get_options(args=None):
     parser.add_argument('--ent_coef', type=float, default=0.01, help='PPO Parameter')
     parser.add_argument('--gae_lambda', type=float, default=1.00, help='PPO Parameter')
 
+    parser.add_argument('--reinforce_batch_size', type=int, default=512, help='REINFORCE Parameter. Number of instances rolled out in parallel for each update')
+    parser.add_argument('--reinforce_epoch_size', type=int, default=100, help='REINFORCE Parameter. Number of updates per epoch')
+    parser.add_argument('--reinforce_baseline', type=str, default='rollout', help="REINFORCE Parameter. Baseline to use: 'rollout' (default, greedy rollout of the best actor so far), 'exponential', 'none' or 'pomo' (TSP only, shared baseline of rollouts from all start nodes of each instance)")
+    parser.add_argument('--reinforce_exp_beta', type=float, default=0.8, help='REINFORCE Parameter. Decay of the exponential baseline')
+
     parser.add_argument('--critics_embedding_dim', type=int, default=64, help='Dimension of input embedding of critics')
+    parser.add_argument('--share_encoder', type=str, default='none', help="Let critics use the actor's node embeddings instead of an own encoder: 'none' (default), 'detached' or 'joint' (critic loss also trains the actor's encoder, not for SAC)")
+    parser.add_argument('--shared_critic_layers', type=int, default=1, help='Number of attention layers of the critic head on the shared encoder')
 
     parser.add_argument('--tau', type=float, default=0.005, help='SAC Parameter')
+    parser.add_argument('--ensemble_critics', type=int, default=False, help='SAC Parameter. Evaluate both critics as one stacked ensemble in a single vectorized pass, trained with lr_critic1')
     parser.add_argument('--alpha_ent', type=float, default=None, help='SAC Parameter. Set to None for entropy learning')
     parser.add_argument('--target_ent', type=float, default=-1.0, help='SAC Parameter')
     parser.add_argument('--lr_alpha_ent', type=float, default=3e-4, help='SAC Parameter')
@@ -90,6 +111,14 @@ def get_options(args=None):
     parser.add_argument('--saved_policy_path', type=str, help='Name of saved model.')
     
     parser.add_argument('--gpu_id', default=0, type=int, help='ID of gpu to use.')
+    parser.add_argument('--multi_start', type=int, default=False, help='Evaluate saved TSP policies greedily from every start node of each instance in one batched decode and keep the best tour')
+    parser.add_argument('--augment', type=int, default=False, help='Evaluate saved policies greedily on the 8 dihedral symmetries of each instance in one batched decode and keep the best tour')
+    parser.add_argument('--augment_rotations', type=int, default=0, help='Number of additional random rotations of each instance for --augment')
+    parser.add_argument('--eval_memory_budget', type=int, default=1024, help="Memory budget in MB for the encoder attention of evaluations, larger attention (e.g. of very large instances) is computed in chunks with the same result (0: no limit)")
+    parser.add_argument('--log_solutions', type=int, default=False, help='Stream the tours and action probabilities of evaluations of saved policies to eval_logs/, see utils/solution_log.py')
+    parser.add_argument('--log_top_k', type=int, default=None, help='Only log the k most likely actions of each step with --log_solutions')
+    parser.add_argument('--quantize_eval', type=int, default=False, help='Additionally evaluate saved policies with dynamic int8 quantized linear layers (CPU only) and report reward deltas and speedups')
+    parser.add_argument('--quantize_attention', type=int, default=False, help='Also quantize the weight tensors of the encoder attention layers in quantized evaluations')
     
     opts = parser.parse_args(args)
     gpu_id = opts.gpu_id
@@ -145,6 +174,7 @@ def get_options(args=None):
     if opts.seed is None:
         opts.seed = random.randint(1,9999)
 
+    import torch  # not at module level, so --help and argument errors return without loading torch
     opts.use_cuda = torch.cuda.is_available()
     opts.run_name = "{}_{}_{}".format(opts.run_name, epoch_suffix, time.strftime("%Y%m%dT%H%M%S"))
     
@@ -59,19 +59,20 @@ class OP(object):
     def make_state(*args, **kwargs):
         return StateOP.initialize(*args, **kwargs)
 
-def generate_instance(size, prize_type):
-    # Details see paper
-    MAX_LENGTHS = {
-        20: 2.0,
-        30: 2.5,
-        40: 2.5,
-        50: 3.0,
-        100: 4.0,
-        200: 4.0,
-        500: 4.5,
-        1000: 5.0,
-    }
+# Details see paper
+MAX_LENGTHS = {
+    20: 2.0,
+    30: 2.5,
+    40: 2.5,
+    50: 3.0,
+    100: 4.0,
+    200: 4.0,
+    500: 4.5,
+    1000: 5.0,
+}
 
+
+def generate_instance(size, prize_type):
     loc = torch.FloatTensor(size, 2).uniform_(0, 1)
     depot = torch.FloatTensor(2).uniform_(0, 1)
     # Methods taken from Fischetti et al. 1998
@@ -44,6 +44,7 @@ class StateOP(NamedTuple):
             lengths=self.lengths[key],
             cur_coord=self.cur_coord[key],
             cur_total_prize=self.cur_total_prize[key],
+            i=self.i[key],
         )
 
     # Warning: cannot override len of NamedTuple, len should be number of fields, not batch size
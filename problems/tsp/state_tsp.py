@@ -41,6 +41,7 @@ class StateTSP(NamedTuple):
             visited_=self.visited_[key],
             lengths=self.lengths[key],
             cur_coord=self.cur_coord[key] if self.cur_coord is not None else None,
+            i=self.i[key],
         )
 
     @staticmethod
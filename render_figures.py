@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from utils.metrics_store import figure_scalars, read_csv
+
+
+# defaults of fields that were added to the figure meta specs over time, as in plotting.ipynb
+META_DEFAULTS = {
+    'scientific': False,
+    'x_multiplier': 1,
+    'is_kool_plot': False,
+    'is_neg_loss_plot': False,
+    'generalization_colors': False,
+}
+
+
+class CsvCache(object):
+    """
+    Parsed csvs in one npz file per csv in the cache directory, reused as long as the size and modification time
+    of the csv are unchanged
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.join(cache_dir, 'csvs')
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def __call__(self, path):
+        stat = os.stat(path)
+        fingerprint = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+        cache_path = os.path.join(self.cache_dir, hashlib.sha1(os.path.abspath(path).encode()).hexdigest() + '.npz')
+        if os.path.isfile(cache_path):
+            with np.load(cache_path) as data:
+                if np.array_equal(data['_fingerprint'], fingerprint):
+                    return {name: data[name] for name in data.files if name != '_fingerprint'}
+        columns = read_csv(path)
+        np.savez(cache_path, _fingerprint=fingerprint, **columns)
+        return columns
+
+
+def inputs_digest(figure_meta, lines):
+    digest = hashlib.sha1(json.dumps(figure_meta, sort_keys=True).encode())
+    for scalars in lines:
+        for name in sorted(scalars):
+            digest.update(name.encode())
+            digest.update(np.ascontiguousarray(scalars[name]).tobytes())
+    return digest.hexdigest()
+
+
+def render_figure(args):
+    """
+    Renders a figure of a figure meta spec like plotting.ipynb, with the lines already loaded
+    """
+    figure_meta, lines, output_path = args
+    import plotly.graph_objects as go
+    from plotly.colors import qualitative
+    import plotly.io as pio
+
+    pio.templates["google"] = go.layout.Template(
+        layout_colorway=['#FD3216', '#00FE35', '#00B5F6', '#EEA6FB', '#0DF9FF', '#FF9616', '#1CBE4F', '#EEA6FB']
+    )
+    pio.templates.default = "google"
+
+    figure_meta = {**META_DEFAULTS, **figure_meta}
+    x_df_label = figure_meta['x_df_label']
+    x_mult = figure_meta['x_multiplier']
+    kool_thinning = figure_meta['kool_thinning']
+    marker_size = figure_meta['marker_size']
+    y_type = figure_meta['y_type']
+    if len(figure_meta.get('key_paths', [])) > 0:
+        y_df_labels = figure_meta['y_df_labels']
+    else:
+        y_df_labels = [figure_meta['y_df_label']] * len(lines)
+    invert_y = figure_meta['invert_y']
+    if not isinstance(invert_y, list):
+        invert_y = [invert_y] * len(lines)
+
+    fig = go.Figure()
+    for i, (name, scalars) in enumerate(zip(figure_meta['line_names'], lines)):
+        y = -scalars[y_df_labels[i]] if invert_y[i] else scalars[y_df_labels[i]]
+        if "Kool" in name or figure_meta['is_kool_plot']:
+            fig = fig.add_trace(go.Scatter(x=scalars[x_df_label][::kool_thinning] * x_mult,
+                                           y=y[::kool_thinning],
+                                           name=name,
+                                           marker=dict(size=marker_size),
+                                           line=dict(width=3)))
+        else:
+            line_specs = dict(width=3)
+            is_legacy_result = False
+            if figure_meta['generalization_colors']:
+                is_legacy_result = name.endswith(' 20')
+                cmap = qualitative.Pastel2 if is_legacy_result else qualitative.Dark2
+                color_id_map = {'DQN': 1, 'PG': 2, 'A2C': 3, 'PPO': 4, 'SAC': 5}
+                line_specs['color'] = cmap[color_id_map[name.split(' ')[0]]]
+            fig = fig.add_trace(go.Scatter(x=scalars[x_df_label] * x_mult,
+                                           y=y,
+                                           name=name,
+                                           marker=dict(size=marker_size),
+                                           line=line_specs,
+                                           legendgroup=f"group{is_legacy_result}"))
+
+    fig.update_layout(
+        font_family="libertine",
+        font_size=28,
+        autosize=False,
+        width=2000,
+        height=666,
+        margin=dict(l=120, r=70, b=80, t=30, pad=4),
+        yaxis=dict(
+            title_text=figure_meta['y_display_label'],
+            type="linear" if figure_meta['is_reward_plot'] else y_type,
+            range=(figure_meta['min_y'], figure_meta['max_y']),
+            rangemode="tozero",
+            tickformat='f' if y_type == 'log' else ('.0e' if figure_meta['scientific'] else None),
+            ticktext=["-0.1", "-1", "-10", "-100", "-1000", "-10k", "-100k", "-1M", "-10M"] if figure_meta['is_neg_loss_plot'] else None,
+            tickvals=[0.1, 1, 10, 100, 1000, 10000, 100000, 1000000, 10000000] if figure_meta['is_neg_loss_plot'] else None,
+        ),
+        xaxis=dict(
+            title_text=figure_meta['x_display_label'],
+            range=None if figure_meta['is_reward_plot'] else (figure_meta['min_x'], figure_meta['max_x']),
+            rangemode="tozero",
+        ),
+        legend=dict(
+            yanchor="top",
+            y=figure_meta['legend_y'],
+            xanchor="right",
+            x=figure_meta['legend_x'],
+            bgcolor='rgba(255,255,255,0.8)',
+        ),
+        legend_title_text=figure_meta['legend_title'],
+    )
+    if figure_meta['tsp_lines']:
+        fig.add_hline(y=10.43, line_dash="dot", annotation_text="random", annotation_position="bottom right")
+        fig.add_hline(y=3.84, line_dash="dot", annotation_text="optimal", annotation_position="bottom right")
+    if figure_meta['op_lines']:
+        fig.add_hline(y=1.58, line_dash="dot", annotation_text="random", annotation_position="bottom right")
+        fig.add_hline(y=5.39, line_dash="dot", annotation_text="optimal", annotation_position="bottom right")
+
+    fig.write_image(output_path)
+    return output_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Renders the figures of all figure meta specs in a directory, "
+                                                 "skipping figures whose specs and data have not changed")
+    parser.add_argument('--meta_dir', default='figure_metas', help="Directory of figure meta json specs")
+    parser.add_argument('--output_dir', default='figures', help="Where to save the figures")
+    parser.add_argument('--format', default='pdf', help="File format of the figures")
+    parser.add_argument('--cache_dir', default='.figure_cache', help="Where to keep parsed csvs and the digests of rendered figures")
+    parser.add_argument('--force', action='store_true', help="Render all figures, even unchanged ones")
+    parser.add_argument('--processes', type=int, default=None, help="Number of rendering processes, defaults to the number of CPUs")
+    opts = parser.parse_args()
+
+    t0 = time.time()
+    os.makedirs(opts.output_dir, exist_ok=True)
+    digests_path = os.path.join(opts.cache_dir, 'figure_digests.json')
+    csv_cache = CsvCache(opts.cache_dir)
+    digests = {}
+    if os.path.isfile(digests_path):
+        with open(digests_path) as f:
+            digests = json.load(f)
+
+    # the data of each run is loaded once in this process, the metrics stores are shared across all figures
+    stores = {}
+    jobs, new_digests, skipped = [], {}, []
+    for meta_file in sorted(os.listdir(opts.meta_dir)):
+        if meta_file.startswith('.') or not meta_file.endswith('.json'):
+            continue
+        with open(os.path.join(opts.meta_dir, meta_file)) as f:
+            figure_meta = json.load(f)
+        try:
+            lines = figure_scalars(figure_meta, stores, load_csv=csv_cache)
+        except FileNotFoundError as e:
+            print(f"Skipping {meta_file}, missing data: {e.filename}")
+            continue
+        output_path = os.path.join(opts.output_dir, f"{figure_meta['plot_filename']}.{opts.format}")
+        digest = inputs_digest(figure_meta, lines)
+        new_digests[output_path] = digest
+        if not opts.force and digests.get(output_path) == digest and os.path.isfile(output_path):
+            skipped.append(output_path)
+        else:
+            jobs.append((figure_meta, lines, output_path))
+
+    if len(jobs) > 0:
+        with Pool(opts.processes) as pool:
+            for output_path in pool.imap_unordered(render_figure, jobs):
+                print(f"Rendered {output_path}")
+                digests[output_path] = new_digests[output_path]
+        with open(digests_path, 'w') as f:
+            json.dump(digests, f)
+    print(f"Rendered {len(jobs)} figures, skipped {len(skipped)} unchanged figures in {time.time() - t0:.2f}s")
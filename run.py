@@ -1,34 +1,19 @@
 #!/usr/bin/env python
 
 import pprint as pp
+import time
 
+import numpy as np
 import torch
 import torch.optim as optim
+from torch.optim.lr_scheduler import ExponentialLR, CyclicLR
 
 from options import get_options
 from nets.attention_model import AttentionModel
-from nets.v_estimator import V_Estimator
-from nets.v_estimator3 import V_Estimator3
-from utils import load_problem
-
-import tianshou as ts
-from problems.tsp.tsp_env import TSP_env
-from problems.tsp.tsp_env_optimized import TSP_env_optimized
-#from problems.op.op_env import OP_env
-from problems.op.op_env_optimized import OP_env_optimized
-from torch.utils.tensorboard import SummaryWriter
-from tianshou.data import to_torch, to_torch_as
-from tianshou.utils import TensorboardLogger
-from torch.optim.lr_scheduler import ExponentialLR, CyclicLR
-
-import numpy as np
-from nets.argmaxembed import ArgMaxEmbed
-import time
-import json
+from utils import load_problem, compile_policy, quantize_for_inference
 
-from custom_classes.random import RandomPolicy
-from custom_classes.pg import PGPolicy_custom
-from custom_classes.discrete_sac import DiscreteSACPolicy_custom
+# tianshou, tensorboard, the envs (gym), the critics and the custom policies are imported in the functions that use
+# them, so each subcommand only pays for the imports it needs (see benchmark.py startup)
 
 epoch_counter = 0
 global_run_name = 'undefined'
@@ -44,6 +29,53 @@ class Categorical_logits(torch.distributions.categorical.Categorical):
         super(Categorical_logits, self).__init__(logits=logits, validate_args=validate_args)
         
         
+def autocast(opts):
+    # bf16 autocast for all actor and critic computations, a no-op for fp32 runs
+    return torch.autocast(device_type=opts.device.type, dtype=torch.bfloat16, enabled=opts.precision == 'bf16')
+
+def create_critic(opts, problem, actor, **kwargs):
+    """
+    Creates a critic of the class selected by critic_class_str, or with share_encoder a critic head on the actor's encoder
+    """
+    from nets.v_estimator import V_Estimator, V_EstimatorShared
+    from nets.v_estimator3 import V_Estimator3
+
+    critic_kwargs = dict(embedding_dim=opts.critics_embedding_dim, problem=problem, negate_outputs=opts.negate_critics_output,
+                         activation_str=opts.v1critic_activation, invert_visited=opts.v1critic_inv_visited,
+                         normalization=opts.normalization, encoder_knn=opts.critic_encoder_knn,
+                         encoder_global_tokens=opts.critic_encoder_global_tokens,
+                         checkpoint_encoder=opts.checkpoint_encoder, **kwargs)
+    if opts.share_encoder != 'none':
+        assert opts.share_encoder in ('detached', 'joint'), "Unknown share_encoder mode: {}".format(opts.share_encoder)
+        critic = V_EstimatorShared(actor, detach=opts.share_encoder == 'detached',
+                                   n_encode_layers=opts.shared_critic_layers, **critic_kwargs)
+        # actor and critics encode an observation only once per update
+        actor.cache_encoding = True
+    else:
+        critics_class = { 'v1': V_Estimator, 'v3': V_Estimator3 }
+        if opts.critic_class_str == 'v3':
+            # only the v3 critic encodes the instances without the per step features and has a decoder to check
+            critic_kwargs.update(group_instances=opts.group_instances, debug_checks=opts.debug_checks)
+        elif opts.group_instances:
+            print("Warning: v1 critics embed the per step features with the nodes, --group_instances only applies to the actor")
+        critic = critics_class[opts.critic_class_str](**critic_kwargs)
+    return critic.to(opts.device)
+
+
+def problem_env_classes():
+    from problems.tsp.tsp_env_optimized import TSP_env_optimized
+    from problems.op.op_env_optimized import OP_env_optimized
+    return { 'tsp': TSP_env_optimized, 'op': OP_env_optimized }
+
+
+def create_logger(opts):
+    from torch.utils.tensorboard import SummaryWriter
+    from tianshou.utils import TensorboardLogger
+    writer = SummaryWriter(f"log_dir/{opts.run_name}")
+    writer.add_text("args", str(opts))
+    return TensorboardLogger(writer, train_interval=1000, test_interval=1, update_interval=1)
+
+
 def updatelog_eps_lr(decay_learning_rate, decay_epsilon, policy, eps, logger, epoch, lr_scheduler=None, env_step=None, batch_size=None, log=False):
     update_epoch_counter(epoch)
     if decay_epsilon:
@@ -67,8 +99,11 @@ def updatelog_lr(decay_learning_rate, logger, lr_schedulers=None, env_step=None,
 
 
 def run_DQN(opts, logger):
+    import tianshou as ts
+    from custom_classes.replay_buffer import EpisodeGroupedVectorReplayBuffer
+
     problem = load_problem(opts.problem)
-    problem_env_class = { 'tsp': TSP_env_optimized, 'op': OP_env_optimized }
+    problem_env_class = problem_env_classes()
 
     actor = AttentionModel(
         opts.embedding_dim,
@@ -79,7 +114,13 @@ def run_DQN(opts, logger):
         mask_inner=True,
         mask_logits=True,
         normalization=opts.normalization,
-        tanh_clipping=opts.tanh_clipping
+        tanh_clipping=opts.tanh_clipping,
+        knn_candidates=opts.knn_candidates,
+        encoder_knn=opts.encoder_knn,
+        encoder_global_tokens=opts.encoder_global_tokens,
+        checkpoint_encoder=opts.checkpoint_encoder,
+        group_instances=opts.group_instances,
+        debug_checks=opts.debug_checks
     ).to(opts.device)
 
     # https://discuss.pytorch.org/t/how-to-optimize-multi-models-parameter-in-one-optimizer/3603/6
@@ -145,7 +186,11 @@ def run_DQN(opts, logger):
     
     
 
-    replay_buffer = ts.data.VectorReplayBuffer(total_size=buffer_size, buffer_num=num_of_buffer)
+    if opts.compile_model:
+        compile_policy(policy)
+
+    replay_buffer = EpisodeGroupedVectorReplayBuffer(total_size=buffer_size, buffer_num=num_of_buffer,
+                                                     group_size=opts.episode_group_size)
     train_collector = ts.data.Collector(policy, train_envs, replay_buffer, exploration_noise=False)
     test_collector = ts.data.Collector(policy, test_envs, exploration_noise=False)
     
@@ -153,23 +198,27 @@ def run_DQN(opts, logger):
         update_epoch_counter(epoch)
         updatelog_eps_lr(decay_learning_rate, decay_epsilon, policy, eps_train/(epoch+1), logger, epoch, lr_scheduler=lr_scheduler, env_step=env_step, batch_size=batch_size, log=True)
 
-    result = ts.trainer.offpolicy_trainer( # DOESN'T work with PPO, which makes sense
-        policy, train_collector, test_collector, num_epochs, step_per_epoch, step_per_collect,
-        num_test_episodes, batch_size, update_per_step= 1 / step_per_collect,
-        train_fn=train_fn,
-        test_fn=lambda epoch, env_step: updatelog_eps_lr(decay_learning_rate, decay_epsilon, policy, eps_test/(epoch+1), logger, epoch, log=False),
-        save_best_fn=save_policy,
-        #stop_fn=lambda mean_rewards: mean_rewards >= env.spec.reward_threshold,
-        logger=logger
-    )
+    with autocast(opts):
+        result = ts.trainer.offpolicy_trainer( # DOESN'T work with PPO, which makes sense
+            policy, train_collector, test_collector, num_epochs, step_per_epoch, step_per_collect,
+            num_test_episodes, batch_size, update_per_step= 1 / step_per_collect,
+            train_fn=train_fn,
+            test_fn=lambda epoch, env_step: updatelog_eps_lr(decay_learning_rate, decay_epsilon, policy, eps_test/(epoch+1), logger, epoch, log=False),
+            save_best_fn=save_policy,
+            #stop_fn=lambda mean_rewards: mean_rewards >= env.spec.reward_threshold,
+            logger=logger
+        )
 
     torch.save(policy.state_dict(), f"policy_dir/{opts.run_name}.pth")
     #policy.load_state_dict(torch.load("policy.pth"))
 
 
 def run_PG(opts, logger):
+    import tianshou as ts
+    from custom_classes.pg import PGPolicy_custom
+
     problem = load_problem(opts.problem)
-    problem_env_class = { 'tsp': TSP_env_optimized, 'op': OP_env_optimized }
+    problem_env_class = problem_env_classes()
 
     actor = AttentionModel(
         opts.embedding_dim,
@@ -180,7 +229,14 @@ def run_PG(opts, logger):
         mask_inner=True,
         mask_logits=True,
         normalization=opts.normalization,
-        tanh_clipping=opts.tanh_clipping
+        tanh_clipping=opts.tanh_clipping,
+        knn_candidates=opts.knn_candidates,
+        encoder_knn=opts.encoder_knn,
+        encoder_global_tokens=opts.encoder_global_tokens,
+        checkpoint_encoder=opts.checkpoint_encoder,
+        group_instances=opts.group_instances,
+        debug_checks=opts.debug_checks,
+        skip_forced_moves=opts.skip_forced_moves
     ).to(opts.device)
 
     # https://discuss.pytorch.org/t/how-to-optimize-multi-models-parameter-in-one-optimizer/3603/6
@@ -251,6 +307,9 @@ def run_PG(opts, logger):
                           reward_normalization=False,
                           deterministic_eval=False)
 
+    if opts.compile_model:
+        compile_policy(policy)
+
     replay_buffer = ts.data.VectorReplayBuffer(total_size=buffer_size, buffer_num=num_of_buffer)
     train_collector = ts.data.Collector(policy, train_envs, replay_buffer, exploration_noise=False)
     test_collector = ts.data.Collector(policy, test_envs, exploration_noise=False)
@@ -259,27 +318,31 @@ def run_PG(opts, logger):
         update_epoch_counter(epoch)
         logger.write("train/learning_rate", epoch, {'LR':lr_scheduler.get_last_lr()[0]})
     
-    result = ts.trainer.onpolicy_trainer(
-        policy=policy,
-        train_collector=train_collector,
-        test_collector=test_collector,
-        max_epoch=num_epochs,
-        step_per_epoch=step_per_epoch,
-        repeat_per_collect=repeat_per_collect,
-        episode_per_test=num_test_episodes,
-        batch_size=batch_size,
-        episode_per_collect=episode_per_collect,
-        train_fn=train_fn,
-        save_best_fn=save_policy,
-        logger=logger
-    )
+    with autocast(opts):
+        result = ts.trainer.onpolicy_trainer(
+            policy=policy,
+            train_collector=train_collector,
+            test_collector=test_collector,
+            max_epoch=num_epochs,
+            step_per_epoch=step_per_epoch,
+            repeat_per_collect=repeat_per_collect,
+            episode_per_test=num_test_episodes,
+            batch_size=batch_size,
+            episode_per_collect=episode_per_collect,
+            train_fn=train_fn,
+            save_best_fn=save_policy,
+            logger=logger
+        )
 
     torch.save(policy.state_dict(), f"policy_dir/{opts.run_name}.pth")
 
 
 def run_PPO(opts, logger):
+    import tianshou as ts
+    from custom_classes.actor_critic import PPOPolicy_custom
+
     problem = load_problem(opts.problem)
-    problem_env_class = { 'tsp': TSP_env_optimized, 'op': OP_env_optimized }
+    problem_env_class = problem_env_classes()
 
     actor = AttentionModel(
         opts.embedding_dim,
@@ -290,7 +353,14 @@ def run_PPO(opts, logger):
         mask_inner=True,
         mask_logits=True,
         normalization=opts.normalization,
-        tanh_clipping=opts.tanh_clipping
+        tanh_clipping=opts.tanh_clipping,
+        knn_candidates=opts.knn_candidates,
+        encoder_knn=opts.encoder_knn,
+        encoder_global_tokens=opts.encoder_global_tokens,
+        checkpoint_encoder=opts.checkpoint_encoder,
+        group_instances=opts.group_instances,
+        debug_checks=opts.debug_checks,
+        skip_forced_moves=opts.skip_forced_moves
     ).to(opts.device)
 
     lr_actor = opts.lr_actor # 1e-4
@@ -306,10 +376,7 @@ def run_PPO(opts, logger):
     test_episodes_factor = opts.te_factor # 1
     gamma = opts.gamma # 1.00
     repeat_per_collect = opts.repeat_per_collect # how many times to learn each batch
-    critics_embedding_dim = opts.critics_embedding_dim
     eps_clip, vf_coef, ent_coef, gae_lambda = opts.eps_clip, opts.vf_coef, opts.ent_coef, opts.gae_lambda
-    critic_class_str = opts.critic_class_str
-    critics_class = { 'v1': V_Estimator, 'v3': V_Estimator3 } # critics_class[critic_class_str]
 
 
 
@@ -333,7 +400,7 @@ def run_PPO(opts, logger):
 
 
 
-    critic = critics_class[critic_class_str](embedding_dim=critics_embedding_dim, problem=problem, negate_outputs=opts.negate_critics_output, activation_str=opts.v1critic_activation, invert_visited=opts.v1critic_inv_visited, normalization=opts.normalization).to(opts.device)
+    critic = create_critic(opts, problem, actor)
     # https://discuss.pytorch.org/t/how-to-optimize-multi-models-parameter-in-one-optimizer/3603/6
     
     optimizer = optim.Adam([
@@ -361,22 +428,25 @@ def run_PPO(opts, logger):
     
 
     distribution_type = Categorical_logits
-    policy = ts.policy.PPOPolicy(actor=actor,
-                                 critic=critic,
-                                 optim=optimizer,
-                                 dist_fn=distribution_type,
-                                 discount_factor=gamma,
-                                 lr_scheduler=lr_scheduler if decay_learning_rate else None,
-                                 eps_clip=eps_clip,
-                                 dual_clip=None,
-                                 value_clip=False,
-                                 advantage_normalization=False,
-                                 vf_coef=vf_coef,
-                                 ent_coef=ent_coef,
-                                 gae_lambda=gae_lambda,
-                                 reward_normalization=False,
-                                 deterministic_eval=False,
-                                 max_grad_norm=opts.max_grad_norm)
+    policy = PPOPolicy_custom(actor=actor,
+                              critic=critic,
+                              optim=optimizer,
+                              dist_fn=distribution_type,
+                              discount_factor=gamma,
+                              lr_scheduler=lr_scheduler if decay_learning_rate else None,
+                              eps_clip=eps_clip,
+                              dual_clip=None,
+                              value_clip=False,
+                              advantage_normalization=False,
+                              vf_coef=vf_coef,
+                              ent_coef=ent_coef,
+                              gae_lambda=gae_lambda,
+                              reward_normalization=False,
+                              deterministic_eval=False,
+                              max_grad_norm=opts.max_grad_norm)
+
+    if opts.compile_model:
+        compile_policy(policy)
 
     replay_buffer = ts.data.VectorReplayBuffer(total_size=buffer_size, buffer_num=num_of_buffer)
     train_collector = ts.data.Collector(policy, train_envs, replay_buffer, exploration_noise=False)
@@ -386,27 +456,33 @@ def run_PPO(opts, logger):
         update_epoch_counter(epoch)
         logger.write("train/learning_rate", epoch, {'LR':lr_scheduler.get_last_lr()[0]})
     
-    result = ts.trainer.onpolicy_trainer(
-        policy=policy,
-        train_collector=train_collector,
-        test_collector=test_collector,
-        max_epoch=num_epochs,
-        step_per_epoch=step_per_epoch,
-        repeat_per_collect=repeat_per_collect,
-        episode_per_test=num_test_episodes,
-        batch_size=batch_size,
-        episode_per_collect=episode_per_collect,
-        logger=logger,
-        train_fn=train_fn,
-        save_best_fn=save_policy
-    )
+    with autocast(opts):
+        result = ts.trainer.onpolicy_trainer(
+            policy=policy,
+            train_collector=train_collector,
+            test_collector=test_collector,
+            max_epoch=num_epochs,
+            step_per_epoch=step_per_epoch,
+            repeat_per_collect=repeat_per_collect,
+            episode_per_test=num_test_episodes,
+            batch_size=batch_size,
+            episode_per_collect=episode_per_collect,
+            logger=logger,
+            train_fn=train_fn,
+            save_best_fn=save_policy
+        )
 
     torch.save(policy.state_dict(), f"policy_dir/{opts.run_name}.pth")
 
 
 def run_SAC(opts, logger):
+    import tianshou as ts
+    from custom_classes.discrete_sac import DiscreteSACPolicy_custom
+    from custom_classes.replay_buffer import EpisodeGroupedVectorReplayBuffer
+    from nets.critic_ensemble import CriticEnsemble
+
     problem = load_problem(opts.problem)
-    problem_env_class = { 'tsp': TSP_env_optimized, 'op': OP_env_optimized } # _optimized
+    problem_env_class = problem_env_classes()
 
     actor = AttentionModel(
         opts.embedding_dim,
@@ -417,7 +493,14 @@ def run_SAC(opts, logger):
         mask_inner=True,
         mask_logits=True,
         normalization=opts.normalization,
-        tanh_clipping=opts.tanh_clipping
+        tanh_clipping=opts.tanh_clipping,
+        knn_candidates=opts.knn_candidates,
+        encoder_knn=opts.encoder_knn,
+        encoder_global_tokens=opts.encoder_global_tokens,
+        checkpoint_encoder=opts.checkpoint_encoder,
+        group_instances=opts.group_instances,
+        debug_checks=opts.debug_checks,
+        skip_forced_moves=opts.skip_forced_moves
     ).to(opts.device)
 
     lr_actor = opts.lr_actor # 1e-4
@@ -436,9 +519,6 @@ def run_SAC(opts, logger):
     num_test_envs = opts.n_test_envs # 1024 # has to be smaller or equal to num_test_episodes
     test_episodes_factor = opts.te_factor # 1
     gamma = opts.gamma # 1.00
-    critics_embedding_dim = opts.critics_embedding_dim
-    critic_class_str = opts.critic_class_str
-    critics_class = { 'v1': V_Estimator, 'v3': V_Estimator3 } # critics_class[critic_class_str]
 
     tau, alpha = opts.tau, opts.alpha_ent # 0.005, None
     target_ent = opts.target_ent # default = -np.prod(dummy_env.action_space.shape)
@@ -469,15 +549,20 @@ def run_SAC(opts, logger):
         {'params': actor.parameters(), 'lr': lr_actor}
     ])
 
-    critic1 = critics_class[critic_class_str](embedding_dim=critics_embedding_dim, q_outputs=True, problem=problem, negate_outputs=opts.negate_critics_output, activation_str=opts.v1critic_activation, invert_visited=opts.v1critic_inv_visited, normalization=opts.normalization).to(opts.device) # V_Estimator
+    # the critic losses must not change the actor's encoder, the actor is updated with a separate optimizer
+    assert opts.share_encoder != 'joint', "SAC critics can only share the actor's encoder detached"
+    critic1 = create_critic(opts, problem, actor, q_outputs=True)
+    critic2 = create_critic(opts, problem, actor, q_outputs=True)
+    if opts.ensemble_critics:
+        # both critics are evaluated in one vectorized pass and trained with the learning rate of critic1
+        critic1, critic2 = CriticEnsemble([critic1, critic2]), None
+
     critic1_optimizer = optim.Adam([
         {'params': critic1.parameters(), 'lr': lr_critic1}
     ])
-
-    critic2 = critics_class[critic_class_str](embedding_dim=critics_embedding_dim, q_outputs=True, problem=problem, negate_outputs=opts.negate_critics_output, activation_str=opts.v1critic_activation, invert_visited=opts.v1critic_inv_visited, normalization=opts.normalization).to(opts.device)
     critic2_optimizer = optim.Adam([
         {'params': critic2.parameters(), 'lr': lr_critic2}
-    ])
+    ]) if critic2 is not None else None
 
 
     def create_scheduler(optimizer, schedule_type):
@@ -488,7 +573,10 @@ def run_SAC(opts, logger):
 
     lr_scheduler_actor = create_scheduler(actor_optimizer, opts.lr_scheduler_type)
     lr_scheduler_critic1 = create_scheduler(critic1_optimizer, opts.lr_scheduler_type)
-    lr_scheduler_critic2 = create_scheduler(critic2_optimizer, opts.lr_scheduler_type)
+    lr_schedulers, lr_labels = [lr_scheduler_actor, lr_scheduler_critic1], ['ActorLR', 'Critic1LR']
+    if critic2_optimizer is not None:
+        lr_schedulers.append(create_scheduler(critic2_optimizer, opts.lr_scheduler_type))
+        lr_labels.append('Critic2LR')
 
 
 
@@ -524,28 +612,36 @@ def run_SAC(opts, logger):
                                       reward_normalization=False,
                                       deterministic_eval=False)
 
-    replay_buffer = ts.data.VectorReplayBuffer(total_size=buffer_size, buffer_num=num_of_buffer)
+    if opts.compile_model:
+        compile_policy(policy)
+
+    replay_buffer = EpisodeGroupedVectorReplayBuffer(total_size=buffer_size, buffer_num=num_of_buffer,
+                                                     group_size=opts.episode_group_size)
     train_collector = ts.data.Collector(policy, train_envs, replay_buffer, exploration_noise=False)
     test_collector = ts.data.Collector(policy, test_envs, exploration_noise=False)
 
     def train_fn(epoch, env_step):
         update_epoch_counter(epoch)
-        updatelog_lr(decay_learning_rate, logger, lr_schedulers=[lr_scheduler_actor, lr_scheduler_critic1, lr_scheduler_critic2], env_step=env_step, log=True, labels=['ActorLR', 'Critic1LR', 'Critic2LR'])
+        updatelog_lr(decay_learning_rate, logger, lr_schedulers=lr_schedulers, env_step=env_step, log=True, labels=lr_labels)
     
-    result = ts.trainer.offpolicy_trainer(
-        policy, train_collector, test_collector, num_epochs, step_per_epoch, step_per_collect,
-        num_test_episodes, batch_size, update_per_step=1 / step_per_collect,
-        train_fn=train_fn,
-        save_best_fn=save_policy,
-        logger=logger
-    )
+    with autocast(opts):
+        result = ts.trainer.offpolicy_trainer(
+            policy, train_collector, test_collector, num_epochs, step_per_epoch, step_per_collect,
+            num_test_episodes, batch_size, update_per_step=1 / step_per_collect,
+            train_fn=train_fn,
+            save_best_fn=save_policy,
+            logger=logger
+        )
 
     torch.save(policy.state_dict(), f"policy_dir/{opts.run_name}.pth")
 
 
 def run_A2C(opts, logger):
+    import tianshou as ts
+    from custom_classes.actor_critic import A2CPolicy_custom
+
     problem = load_problem(opts.problem)
-    problem_env_class = { 'tsp': TSP_env_optimized, 'op': OP_env_optimized }
+    problem_env_class = problem_env_classes()
 
     actor = AttentionModel(
         opts.embedding_dim,
@@ -556,7 +652,14 @@ def run_A2C(opts, logger):
         mask_inner=True,
         mask_logits=True,
         normalization=opts.normalization,
-        tanh_clipping=opts.tanh_clipping
+        tanh_clipping=opts.tanh_clipping,
+        knn_candidates=opts.knn_candidates,
+        encoder_knn=opts.encoder_knn,
+        encoder_global_tokens=opts.encoder_global_tokens,
+        checkpoint_encoder=opts.checkpoint_encoder,
+        group_instances=opts.group_instances,
+        debug_checks=opts.debug_checks,
+        skip_forced_moves=opts.skip_forced_moves
     ).to(opts.device)
 
     # https://discuss.pytorch.org/t/how-to-optimize-multi-models-parameter-in-one-optimizer/3603/6
@@ -573,10 +676,7 @@ def run_A2C(opts, logger):
     test_episodes_factor = opts.te_factor # 1
     gamma = opts.gamma # 1.00
     repeat_per_collect = opts.repeat_per_collect # how many times to learn each batch
-    critics_embedding_dim = opts.critics_embedding_dim # 64
     vf_coef, ent_coef, gae_lambda = opts.vf_coef, opts.ent_coef, opts.gae_lambda
-    critic_class_str = opts.critic_class_str
-    critics_class = { 'v1': V_Estimator, 'v3': V_Estimator3 } # critics_class[critic_class_str]
 
 
 
@@ -599,7 +699,7 @@ def run_A2C(opts, logger):
 
 
 
-    critic = critics_class[critic_class_str](embedding_dim=critics_embedding_dim, problem=problem, negate_outputs=opts.negate_critics_output, activation_str=opts.v1critic_activation, invert_visited=opts.v1critic_inv_visited, normalization=opts.normalization).to(opts.device)
+    critic = create_critic(opts, problem, actor)
     # https://discuss.pytorch.org/t/how-to-optimize-multi-models-parameter-in-one-optimizer/3603/6
     optimizer = optim.Adam([
         {'params': actor.parameters(), 'lr': lr_actor},
@@ -627,16 +727,19 @@ def run_A2C(opts, logger):
     test_envs = ts.env.DummyVectorEnv(test_problems)
 
     distribution_type = Categorical_logits
-    policy = ts.policy.A2CPolicy(actor=actor,
-                                 critic=critic,
-                                 optim=optimizer,
-                                 dist_fn=distribution_type,
-                                 discount_factor=gamma,
-                                 lr_scheduler=lr_scheduler if decay_learning_rate else None,
-                                 vf_coef=vf_coef,
-                                 ent_coef=ent_coef,
-                                 gae_lambda=gae_lambda,
-                                 max_grad_norm=opts.max_grad_norm)
+    policy = A2CPolicy_custom(actor=actor,
+                              critic=critic,
+                              optim=optimizer,
+                              dist_fn=distribution_type,
+                              discount_factor=gamma,
+                              lr_scheduler=lr_scheduler if decay_learning_rate else None,
+                              vf_coef=vf_coef,
+                              ent_coef=ent_coef,
+                              gae_lambda=gae_lambda,
+                              max_grad_norm=opts.max_grad_norm)
+
+    if opts.compile_model:
+        compile_policy(policy)
 
     replay_buffer = ts.data.VectorReplayBuffer(total_size=buffer_size, buffer_num=num_of_buffer)
     train_collector = ts.data.Collector(policy, train_envs, replay_buffer, exploration_noise=False)
@@ -646,32 +749,36 @@ def run_A2C(opts, logger):
         update_epoch_counter(epoch)
         logger.write("train/learning_rate", epoch, {'LR':lr_scheduler.get_last_lr()[0]})
     
-    result = ts.trainer.onpolicy_trainer(
-        policy=policy,
-        train_collector=train_collector,
-        test_collector=test_collector,
-        max_epoch=num_epochs,
-        step_per_epoch=step_per_epoch,
-        repeat_per_collect=repeat_per_collect,
-        episode_per_test=num_test_episodes,
-        batch_size=batch_size,
-        episode_per_collect=episode_per_collect,
-        train_fn=train_fn,
-        save_best_fn=save_policy,
-        logger=logger
-    )
+    with autocast(opts):
+        result = ts.trainer.onpolicy_trainer(
+            policy=policy,
+            train_collector=train_collector,
+            test_collector=test_collector,
+            max_epoch=num_epochs,
+            step_per_epoch=step_per_epoch,
+            repeat_per_collect=repeat_per_collect,
+            episode_per_test=num_test_episodes,
+            batch_size=batch_size,
+            episode_per_collect=episode_per_collect,
+            train_fn=train_fn,
+            save_best_fn=save_policy,
+            logger=logger
+        )
 
     torch.save(policy.state_dict(), f"policy_dir/{opts.run_name}.pth")
 
 
-def run_custom_REINFORCE(opts, log_results=False):
-    problem = load_problem(opts.problem)
-    problem_env_class = { 'tsp': TSP_env_optimized, 'op': OP_env_optimized }
+def run_custom_REINFORCE(opts, logger):
+    """
+    REINFORCE with whole batches of instances rolled out on tensors (see utils/rollout.py) instead of tianshou envs,
+    with a greedy rollout, exponential, no baseline or the shared baseline of multi-start rollouts (POMO)
+    """
+    import tianshou as ts
+    from utils.rollout import random_instances, rollout, greedy_costs, NoBaseline, ExponentialBaseline, POMOBaseline, RolloutBaseline
 
-    critic_class_str = opts.critic_class_str
-    critics_class = { 'v1': V_Estimator, 'v3': V_Estimator3 }
+    problem = load_problem(opts.problem)
+    graph_sizes = opts.graph_size if type(opts.graph_size) is list else [opts.graph_size]
 
-    # NOTE: dims must be equivalent to save
     actor = AttentionModel(
         opts.embedding_dim,
         opts.hidden_dim,
@@ -681,64 +788,84 @@ def run_custom_REINFORCE(opts, log_results=False):
         mask_inner=True,
         mask_logits=True,
         normalization=opts.normalization,
-        tanh_clipping=opts.tanh_clipping
+        tanh_clipping=opts.tanh_clipping,
+        knn_candidates=opts.knn_candidates,
+        encoder_knn=opts.encoder_knn,
+        encoder_global_tokens=opts.encoder_global_tokens,
+        checkpoint_encoder=opts.checkpoint_encoder,
+        debug_checks=opts.debug_checks,
+        compact_every=opts.compact_every,
+        fold_projections=opts.fold_decoder_projections
     ).to(opts.device)
 
-    critic = critics_class[critic_class_str](embedding_dim=opts.critics_embedding_dim, problem=problem, negate_outputs=opts.negate_critics_output, activation_str=opts.v1critic_activation, invert_visited=opts.v1critic_inv_visited).to(opts.device)
-
-    # https://discuss.pytorch.org/t/how-to-optimize-multi-models-parameter-in-one-optimizer/3603/6
-    learning_rate = 1e-4
     optimizer = optim.Adam([
-        {'params': actor.parameters(), 'lr': learning_rate}
+        {'params': actor.parameters(), 'lr': opts.lr_actor}
     ])
+    lr_scheduler_options = {
+        'exp': ExponentialLR(optimizer, gamma=opts.lr_decay, verbose=False),
+        'cyclic': CyclicLR(optimizer, opts.cyc_base_lr, opts.cyc_max_lr, step_size_up=opts.cyc_step_size_up, step_size_down=opts.cyc_step_size_down, mode='triangular2', cycle_momentum=False)
+    }
+    lr_scheduler = lr_scheduler_options[opts.lr_scheduler_type]
 
-    num_test_envs = 512 # has to be smaller or equal to num_test_episodes
-    num_train_envs = batch_size = 16
-    num_episodes = opts.n_epochs
-    num_batches_per_episode = 20
-    
-    # DummyVectorEnv, SubprocVectorEnv
-    
-    if type(opts.graph_size) is list:
-        train_problems = []
-        test_problems = []
-        for size in opts.graph_size:
-            train_problems += [lambda: problem_env_class[opts.problem](opts, size) for _ in range(opts.train_envs_per_size)]
-            test_problems += [lambda: problem_env_class[opts.problem](opts, size) for _ in range(opts.test_envs_per_size)]
-    else:
-        train_problems += [lambda: problem_env_class[opts.problem](opts, size) for _ in range(num_train_envs)]
-        test_problems += [lambda: problem_env_class[opts.problem](opts, size) for _ in range(num_test_envs)]
-    
-    train_envs = ts.env.DummyVectorEnv(train_problems)
-    test_envs = ts.env.DummyVectorEnv(test_problems)
-
-    for i in range(num_episodes):
-        for j in range(num_batches_per_episode):
-            episode_rewards = np.zeros(num_train_envs)
-            eposide_log_probs = torch.zeros(num_train_envs, device=opts.device)
-            data = ts.data.Batch(obs={}, act={}, rew={}, done={}, obs_next={}, info={}, policy={})
-            data.obs = train_envs.reset()
-            done = False
-            embeddings = actor.encode(data.obs)
-            while not done:
-                logits, _ = actor.decode(data.obs, embeddings)
-                if log_results:
-                    dist = Categorical_logits(logits)
-                    act = dist.sample()
-                    eposide_log_probs += dist.log_prob(act)
-                data.obs, data.rew, data.done, info = train_envs.step(act)
-                episode_rewards += data.rew
-                done=data.done[0]
-            episode_costs = -to_torch_as(episode_rewards, eposide_log_probs)
-            loss = torch.sum(eposide_log_probs * episode_costs)
-            print(f"Episode: {i}, b{j}: loss={loss.item()}, rew={np.mean(episode_rewards)}")
-
-            optimizer.zero_grad()
-            loss.backward()
-            optimizer.step()
+    # only used to save the actor in the format of the PG policies, so they can be evaluated with run_saved
+    policy = ts.policy.PGPolicy(model=actor, optim=optimizer, dist_fn=Categorical_logits, discount_factor=opts.gamma)
 
+    def make_instances(batch_size, graph_size):
+        return random_instances(opts.problem, batch_size, graph_size, opts.data_distribution, opts.device)
 
+    if opts.reinforce_baseline == 'rollout':
+        baseline = RolloutBaseline(actor, opts.problem, lambda: [make_instances(opts.reinforce_batch_size, size) for size in graph_sizes])
+    elif opts.reinforce_baseline == 'exponential':
+        baseline = ExponentialBaseline(opts.reinforce_exp_beta)
+    elif opts.reinforce_baseline == 'pomo':
+        baseline = POMOBaseline()
+    else:
+        assert opts.reinforce_baseline == 'none', "Unknown REINFORCE baseline: {}".format(opts.reinforce_baseline)
+        baseline = NoBaseline()
+
+    # POMO rolls out each instance from all start nodes, in training and in the greedy tests (best of all starts)
+    multi_start = opts.reinforce_baseline == 'pomo'
+    num_test_episodes = opts.test_envs_per_size * opts.te_factor
+    test_instances = [make_instances(num_test_episodes, size) for size in graph_sizes]
+
+    env_step = 0
+    best_reward = -np.inf
+    with autocast(opts):
+        for epoch in range(1, opts.n_epochs + 1):
+            update_epoch_counter(epoch)
+            logger.write("train/learning_rate", epoch, {'LR': lr_scheduler.get_last_lr()[0]})
+            actor.train()
+            t0 = time.time()
+            for i in range(opts.reinforce_epoch_size):
+                instances = make_instances(opts.reinforce_batch_size, graph_sizes[i % len(graph_sizes)])
+                cost, log_likelihood, actions = rollout(actor, opts.problem, instances, 'sampling', multi_start)
+                loss = ((cost - baseline.eval(instances, cost)) * log_likelihood).mean()
+
+                optimizer.zero_grad()
+                loss.backward()
+                if opts.max_grad_norm:
+                    torch.nn.utils.clip_grad_norm_(actor.parameters(), max_norm=opts.max_grad_norm)
+                optimizer.step()
+                if opts.decay_lr:
+                    lr_scheduler.step()
+                env_step += actions.numel()
+            episodes_per_second = opts.reinforce_epoch_size * opts.reinforce_batch_size / (time.time() - t0)
+            logger.write("train/env_step", env_step, {'train/reward': -cost.mean().item(), 'train/loss': loss.item(),
+                                                      'train/episodes_per_second': episodes_per_second})
+
+            actor.eval()
+            test_rewards = -torch.cat([greedy_costs(actor, opts.problem, instances, multi_start) for instances in test_instances])
+            test_reward, test_reward_std = test_rewards.mean().item(), test_rewards.std().item()
+            logger.write("test/env_step", env_step, {'test/reward': test_reward, 'test/reward_std': test_reward_std})
+            if test_reward > best_reward:
+                best_reward = test_reward
+                save_policy(policy)
+            print(f"Epoch #{epoch}: test_reward: {test_reward:.6f} ± {test_reward_std:.6f}, best_reward: {best_reward:.6f}, "
+                  f"{episodes_per_second:.1f} episodes/s")
+
+            baseline.epoch_callback(actor)
 
+    torch.save(policy.state_dict(), f"policy_dir/{opts.run_name}.pth")
 
 
 def batchify_obs(obs):
@@ -751,6 +878,9 @@ def batchify_obs(obs):
     return obs
 
 def run_STE_argmax(opts):
+    from problems.tsp.tsp_env import TSP_env
+    from nets.argmaxembed import ArgMaxEmbed
+
     problem = load_problem(opts.problem)
 
     model = AttentionModel(
@@ -762,7 +892,8 @@ def run_STE_argmax(opts):
         mask_inner=True,
         mask_logits=True,
         normalization=opts.normalization,
-        tanh_clipping=opts.tanh_clipping
+        tanh_clipping=opts.tanh_clipping,
+        debug_checks=opts.debug_checks
     ).to(opts.device)
 
     optimizer = optim.Adam([
@@ -815,7 +946,7 @@ def run_STE_argmax(opts):
         print(f'Epoch {epoch_idx} Costs: {epoch_costs/opts.epoch_size}') # not working rn
 
 def manual_testing(opts):
-    problem_env_class = { 'tsp': TSP_env_optimized, 'op': OP_env_optimized }
+    problem_env_class = problem_env_classes()
     env = problem_env_class[opts.problem](opts)
     obs = env.reset()
     done = False
@@ -826,13 +957,21 @@ def manual_testing(opts):
         print(f"{obs=}, {reward=}, {done=}")
 
 
-def run_saved(opts, log_solutions=False, logger=None, deterministic_eval=True):
+def run_saved(opts, log_solutions=False, logger=None, deterministic_eval=True, quantize=False):
+    import tianshou as ts
+    from tianshou.data import to_torch
+    from custom_classes.pg import PGPolicy_custom
+    from custom_classes.actor_critic import A2CPolicy_custom, PPOPolicy_custom
+    from custom_classes.discrete_sac import DiscreteSACPolicy_custom
+    from nets.critic_ensemble import CriticEnsemble, convert_twin_critics_state_dict
+    from utils.rollout import instances_from_obs, greedy_costs
+    from utils.augmentation import augment, best_of_views
+    from utils.solution_log import SolutionLogWriter
+
     t0 = time.time()
 
     problem = load_problem(opts.problem)
-    problem_env_class = { 'tsp': TSP_env_optimized, 'op': OP_env_optimized }
-    critic_class_str = opts.critic_class_str
-    critics_class = { 'v1': V_Estimator, 'v3': V_Estimator3 }
+    problem_env_class = problem_env_classes()
 
     # ARCHITECTURE AND PLACEHOLDER ///////////////////////////////////////////////////////////////////////////////////////////////////
     actor = AttentionModel(
@@ -844,11 +983,22 @@ def run_saved(opts, log_solutions=False, logger=None, deterministic_eval=True):
         mask_inner=True,
         mask_logits=True,
         normalization=opts.normalization,
-        tanh_clipping=opts.tanh_clipping
+        tanh_clipping=opts.tanh_clipping,
+        knn_candidates=opts.knn_candidates,
+        encoder_knn=opts.encoder_knn,
+        encoder_global_tokens=opts.encoder_global_tokens,
+        checkpoint_encoder=opts.checkpoint_encoder,
+        debug_checks=opts.debug_checks,
+        skip_forced_moves=opts.skip_forced_moves,
+        compact_every=opts.compact_every,
+        fold_projections=opts.fold_decoder_projections
     ).to(opts.device)
+    if opts.eval_memory_budget > 0:
+        # the encoder computes attention whose compatibilities would exceed the budget in chunks, e.g. for large n
+        actor.embedder.attention_memory_budget = opts.eval_memory_budget * 2 ** 20
 
-    critic1 = critics_class[critic_class_str](embedding_dim=opts.critics_embedding_dim, problem=problem, negate_outputs=opts.negate_critics_output, activation_str=opts.v1critic_activation, invert_visited=opts.v1critic_inv_visited).to(opts.device)
-    critic2 = critics_class[critic_class_str](embedding_dim=opts.critics_embedding_dim, problem=problem, negate_outputs=opts.negate_critics_output, activation_str=opts.v1critic_activation, invert_visited=opts.v1critic_inv_visited).to(opts.device)
+    critic1 = create_critic(opts, problem, actor)
+    critic2 = create_critic(opts, problem, actor)
 
     # PLACEHOLDERS
     learning_rate = 1e-3 
@@ -872,25 +1022,28 @@ def run_saved(opts, log_solutions=False, logger=None, deterministic_eval=True):
 
     if opts.rl_algorithm == 'DQN':
         policy = ts.policy.DQNPolicy(actor, optimizer, gamma, opts.n_step, target_update_freq=opts.target_freq)
-    elif opts.rl_algorithm == 'PG':
-        Policy_class = PGPolicy_custom if opts.neg_PG else ts.policy.PGPolicy
+    elif opts.rl_algorithm in ('PG', 'REINFORCE'):
+        Policy_class = PGPolicy_custom if opts.neg_PG and opts.rl_algorithm == 'PG' else ts.policy.PGPolicy
         policy = Policy_class(model=actor,
                               optim=optimizer,
                               dist_fn=distribution_type,
                               discount_factor=gamma)
     elif opts.rl_algorithm == 'PPO':
-        policy = ts.policy.PPOPolicy(actor=actor,
-                                     critic=critic1,
-                                     optim=optimizer, # NOTE: optimizer originally contains actor and critic params for PPO implementation! but here it is just used as placeholder
-                                     dist_fn=distribution_type,
-                                     discount_factor=gamma)
+        policy = PPOPolicy_custom(actor=actor,
+                                  critic=critic1,
+                                  optim=optimizer, # NOTE: optimizer originally contains actor and critic params for PPO implementation! but here it is just used as placeholder
+                                  dist_fn=distribution_type,
+                                  discount_factor=gamma)
     elif opts.rl_algorithm == 'A2C':
-        policy = ts.policy.A2CPolicy(actor=actor,
-                                     critic=critic1,
-                                     optim=optimizer,
-                                     dist_fn=distribution_type,
-                                     discount_factor=gamma)
+        policy = A2CPolicy_custom(actor=actor,
+                                  critic=critic1,
+                                  optim=optimizer,
+                                  dist_fn=distribution_type,
+                                  discount_factor=gamma)
     elif opts.rl_algorithm == 'SAC':
+        if opts.ensemble_critics:
+            critic1, critic2 = CriticEnsemble([critic1, critic2]), None
+            critic1_optimizer, critic2_optimizer = optim.Adam(critic1.parameters(), lr=learning_rate), None
         policy = DiscreteSACPolicy_custom(actor=actor, 
                                           actor_optim=optimizer,
                                           critic1=critic1,
@@ -901,56 +1054,78 @@ def run_saved(opts, log_solutions=False, logger=None, deterministic_eval=True):
         print('RL Algorithm specified is not compatible with evaluation mode.')
         return
     
-    policy.load_state_dict(torch.load(opts.saved_policy_path)) # f"policy_dir/{opts.save_name}.pth"
+    state_dict = torch.load(opts.saved_policy_path) # f"policy_dir/{opts.save_name}.pth"
+    if opts.rl_algorithm == 'SAC' and opts.ensemble_critics and any(name.startswith('critic2.') for name in state_dict):
+        # policies trained with separate twin critics
+        state_dict = convert_twin_critics_state_dict(state_dict)
+    policy.load_state_dict(state_dict)
+    if quantize:
+        assert opts.device.type == 'cpu', "Quantized inference is only supported on CPU"
+        quantize_for_inference(policy.actor if opts.rl_algorithm != 'DQN' else policy.model, quantize_attention=opts.quantize_attention)
+    if opts.compile_model:
+        compile_policy(policy)
 
     # EVALUATION /////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////
     all_rewards = []
-    logs = {}
-    logs['runs'] = []
-
-    for i in range(num_runs):
-        total_rew = np.zeros(num_eval_envs)
-        data = ts.data.Batch(obs={}, act={}, rew={}, done={}, obs_next={}, info={}, policy={})
-        data.obs = eval_envs.reset()
-        not_done_mask = np.ones(num_eval_envs, dtype=bool)
-
-        done = False
-        if log_solutions:
-            log = {}
-            log['coordinates'] = data.obs['loc'].tolist()
-            log['tour_probs'] = []
-            log['tour_indices'] = []
-        embeddings = policy.actor.encode(data.obs) if opts.rl_algorithm != 'DQN' else policy.model.encode(data.obs)
-        while not done:
-            logits, _ = policy.actor.decode(data.obs, embeddings[not_done_mask]) if opts.rl_algorithm != 'DQN' else policy.model.decode(data.obs, embeddings[not_done_mask])
-            dist = Categorical_logits(logits)
-
-            if deterministic_eval:
-                act = logits.max(dim=1)[1] # [1] for getting the indices
-            else:
-                act = dist.sample()
+    if log_solutions:
+        solution_log = SolutionLogWriter(f"eval_logs/{opts.run_name}_{opts.graph_size}", top_k=opts.log_top_k)
+
+    if opts.multi_start or opts.augment:
+        assert not log_solutions, "Multi-start and augmented evaluations do not log solutions"
+        assert not opts.multi_start or opts.problem == 'tsp', "Multi-start evaluation is only supported for the TSP"
+
+    with autocast(opts):
+        for i in range(num_runs):
+            if opts.multi_start or opts.augment:
+                # greedy tours of all start nodes and/or symmetric views of the instances in one batched decode,
+                # keeping the best one per instance
+                instances = instances_from_obs(opts.problem, ts.data.Batch(obs=eval_envs.reset()).obs, opts.device)
+                if opts.augment:
+                    instances = augment(instances, opts.augment_rotations)
+                model = policy.actor if opts.rl_algorithm != 'DQN' else policy.model
+                costs = greedy_costs(model, opts.problem, instances, multi_start=opts.multi_start)
+                if opts.augment:
+                    costs = best_of_views(costs, num_eval_envs)[0]
+                all_rewards.append(-costs.cpu().numpy())
+                continue
+
+            total_rew = np.zeros(num_eval_envs)
+            data = ts.data.Batch(obs={}, act={}, rew={}, done={}, obs_next={}, info={}, policy={})
+            data.obs = eval_envs.reset()
+            not_done_mask = np.ones(num_eval_envs, dtype=bool)
 
+            done = False
             if log_solutions:
-                log['tour_probs'].append(dist.probs.tolist())
-                log['tour_indices'].append(act.tolist())
+                solution_log.start_run(to_torch(data.obs['loc']).cpu(), n_actions=data.obs['action_mask'].shape[-1])
+            model = policy.actor if opts.rl_algorithm != 'DQN' else policy.model
+            # the instances are encoded (and their decoding candidates computed) once for all steps
+            embeddings, knn = model.encode_with_candidates(data.obs)
+            while not done:
+                logits, _ = model.decode(data.obs, embeddings[not_done_mask],
+                                         knn=knn[not_done_mask] if knn is not None else None)
+                dist = Categorical_logits(logits)
+
+                if deterministic_eval:
+                    act = logits.max(dim=1)[1] # [1] for getting the indices
+                else:
+                    act = dist.sample()
 
-            data.obs, data.rew, data.done, info = eval_envs.step(act, id=np.flatnonzero(not_done_mask))
+                if log_solutions:
+                    solution_log.log_step(np.flatnonzero(not_done_mask), dist.probs, act)
 
-            total_rew[not_done_mask] += data.rew
-            done=np.all(data.done)
-            not_done_mask[not_done_mask] = np.logical_not(data.done) # updating all values that were not done before
-            data = data[np.logical_not(data.done)]
-        all_rewards.append(total_rew)
-        if log_solutions:
-            logs['runs'].append(log)
+                data.obs, data.rew, data.done, info = eval_envs.step(act, id=np.flatnonzero(not_done_mask))
+
+                total_rew[not_done_mask] += data.rew
+                done=np.all(data.done)
+                not_done_mask[not_done_mask] = np.logical_not(data.done) # updating all values that were not done before
+                data = data[np.logical_not(data.done)]
+            all_rewards.append(total_rew)
+            if log_solutions:
+                solution_log.end_run()
 
     t1 = time.time()
     total_time = t1-t0
 
-    if log_solutions:
-        with open(f"eval_logs/{opts.run_name}" + ".json", "w") as fp:
-            json.dump(logs, fp)
-
     all_rewards = np.stack(all_rewards)
     if logger is not None:
         logger.write("eval/rew", opts.graph_size, {'rew': np.mean(all_rewards)})
@@ -958,14 +1133,18 @@ def run_saved(opts, log_solutions=False, logger=None, deterministic_eval=True):
         logger.write("eval/avg_time", opts.graph_size, {'avg_time': total_time/(num_eval_envs*num_runs)})
 
     print(f"Size: {opts.graph_size}, Mean: {np.mean(all_rewards)}, Std: {np.std(all_rewards)}, Avg Time: {total_time/(num_eval_envs*num_runs)}")
+    return np.mean(all_rewards), total_time
 
 
 
 
 
 def random_run(opts, logger=None):
+    import tianshou as ts
+    from custom_classes.random import RandomPolicy
+
     problem = load_problem(opts.problem)
-    problem_env_class = { 'tsp': TSP_env_optimized, 'op': OP_env_optimized } # _optimized
+    problem_env_class = problem_env_classes()
 
     policy = RandomPolicy()
 
@@ -987,23 +1166,39 @@ def random_run(opts, logger=None):
 
 
 
+def compare_quantized(opts, logger=None):
+    # both runs are seeded identically so they are evaluated on the same instances
+    torch.manual_seed(opts.seed)
+    np.random.seed(opts.seed)
+    rew_fp32, time_fp32 = run_saved(opts, logger=logger)
+
+    torch.manual_seed(opts.seed)
+    np.random.seed(opts.seed)
+    rew_int8, time_int8 = run_saved(opts, quantize=True)
+
+    if logger is not None:
+        logger.write("eval/quant_rew_delta", opts.graph_size, {'quant_rew_delta': rew_int8 - rew_fp32})
+        logger.write("eval/quant_speedup", opts.graph_size, {'quant_speedup': time_fp32 / time_int8})
+
+    print(f"Size: {opts.graph_size}, int8 Mean: {rew_int8}, Delta: {rew_int8 - rew_fp32}, Speedup: {time_fp32 / time_int8}")
+
+
 def evaluate(opts):
-    writer = SummaryWriter(f"log_dir/{opts.run_name}")
-    writer.add_text("args", str(opts))
-    logger = TensorboardLogger(writer, train_interval=1000, test_interval=1, update_interval=1)
+    logger = create_logger(opts)
     
     graph_sizes = [5, 10, 20, 30, 40, 50, 100] # [20, 30, 40, 50, 100] 
     for graph_size in graph_sizes:
         opts.graph_size = graph_size
         #random_run(opts, logger)
-        run_saved(opts, logger=logger)
+        if opts.quantize_eval:
+            compare_quantized(opts, logger)
+        else:
+            run_saved(opts, log_solutions=opts.log_solutions, logger=logger)
     return
 
 
 def train(opts):
-    writer = SummaryWriter(f"log_dir/{opts.run_name}")
-    writer.add_text("args", str(opts))
-    logger = TensorboardLogger(writer, train_interval=1000, test_interval=1, update_interval=1)
+    logger = create_logger(opts)
 
     problem_runner = {
         'DQN': run_DQN,
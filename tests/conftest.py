@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the repository root, so tests import the packages and scripts as run.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,64 @@
+import argparse
+import copy
+
+import numpy as np
+import pytest
+import torch
+
+import tianshou as ts
+from tianshou.policy import A2CPolicy
+
+from custom_classes.actor_critic import A2CPolicy_custom
+from nets.attention_model import AttentionModel
+from nets.v_estimator import V_Estimator
+from problems.op.op_env_optimized import OP_env_optimized
+from problems.tsp.tsp_env_optimized import TSP_env_optimized
+from run import Categorical_logits
+from utils import load_problem
+
+GRAPH_SIZE = 20  # the smallest graph size with an OP length budget
+ENV_CLASSES = {'tsp': TSP_env_optimized, 'op': OP_env_optimized}
+
+
+def unfinished_steps(buffer, batch, indices):
+    """Last steps of the episodes that are not done in the buffer, whose V(s') needs a critic pass on obs_next"""
+    return (buffer.next(indices) == indices) & ~batch.done
+
+
+def collect_buffer(policy, problem_name, n_envs=3, n_step=3 * (GRAPH_SIZE + 5)):
+    """A buffer of about n_step transitions of n_envs envs, with unfinished episodes at its end"""
+    env_opts = argparse.Namespace(device=torch.device('cpu'), data_distribution=None)
+    envs = ts.env.DummyVectorEnv([lambda: ENV_CLASSES[problem_name](env_opts, GRAPH_SIZE) for _ in range(n_envs)])
+    np.random.seed(0)
+    buffer = ts.data.VectorReplayBuffer(total_size=2 * n_step, buffer_num=n_envs)
+    collector = ts.data.Collector(policy, envs, buffer, exploration_noise=False)
+    collector.collect(n_step=n_step)
+    # all envs may just have finished an episode
+    while not unfinished_steps(buffer, *buffer.sample(0)).any():
+        collector.collect(n_step=n_envs)
+    return buffer
+
+
+@pytest.mark.parametrize('rew_norm', [False, True])
+@pytest.mark.parametrize('problem_name', ['tsp', 'op'])
+def test_episodic_values_match_a2c_returns(problem_name, rew_norm):
+    torch.manual_seed(0)
+    problem = load_problem(problem_name)
+    actor = AttentionModel(16, 16, problem, n_encode_layers=1, normalization='instance')
+    critic = V_Estimator(embedding_dim=16, problem=problem, n_encode_layers=1)
+    # a critic batch size that splits the batch, gamma and gae_lambda below 1 so that every V(s') matters
+    policy = A2CPolicy_custom(actor, critic, torch.optim.Adam([*actor.parameters(), *critic.parameters()]),
+                              Categorical_logits, discount_factor=0.9, gae_lambda=0.8, max_batchsize=16,
+                              reward_normalization=rew_norm)
+    policy.ret_rms.update(np.random.RandomState(0).randn(100) * 3)
+    baseline = copy.deepcopy(policy)
+
+    buffer = collect_buffer(policy, problem_name)
+    batch, indices = buffer.sample(0)
+
+    with torch.no_grad():
+        returns = policy._compute_returns(copy.deepcopy(batch), buffer, indices)
+        expected = A2CPolicy._compute_returns(baseline, copy.deepcopy(batch), buffer, indices)
+    for key in ('v_s', 'returns', 'adv'):
+        torch.testing.assert_close(returns[key], expected[key])
+    np.testing.assert_allclose(policy.ret_rms.var, baseline.ret_rms.var)
@@ -0,0 +1,121 @@
+import pytest
+import torch
+
+from nets.attention_model import AttentionModel
+from utils import load_problem
+from utils.random_data import random_obs, random_episodes
+from utils.rollout import random_instances, rollout
+
+GRAPH_SIZE = 20  # the smallest graph size with an OP length budget
+
+
+def create_actor(problem_name, **kwargs):
+    torch.manual_seed(0)
+    return AttentionModel(16, 16, load_problem(problem_name), n_encode_layers=2, normalization='instance', **kwargs)
+
+
+def greedy_tours(actor, problem_name, instances):
+    with torch.no_grad():
+        return rollout(actor, problem_name, instances, 'greedy')[2]
+
+
+@pytest.mark.parametrize('problem_name', ['tsp', 'op'])
+def test_knn_candidates_of_all_nodes_match_full_decoding(problem_name):
+    actor = create_actor(problem_name).eval()
+    torch.manual_seed(1)
+    instances = random_instances(problem_name, 8, GRAPH_SIZE)
+    observations = [random_obs(problem_name, 8, GRAPH_SIZE, step) for step in (0, 1, GRAPH_SIZE // 2)]
+    tours = greedy_tours(actor, problem_name, instances)
+    with torch.no_grad():
+        logits = [actor(obs)[0] for obs in observations]
+
+    # all nodes are candidates of each node
+    actor.knn_candidates = GRAPH_SIZE
+    torch.testing.assert_close(greedy_tours(actor, problem_name, instances), tours)
+    with torch.no_grad():
+        for obs, obs_logits in zip(observations, logits):
+            torch.testing.assert_close(actor(obs)[0], obs_logits)
+
+
+@pytest.mark.parametrize('network', ['actor', 'critic v3'])
+def test_grouped_instances_match_per_step_encoding(network):
+    from nets.v_estimator3 import V_Estimator3
+
+    if network == 'actor':
+        model = create_actor('tsp')
+    else:
+        torch.manual_seed(0)
+        model = V_Estimator3(embedding_dim=16, problem=load_problem('tsp'), n_encode_layers=2)
+    torch.manual_seed(1)
+    # all steps of 4 episodes, the rows of each episode share its instance
+    obs = random_episodes('tsp', 4, GRAPH_SIZE)
+
+    results = []
+    for group_instances in (False, True):
+        model.group_instances = group_instances
+        model.zero_grad()
+        outputs = model(obs)
+        outputs = outputs[0] if isinstance(outputs, tuple) else outputs
+        outputs.masked_fill(outputs < -1e8, 0).pow(2).mean().backward()
+        results.append((outputs.detach(), [param.grad.clone() for param in model.parameters() if param.grad is not None]))
+
+    (outputs, grads), (grouped_outputs, grouped_grads) = results
+    torch.testing.assert_close(grouped_outputs, outputs, rtol=1e-4, atol=1e-5)
+    assert len(grouped_grads) == len(grads)
+    for grad, grouped_grad in zip(grads, grouped_grads):
+        torch.testing.assert_close(grouped_grad, grad, rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize('problem_name', ['tsp', 'op'])
+def test_skipped_forced_moves_match_the_network(problem_name):
+    actor = create_actor(problem_name).eval()
+    torch.manual_seed(1)
+    # the last steps of the TSP episodes have a single feasible action, and every third row is restricted to its first
+    # feasible node (the depot for the OP, as at the end of the length budget)
+    obs = random_episodes(problem_name, 4, GRAPH_SIZE)
+    rows = torch.arange(0, len(obs['action_mask']), 3)
+    mask = torch.ones_like(obs['action_mask'][rows])
+    mask.scatter_(-1, (~obs['action_mask'][rows]).int().argmax(-1, keepdim=True), False)
+    obs['action_mask'][rows] = mask
+    with torch.no_grad():
+        probs = torch.softmax(actor(obs)[0], dim=-1)
+        actor.skip_forced_moves = True
+        torch.testing.assert_close(torch.softmax(actor(obs)[0], dim=-1), probs)
+
+
+@pytest.mark.parametrize('problem_name, multi_start', [('tsp', False), ('tsp', True), ('op', False)])
+def test_compacted_rollouts_match_all_nodes(problem_name, multi_start):
+    actor = create_actor(problem_name).eval()
+    torch.manual_seed(1)
+    instances = random_instances(problem_name, 8, GRAPH_SIZE)
+    with torch.no_grad():
+        _, log_likelihood, tours = rollout(actor, problem_name, instances, 'greedy', multi_start)
+        for compact_every in (1, 5):
+            actor.compact_every = compact_every
+            _, compact_log_likelihood, compact_tours = rollout(actor, problem_name, instances, 'greedy', multi_start)
+            torch.testing.assert_close(compact_tours, tours)
+            torch.testing.assert_close(compact_log_likelihood, log_likelihood)
+
+
+@pytest.mark.parametrize('problem_name, multi_start, knn_candidates', [
+    ('tsp', False, 0), ('tsp', True, 0), ('tsp', False, 5), ('op', False, 0), ('op', False, 5)])
+def test_folded_projections_match_decoding(problem_name, multi_start, knn_candidates):
+    actor = create_actor(problem_name, knn_candidates=knn_candidates)
+    torch.manual_seed(1)
+    instances = random_instances(problem_name, 8, GRAPH_SIZE)
+
+    results = []
+    for fold_projections in (False, True):
+        actor.fold_projections = fold_projections
+        actor.zero_grad()
+        _, log_likelihood, tours = rollout(actor, problem_name, instances, 'greedy', multi_start)
+        log_likelihood.mean().backward()
+        results.append((log_likelihood.detach(), tours, [param.grad.clone() for param in actor.parameters()
+                                                         if param.grad is not None]))
+
+    (log_likelihood, tours, grads), (folded_log_likelihood, folded_tours, folded_grads) = results
+    torch.testing.assert_close(folded_tours, tours)
+    torch.testing.assert_close(folded_log_likelihood, log_likelihood, rtol=1e-4, atol=1e-5)
+    assert len(folded_grads) == len(grads)
+    for grad, folded_grad in zip(grads, folded_grads):
+        torch.testing.assert_close(folded_grad, grad, rtol=1e-3, atol=1e-5)
@@ -0,0 +1,80 @@
+import pytest
+import torch
+
+from problems.tsp.problem_tsp import TSP
+from utils.augmentation import augmentation_transforms, augment, best_of_views
+from utils.rollout import random_instances
+
+BATCH_SIZE, GRAPH_SIZE = 4, 20
+
+
+def tour_lengths(loc, tours):
+    # closed tours, through the depot when it is the first node
+    coords = loc.gather(1, tours[..., None].expand(*tours.size(), 2))
+    return (coords - coords.roll(1, dims=1)).norm(p=2, dim=-1).sum(-1)
+
+
+@pytest.mark.parametrize('n_rotations', [0, 3])
+def test_views_preserve_pairwise_distances_and_tour_costs(n_rotations):
+    torch.manual_seed(0)
+    matrices, offsets = augmentation_transforms(n_rotations)
+    assert matrices.shape == (8 + n_rotations, 2, 2) and offsets.shape == (8 + n_rotations, 2)
+
+    loc = torch.rand(BATCH_SIZE, GRAPH_SIZE, 2)
+    views = torch.einsum('vij,bnj->vbni', matrices, loc) + offsets[:, None, None, :]
+    torch.testing.assert_close(views[0], loc)
+    # the dihedral views are 8 different views of the unit square
+    dihedral = views[:8]
+    assert ((dihedral >= 0) & (dihedral <= 1)).all()
+    assert len({tuple(view[0, 0].tolist()) for view in dihedral}) == 8
+    for view in views:
+        torch.testing.assert_close(torch.cdist(view, view), torch.cdist(loc, loc))
+
+    tours = torch.stack([torch.randperm(GRAPH_SIZE) for _ in range(BATCH_SIZE)])
+    costs, _ = TSP.get_costs(loc, tours)
+    for view in views:
+        torch.testing.assert_close(TSP.get_costs(view, tours)[0], costs)
+
+
+def test_augment_keeps_depot_and_prizes_aligned():
+    torch.manual_seed(0)
+    instances = random_instances('op', BATCH_SIZE, GRAPH_SIZE)
+    augmented = augment(instances, n_rotations=2)
+    n_views = 10
+    assert augmented.keys() == instances.keys()
+    for key, value in augmented.items():
+        assert value.shape == (n_views * BATCH_SIZE, *instances[key].shape[1:]), key
+
+    loc_with_depot = torch.cat((instances['depot'][:, None, :], instances['loc']), 1)
+    tours = torch.cat((torch.zeros(BATCH_SIZE, 1, dtype=torch.long),
+                       torch.stack([torch.randperm(GRAPH_SIZE)[:5] + 1 for _ in range(BATCH_SIZE)])), 1)
+    lengths = tour_lengths(loc_with_depot, tours)
+    for view in range(n_views):
+        # row view * batch_size + i is view of instance i
+        rows = slice(view * BATCH_SIZE, (view + 1) * BATCH_SIZE)
+        for key in ('prize', 'max_length'):
+            torch.testing.assert_close(augmented[key][rows], instances[key])
+        view_loc_with_depot = torch.cat((augmented['depot'][rows, None, :], augmented['loc'][rows]), 1)
+        torch.testing.assert_close(torch.cdist(view_loc_with_depot, view_loc_with_depot),
+                                   torch.cdist(loc_with_depot, loc_with_depot))
+        # the same tours through the depot have the same lengths and collect the same prizes
+        torch.testing.assert_close(tour_lengths(view_loc_with_depot, tours), lengths)
+
+
+def test_best_of_views_is_the_minimum_over_the_views_of_each_instance():
+    torch.manual_seed(0)
+    n_views = 8
+    instances = random_instances('tsp', BATCH_SIZE, GRAPH_SIZE)
+    augmented = augment(instances)
+    tours = torch.stack([torch.randperm(GRAPH_SIZE) for _ in range(BATCH_SIZE)])
+    # a cost that differs per view, as the costs of decoding each view would
+    costs = TSP.get_costs(augmented['loc'], tours.repeat(n_views, 1))[0] + torch.rand(n_views * BATCH_SIZE)
+
+    best, best_views = best_of_views(costs, BATCH_SIZE)
+    assert best.shape == best_views.shape == (BATCH_SIZE,)
+    for i in range(BATCH_SIZE):
+        instance_costs = costs[i::BATCH_SIZE]
+        assert best[i] == instance_costs.min()
+        assert best_views[i] == instance_costs.argmin()
+        torch.testing.assert_close(augmented['loc'][best_views[i] * BATCH_SIZE + i],
+                                   augment({'loc': instances['loc'][i:i + 1]})['loc'][best_views[i]])
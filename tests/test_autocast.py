@@ -0,0 +1,78 @@
+import argparse
+
+import pytest
+import torch
+
+from nets.attention_model import AttentionModel
+from nets.graph_encoder import Normalization, mask_value
+from run import autocast
+from utils import load_problem
+from utils.random_data import random_obs
+
+GRAPH_SIZE = 20  # the smallest graph size with an OP length budget
+
+
+def cpu_opts(precision):
+    return argparse.Namespace(device=torch.device('cpu'), precision=precision)
+
+
+def test_autocast_is_bf16_only_for_bf16_runs():
+    x = torch.randn(4, 4)
+    with autocast(cpu_opts('bf16')):
+        assert (x @ x).dtype == torch.bfloat16
+    with autocast(cpu_opts('fp32')):
+        assert (x @ x).dtype == torch.float32
+
+
+@pytest.mark.parametrize('dtype', [torch.float32, torch.bfloat16, torch.float16])
+def test_mask_value_is_finite_in_dtype(dtype):
+    value = torch.tensor(mask_value(dtype), dtype=dtype)
+    assert torch.isfinite(value) and value <= -6e4
+    # all masked rows do not become NaN
+    assert not torch.softmax(value.expand(3).float(), dim=-1).isnan().any()
+
+
+@pytest.mark.parametrize('normalization', ['batch', 'instance'])
+def test_normalization_of_bf16_inputs_runs_in_fp32(normalization):
+    torch.manual_seed(0)
+    norm = Normalization(16, normalization).train()
+    # far from 0 mean, where bf16 statistics lose most of their precision
+    x = (100 + torch.randn(4, 12, 16)).to(torch.bfloat16)
+    inputs = []
+    norm.normalizer.register_forward_pre_hook(lambda module, args: inputs.append(args[0].dtype))
+    expected_norm = Normalization(16, normalization).train()
+    expected_norm.load_state_dict(norm.state_dict())
+
+    with autocast(cpu_opts('bf16')):
+        output = norm(x)
+    assert inputs == [torch.float32] and output.dtype == torch.bfloat16
+    torch.testing.assert_close(output, expected_norm(x.float()).to(torch.bfloat16))
+    for buffer, expected_buffer in zip(norm.buffers(), expected_norm.buffers()):
+        assert buffer.dtype == expected_buffer.dtype
+        torch.testing.assert_close(buffer, expected_buffer)
+
+
+@pytest.mark.parametrize('problem_name', ['tsp', 'op'])
+def test_bf16_actor_logits_are_fp32_and_finite(problem_name):
+    torch.manual_seed(0)
+    actor = AttentionModel(32, 32, load_problem(problem_name), n_encode_layers=2, normalization='instance').eval()
+    obs = random_obs(problem_name, 8, GRAPH_SIZE, step=GRAPH_SIZE // 2)
+    # a done env, in which every node is masked
+    obs['action_mask'][0] = True
+    normalizer_inputs = []
+    for module in actor.modules():
+        if isinstance(module, Normalization):
+            module.normalizer.register_forward_pre_hook(lambda module, args: normalizer_inputs.append(args[0].dtype))
+
+    with torch.no_grad():
+        logits, _ = actor(obs)
+        with autocast(cpu_opts('bf16')):
+            bf16_logits, _ = actor(obs)
+
+    assert normalizer_inputs and set(normalizer_inputs) == {torch.float32}
+    assert bf16_logits.dtype == torch.float32
+    assert torch.isfinite(bf16_logits).all()
+    mask = obs['action_mask'].view(bf16_logits.size())
+    assert (bf16_logits[mask] == mask_value(torch.float32)).all()
+    assert (bf16_logits[~mask] > mask_value(torch.float32)).all()
+    torch.testing.assert_close(bf16_logits[~mask], logits[~mask], rtol=0.05, atol=0.05)
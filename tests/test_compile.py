@@ -0,0 +1,35 @@
+import copy
+
+import pytest
+import torch
+
+from nets.attention_model import AttentionModel
+from nets.v_estimator import V_Estimator
+from nets.v_estimator3 import V_Estimator3
+from utils import load_problem, compile_model
+from utils.random_data import random_obs
+
+NETWORKS = {
+    'actor': lambda problem: AttentionModel(16, 16, problem, n_encode_layers=2),
+    'critic v1': lambda problem: V_Estimator(embedding_dim=16, problem=problem, n_encode_layers=2),
+    'critic v3': lambda problem: V_Estimator3(embedding_dim=16, problem=problem, n_encode_layers=2),
+}
+
+
+@pytest.mark.parametrize('problem_name', ['tsp', 'op'])
+@pytest.mark.parametrize('network', NETWORKS)
+def test_compiled_outputs_match_eager(network, problem_name):
+    torch.manual_seed(0)
+    eager = NETWORKS[network](load_problem(problem_name)).eval()
+    compiled = compile_model(copy.deepcopy(eager))
+
+    # compile_model turns the decoder checks off, turning them back on has to keep the compiled outputs
+    for debug_checks in (False, True):
+        eager.debug_checks = compiled.debug_checks = debug_checks
+        with torch.no_grad():
+            for step in (0, 5):
+                obs = random_obs(problem_name, 8, 10, step)
+                out_eager, out_compiled = eager(obs), compiled(obs)
+                if isinstance(out_eager, tuple):
+                    out_eager, out_compiled = out_eager[0], out_compiled[0]
+                torch.testing.assert_close(out_compiled, out_eager, rtol=1e-4, atol=1e-5)
@@ -0,0 +1,97 @@
+import copy
+
+import pytest
+import torch
+
+from custom_classes.discrete_sac import DiscreteSACPolicy_custom
+from nets.attention_model import AttentionModel
+from nets.critic_ensemble import CriticEnsemble, convert_twin_critics_state_dict
+from nets.v_estimator import V_Estimator
+from nets.v_estimator3 import V_Estimator3
+from utils import load_problem
+from utils.random_data import random_obs
+
+CRITIC_CLASSES = {'v1': V_Estimator, 'v3': V_Estimator3}
+
+
+def create_critics(critic_class, problem_name='tsp', normalization='instance'):
+    torch.manual_seed(0)
+    return [CRITIC_CLASSES[critic_class](embedding_dim=16, problem=load_problem(problem_name), n_encode_layers=2,
+                                         normalization=normalization, q_outputs=True) for _ in range(2)]
+
+
+def randomize_buffers(critics):
+    # running statistics of batch normalization that differ between the critics
+    for critic in critics:
+        for buffer in critic.buffers():
+            if buffer.is_floating_point():
+                buffer.copy_(torch.rand_like(buffer) + 0.5)
+
+
+def create_policy(critic1, critic2):
+    torch.manual_seed(1)
+    actor = AttentionModel(16, 16, load_problem('tsp'), n_encode_layers=1, normalization='instance')
+    return DiscreteSACPolicy_custom(actor, torch.optim.Adam(actor.parameters()),
+                                    critic1, torch.optim.Adam(critic1.parameters()),
+                                    critic2, torch.optim.Adam(critic2.parameters()) if critic2 is not None else None)
+
+
+@pytest.mark.parametrize('normalization', ['instance', 'batch'])
+@pytest.mark.parametrize('problem_name', ['tsp', 'op'])
+@pytest.mark.parametrize('critic_class', CRITIC_CLASSES)
+def test_ensemble_matches_separate_critics(critic_class, problem_name, normalization):
+    critics = create_critics(critic_class, problem_name, normalization)
+    randomize_buffers(critics)
+    ensemble = CriticEnsemble(critics).eval()
+    obs = random_obs(problem_name, 8, 10, step=3)
+    with torch.no_grad():
+        expected = torch.stack([critic.eval()(obs) for critic in critics])
+        torch.testing.assert_close(ensemble(obs), expected, rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize('critic_class', CRITIC_CLASSES)
+def test_twin_critics_checkpoint_loads_into_ensemble(critic_class):
+    twin_policy = create_policy(*create_critics(critic_class, normalization='batch'))
+    # targets that differ from the critics, so that a mixup of critic1/critic2 and their targets shows
+    for critic in (twin_policy.critic1_old, twin_policy.critic2_old):
+        with torch.no_grad():
+            for param in critic.parameters():
+                param.add_(torch.randn_like(param) * 0.1)
+        randomize_buffers([critic])
+    state_dict = twin_policy.state_dict()
+    assert any(name.startswith('critic2_old.') for name in state_dict)
+
+    critics = create_critics(critic_class, normalization='batch')
+    ensemble_policy = create_policy(CriticEnsemble(critics), None)
+    ensemble_policy.load_state_dict(convert_twin_critics_state_dict(state_dict))
+
+    obs = random_obs('tsp', 8, 10, step=3)
+    twin_policy.eval()
+    ensemble_policy.eval()
+    with torch.no_grad():
+        for suffix in ('', '_old'):
+            expected = torch.stack([getattr(twin_policy, f'critic{i}{suffix}').eval()(obs) for i in (1, 2)])
+            torch.testing.assert_close(getattr(ensemble_policy, f'critic1{suffix}').eval()(obs), expected,
+                                       rtol=1e-5, atol=1e-6)
+        torch.testing.assert_close(ensemble_policy.actor(obs)[0], twin_policy.actor(obs)[0])
+
+
+def test_polyak_update_matches_soft_update_of_separate_critics():
+    critics, targets = create_critics('v3', normalization='batch'), create_critics('v3', normalization='batch')
+    with torch.no_grad():
+        for param in (param for critic in critics for param in critic.parameters()):
+            param.add_(1.)
+    randomize_buffers(critics)
+    ensemble, target_ensemble = CriticEnsemble(critics), CriticEnsemble(targets)
+    target_buffers = copy.deepcopy(list(target_ensemble.buffers()))
+
+    target_ensemble.polyak_update_(ensemble, 0.1)
+    policy = create_policy(*critics)
+    for critic, target in zip(critics, targets):
+        policy.soft_update(target, critic, 0.1)
+    expected = CriticEnsemble(targets)
+    for param, expected_param in zip(target_ensemble.parameters(), expected.parameters()):
+        torch.testing.assert_close(param, expected_param)
+    # buffers are not moved
+    for buffer, target_buffer in zip(target_ensemble.buffers(), target_buffers):
+        torch.testing.assert_close(buffer, target_buffer)
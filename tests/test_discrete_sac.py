@@ -0,0 +1,131 @@
+import numpy as np
+import pytest
+import torch
+
+from tianshou.data import Batch, ReplayBuffer, VectorReplayBuffer, to_torch
+
+from benchmark import fill_replay_buffer
+from custom_classes.discrete_sac import DiscreteSACPolicy_custom
+from nets.attention_model import AttentionModel
+from nets.v_estimator import V_Estimator
+from nets.v_estimator3 import V_Estimator3
+from utils import load_problem
+
+GRAPH_SIZE = 10
+N_EPISODES = 6
+CRITIC_CLASSES = {'v1': V_Estimator, 'v3': V_Estimator3}
+
+
+class BaselineDiscreteSACPolicy(DiscreteSACPolicy_custom):
+    """The target and update of separate twin critics before done rows were skipped and critic forwards reused"""
+
+    def _target_q(self, buffer: ReplayBuffer, indices: np.ndarray) -> torch.Tensor:
+        batch = buffer[indices]  # batch.obs: s_{t+n}
+        obs_next_result = self(batch, input="obs_next", are_next_obs=True)
+        dist = obs_next_result.dist
+
+        target_q = torch.zeros(len(batch), device=obs_next_result.logits.device)
+        not_done_targets = dist.probs * torch.min(
+            self.critic1_old(batch.obs_next),
+            self.critic2_old(batch.obs_next),
+        )[obs_next_result.not_done_mask]
+
+        not_done_targets = not_done_targets.sum(dim=-1) + self._alpha * dist.entropy()
+        target_q[obs_next_result.not_done_mask] = not_done_targets
+
+        return target_q
+
+    def learn(self, batch: Batch, **kwargs):
+        weight = batch.pop("weight", 1.0)
+        target_q = batch.returns.flatten()
+        act = to_torch(
+            batch.act[:, np.newaxis], device=target_q.device, dtype=torch.long
+        )
+
+        # critic 1
+        current_q1 = self.critic1(batch.obs).gather(1, act).flatten()
+        td1 = current_q1 - target_q
+        critic1_loss = (td1.pow(2) * weight).mean()
+
+        self.critic1_optim.zero_grad()
+        critic1_loss.backward()
+        self.critic1_optim.step()
+
+        # critic 2
+        current_q2 = self.critic2(batch.obs).gather(1, act).flatten()
+        td2 = current_q2 - target_q
+        critic2_loss = (td2.pow(2) * weight).mean()
+
+        self.critic2_optim.zero_grad()
+        critic2_loss.backward()
+        self.critic2_optim.step()
+        batch.weight = (td1 + td2) / 2.0  # prio-buffer
+
+        # actor
+        dist = self(batch).dist
+        entropy = dist.entropy()
+        with torch.no_grad():
+            current_q1a = self.critic1(batch.obs)
+            current_q2a = self.critic2(batch.obs)
+            q = torch.min(current_q1a, current_q2a)
+        actor_loss = -(self._alpha * entropy + (dist.probs * q).sum(dim=-1)).mean()
+        self.actor_optim.zero_grad()
+        actor_loss.backward()
+        self.actor_optim.step()
+
+        self.sync_weight()
+
+        return {
+            "loss/actor": actor_loss.item(),
+            "loss/critic1": critic1_loss.item(),
+            "loss/critic2": critic2_loss.item(),
+        }
+
+
+def create_policy(policy_class, problem_name, critic_class):
+    torch.manual_seed(0)
+    problem = load_problem(problem_name)
+    actor = AttentionModel(16, 16, problem, n_encode_layers=1, normalization='instance')
+    critic1, critic2 = (CRITIC_CLASSES[critic_class](embedding_dim=16, problem=problem, n_encode_layers=1,
+                                                     q_outputs=True) for _ in range(2))
+    # without parameter updates, the baseline's actor loss on the Q-values after the critic steps equals the one on
+    # the Q-values of the critic forward before them, and the gradients of all networks can be compared
+    return policy_class(actor, torch.optim.SGD(actor.parameters(), lr=0.),
+                        critic1, torch.optim.SGD(critic1.parameters(), lr=0.),
+                        critic2, torch.optim.SGD(critic2.parameters(), lr=0.), gamma=0.9, alpha=0.1)
+
+
+@pytest.mark.parametrize('critic_class', CRITIC_CLASSES)
+@pytest.mark.parametrize('problem_name', ['tsp', 'op'])
+def test_sac_update_matches_separate_critics(problem_name, critic_class):
+    np.random.seed(0)
+    torch.manual_seed(1)
+    # the last transition of each episode is done
+    buffer = fill_replay_buffer(VectorReplayBuffer(total_size=N_EPISODES * GRAPH_SIZE, buffer_num=N_EPISODES),
+                                problem_name, N_EPISODES, GRAPH_SIZE)
+    indices = np.sort(buffer.sample_indices(0))
+    assert buffer.done[indices].any() and not buffer.done[indices].all()
+
+    results = []
+    for policy_class in (DiscreteSACPolicy_custom, BaselineDiscreteSACPolicy):
+        policy = create_policy(policy_class, problem_name, critic_class)
+        with torch.no_grad():
+            target_q = policy._target_q(buffer, indices)
+        batch = policy.process_fn(buffer[indices], buffer, indices)
+        losses = policy.learn(batch)
+        grads = {name: param.grad.clone() for name, param in policy.named_parameters() if param.grad is not None}
+        results.append((target_q, batch.returns, losses, batch.weight, grads))
+
+    (target_q, returns, losses, weight, grads), (expected_target_q, expected_returns, expected_losses,
+                                                  expected_weight, expected_grads) = results
+    # done rows have a target of 0
+    assert (target_q[torch.as_tensor(buffer.done[indices])] == 0).all()
+    torch.testing.assert_close(target_q, expected_target_q)
+    torch.testing.assert_close(returns, expected_returns)
+    assert losses.keys() == expected_losses.keys()
+    for key in losses:
+        assert losses[key] == pytest.approx(expected_losses[key], rel=1e-5), key
+    torch.testing.assert_close(weight, expected_weight)
+    assert grads.keys() == expected_grads.keys()
+    for name in grads:
+        torch.testing.assert_close(grads[name], expected_grads[name], rtol=1e-4, atol=1e-6, msg=name)
@@ -0,0 +1,49 @@
+import torch
+
+from nets.graph_encoder import GraphAttentionEncoder
+
+
+def encoder_inputs(batch_size=4, graph_size=12, embed_dim=16):
+    torch.manual_seed(0)
+    return torch.randn(batch_size, graph_size, embed_dim), torch.rand(batch_size, graph_size, 2)
+
+
+def test_sparse_encoder_with_all_neighbours_matches_dense():
+    x, coords = encoder_inputs()
+    encoder = GraphAttentionEncoder(n_heads=4, embed_dim=16, n_layers=2, normalization='instance').eval()
+    with torch.no_grad():
+        dense, _ = encoder(x, coords=coords)
+        encoder.knn_neighbours = x.size(1)
+        sparse, _ = encoder(x, coords=coords)
+    torch.testing.assert_close(sparse, dense, rtol=1e-5, atol=1e-5)
+
+
+def test_checkpointed_encoder_matches_gradients_and_batch_statistics():
+    x, coords = encoder_inputs()
+    results = []
+    for checkpoint_layers in (0, 1, 2):
+        torch.manual_seed(1)
+        encoder = GraphAttentionEncoder(n_heads=4, embed_dim=16, n_layers=3, normalization='batch',
+                                        checkpoint_layers=checkpoint_layers).train()
+        h, graph_embedding = encoder(x, coords=coords)
+        (h.pow(2).mean() + graph_embedding.sum()).backward()
+        results.append(([param.grad for param in encoder.parameters()], list(encoder.buffers())))
+
+    (grads, buffers), *checkpointed = results
+    for checkpointed_grads, checkpointed_buffers in checkpointed:
+        for grad, checkpointed_grad in zip(grads, checkpointed_grads):
+            torch.testing.assert_close(checkpointed_grad, grad)
+        # the recomputation in the backward pass does not update the running statistics again
+        for buffer, checkpointed_buffer in zip(buffers, checkpointed_buffers):
+            torch.testing.assert_close(checkpointed_buffer, buffer)
+
+
+def test_chunked_attention_matches_dense():
+    x, coords = encoder_inputs(graph_size=30)
+    encoder = GraphAttentionEncoder(n_heads=4, embed_dim=16, n_layers=2, normalization='instance').eval()
+    with torch.no_grad():
+        dense, _ = encoder(x, coords=coords)
+        # compatibilities of 28 keys per block (n_heads * batch_size * 4 bytes each), so the last key block is partial
+        encoder.attention_memory_budget = 4 * 4 * 4 * 28
+        chunked, _ = encoder(x, coords=coords)
+    torch.testing.assert_close(chunked, dense, rtol=1e-5, atol=1e-5)
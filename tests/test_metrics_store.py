@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+import pytest
+from torch.utils.tensorboard import SummaryWriter
+
+from utils.metrics_store import MetricsStore, read_scalar_events, read_csv, figure_scalars
+
+
+def log_scalars(writer, tag, steps):
+    for step in steps:
+        writer.add_scalar(tag, step / 4, step)
+    writer.flush()
+
+
+def test_update_appends_only_new_events(tmp_path):
+    log_dir = str(tmp_path / 'log_dir')
+    writer_a, writer_b = SummaryWriter(os.path.join(log_dir, 'run_a')), SummaryWriter(os.path.join(log_dir, 'run_b'))
+    writer_a.add_text('args', 'not a scalar')
+    log_scalars(writer_a, 'test/rew', range(3))
+    log_scalars(writer_a, 'train/loss', range(2))
+    log_scalars(writer_b, 'test/rew', range(10, 14))
+
+    store = MetricsStore(log_dir)
+    # both event files are parsed in parallel
+    assert store.update(processes=2) == ['run_a', 'run_b']
+    store.write_csvs(['run_a', 'run_b'])
+    columns = {name: values.copy() for name, values in store.columns.items()}
+    assert len(columns['value']) == 9
+    rew_a = read_csv(os.path.join(log_dir, 'csvs', 'testrew', 'run_a.csv'))
+    np.testing.assert_array_equal(rew_a['Steps'], [0, 1, 2])
+    np.testing.assert_allclose(rew_a['test/rew'], [0, 0.25, 0.5])
+    assert MetricsStore(log_dir).update(processes=1) == []
+
+    # a fresh store continues from the offsets of the previous export
+    log_scalars(writer_a, 'test/rew', range(3, 5))
+    store = MetricsStore(log_dir)
+    assert store.update(processes=1) == ['run_a']
+    store.write_csvs(['run_a'])
+    assert len(store.columns['value']) == 11
+    for name, values in columns.items():
+        np.testing.assert_array_equal(store.columns[name][:9], values)
+    np.testing.assert_array_equal(store.columns['step'][9:], [3, 4])
+
+    rew_a = read_csv(os.path.join(log_dir, 'csvs', 'testrew', 'run_a.csv'))
+    np.testing.assert_array_equal(rew_a['Steps'], [0, 1, 2, 3, 4])
+    np.testing.assert_allclose(rew_a['test/rew'], [0, 0.25, 0.5, 0.75, 1])
+    assert store.tags('run_a') == ['test/rew', 'train/loss']
+
+    # runs in the store are read from it, others from their csvs
+    os.makedirs(os.path.join(log_dir, 'csvs', 'testrew'), exist_ok=True)
+    with open(os.path.join(log_dir, 'csvs', 'testrew', 'run_c.csv'), 'w') as f:
+        f.write(';test/rew;Steps;Wall_Time\n0;7.0;5;1000.0\n')
+    figure_meta = {'key_path': os.path.join(log_dir, 'csvs', 'testrew'), 'y_df_label': 'test/rew',
+                   'run_names': ['run_b', 'run_c']}
+    rew_b, rew_c = figure_scalars(figure_meta)
+    np.testing.assert_array_equal(rew_b['Steps'], [10, 11, 12, 13])
+    np.testing.assert_allclose(rew_b['test/rew'], [2.5, 2.75, 3, 3.25])
+    np.testing.assert_array_equal(rew_c['Steps'], [5])
+    np.testing.assert_allclose(rew_c['test/rew'], [7.0])
+    writer_a.close()
+    writer_b.close()
+
+
+def test_partial_trailing_record_is_read_on_the_next_call(tmp_path):
+    writer = SummaryWriter(str(tmp_path / 'run'))
+    log_scalars(writer, 'test/rew', range(3))
+    writer.close()
+    event_file, = [os.path.join(tmp_path, 'run', name) for name in os.listdir(tmp_path / 'run')]
+    with open(event_file, 'rb') as f:
+        data = f.read()
+
+    partial_file = str(tmp_path / 'events.out.tfevents.partial')
+    with open(partial_file, 'wb') as f:
+        f.write(data[:-5])
+    tags, steps, values, _, offset = read_scalar_events(partial_file)
+    assert steps == [0, 1] and tags == ['test/rew'] * 2
+    assert offset < len(data) - 5
+
+    with open(partial_file, 'ab') as f:
+        f.write(data[-5:])
+    tags, steps, values, _, end = read_scalar_events(partial_file, offset)
+    assert steps == [2] and values == [pytest.approx(0.5)]
+    assert end == len(data)
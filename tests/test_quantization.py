@@ -0,0 +1,87 @@
+import copy
+import os
+
+import pytest
+import torch
+
+import run
+from nets.attention_model import AttentionModel
+from nets.graph_encoder import MultiHeadAttention, LinearMultiHeadAttention
+from options import get_options
+from utils import load_problem, quantize_for_inference
+from utils.rollout import random_instances, rollout
+
+GRAPH_SIZE = 20  # the smallest graph size with an OP length budget
+# relative difference of the mean greedy costs of the quantized and fp32 actors
+COST_TOLERANCE = 0.05
+
+
+@pytest.mark.parametrize('quantize_attention', [False, True])
+@pytest.mark.parametrize('problem_name', ['tsp', 'op'])
+def test_quantized_actor_decodes_valid_tours_close_to_fp32(problem_name, quantize_attention):
+    torch.manual_seed(0)
+    problem = load_problem(problem_name)
+    actor = AttentionModel(64, 64, problem, n_encode_layers=2, normalization='instance').eval()
+    quantized = quantize_for_inference(copy.deepcopy(actor), quantize_attention=quantize_attention)
+
+    # all linear layers but the input embeddings are quantized
+    linear_layers = {name: type(module) for name, module in quantized.named_modules()
+                     if isinstance(module, (torch.nn.Linear, torch.ao.nn.quantized.dynamic.Linear))}
+    assert {layer for name, layer in linear_layers.items() if name.startswith('init_embed')} == {torch.nn.Linear}
+    assert {layer for name, layer in linear_layers.items() if not name.startswith('init_embed')} == {
+        torch.ao.nn.quantized.dynamic.Linear}
+    attention_layers = [type(module) for module in quantized.modules()
+                        if isinstance(module, (MultiHeadAttention, LinearMultiHeadAttention))]
+    assert attention_layers and set(attention_layers) == {LinearMultiHeadAttention if quantize_attention
+                                                          else MultiHeadAttention}
+
+    torch.manual_seed(1)
+    instances = random_instances(problem_name, 128, GRAPH_SIZE)
+    with torch.no_grad():
+        cost, _, _ = rollout(actor, problem_name, instances, 'greedy')
+        quantized_cost, _, tours = rollout(quantized, problem_name, instances, 'greedy')
+    # get_costs asserts that the tours are valid, including the length budget of the OP
+    problem_costs, _ = problem.get_costs(instances if problem_name == 'op' else instances['loc'], tours)
+    torch.testing.assert_close(problem_costs, quantized_cost)
+    assert abs(quantized_cost.mean() - cost.mean()) <= COST_TOLERANCE * abs(cost.mean())
+
+
+def test_linear_multi_head_attention_matches_multi_head_attention():
+    torch.manual_seed(0)
+    attention = MultiHeadAttention(n_heads=4, input_dim=32, embed_dim=32)
+    q, h = torch.randn(3, 5, 32), torch.randn(3, 7, 32)
+    linear_attention = LinearMultiHeadAttention(attention)
+    with torch.no_grad():
+        torch.testing.assert_close(linear_attention(q, h), attention(q, h))
+        torch.testing.assert_close(linear_attention(h), attention(h))
+
+
+class RecordingLogger(object):
+
+    def __init__(self):
+        self.records = {}
+
+    def write(self, step_type, step, data):
+        self.records[step_type] = data
+
+
+@pytest.mark.parametrize('quantize_attention', [False, True])
+def test_compare_quantized_reports_a_small_reward_delta(tmp_path, monkeypatch, quantize_attention):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('args')
+    opts = get_options(['--rl_algorithm', 'PG', '--embedding_dim', '32', '--hidden_dim', '32',
+                        '--n_encode_layers', '2', '--seed', '0', '--quantize_attention', str(int(quantize_attention))])
+    opts.device, opts.graph_size = torch.device('cpu'), 10
+
+    torch.manual_seed(0)
+    actor = AttentionModel(opts.embedding_dim, opts.hidden_dim, load_problem(opts.problem),
+                           n_encode_layers=opts.n_encode_layers, normalization=opts.normalization)
+    opts.saved_policy_path = str(tmp_path / 'policy.pth')
+    torch.save({'actor.' + name: value for name, value in actor.state_dict().items()}, opts.saved_policy_path)
+
+    logger = RecordingLogger()
+    run.compare_quantized(opts, logger)
+    rew = logger.records['eval/rew']['rew']
+    assert rew < 0
+    assert abs(logger.records['eval/quant_rew_delta']['quant_rew_delta']) <= COST_TOLERANCE * abs(rew)
+    assert logger.records['eval/quant_speedup']['quant_speedup'] > 0
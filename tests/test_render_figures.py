@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+
+from render_figures import CsvCache, inputs_digest
+from utils.metrics_store import figure_scalars
+
+
+def write_csv(path, values):
+    with open(path, 'w') as f:
+        f.write(';rew;Steps;Wall_Time\n')
+        for i, value in enumerate(values):
+            f.write('{};{};{};{}\n'.format(i, value, i * 10, 1000.0 + i))
+
+
+def test_csv_cache_reuses_unchanged_csvs(tmp_path):
+    path = str(tmp_path / 'run.csv')
+    write_csv(path, [1.0, 2.0, 3.0])
+    cache = CsvCache(str(tmp_path / 'cache'))
+
+    columns = cache(path)
+    np.testing.assert_array_equal(columns['rew'], [1.0, 2.0, 3.0])
+    np.testing.assert_array_equal(columns['Steps'], [0, 10, 20])
+    assert len(os.listdir(cache.cache_dir)) == 1
+    np.testing.assert_array_equal(cache(path)['rew'], columns['rew'])
+
+    # a changed csv (size and modification time) is parsed again
+    write_csv(path, [1.0, 2.0, 3.0, 4.0])
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10 ** 9))
+    np.testing.assert_array_equal(cache(path)['rew'], [1.0, 2.0, 3.0, 4.0])
+
+
+def test_inputs_digest_tracks_spec_and_data(tmp_path):
+    key_path = tmp_path / 'log_dir' / 'csvs' / 'rew'
+    key_path.mkdir(parents=True)
+    write_csv(str(key_path / 'run_a.csv'), [1.0, 2.0])
+    figure_meta = {'key_path': str(key_path), 'y_df_label': 'rew', 'run_names': ['run_a'], 'plot_filename': 'a'}
+
+    digest = inputs_digest(figure_meta, figure_scalars(figure_meta))
+    assert digest == inputs_digest(figure_meta, figure_scalars(figure_meta))
+    assert digest != inputs_digest({**figure_meta, 'plot_filename': 'b'}, figure_scalars(figure_meta))
+
+    write_csv(str(key_path / 'run_a.csv'), [1.0, 2.5])
+    assert digest != inputs_digest(figure_meta, figure_scalars(figure_meta))
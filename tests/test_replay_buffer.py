@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from tianshou.data import Batch
+
+from custom_classes.replay_buffer import EpisodeGroupedVectorReplayBuffer
+
+
+def fill_buffer(episode_lengths, size_per_buffer, group_size):
+    """
+    A buffer with one sub buffer per list of episode lengths, whose episodes are added in order. The last episode of
+    each sub buffer is unfinished and the first ones are (partly) overwritten when they don't fit in size_per_buffer.
+    Observations are the episode number and the step in the episode.
+    """
+    buffer = EpisodeGroupedVectorReplayBuffer(total_size=size_per_buffer * len(episode_lengths),
+                                              buffer_num=len(episode_lengths), group_size=group_size)
+    episode = 0
+    for buffer_id, lengths in enumerate(episode_lengths):
+        for i, length in enumerate(lengths):
+            for step in range(length):
+                done = step == length - 1 and i < len(lengths) - 1
+                buffer.add(Batch(obs={'episode': [episode], 'step': [step]}, act=[0], rew=[0.], terminated=[done],
+                                 truncated=[False], obs_next={'episode': [episode], 'step': [step + 1]}, info={}),
+                           buffer_ids=[buffer_id])
+            episode += 1
+    return buffer
+
+
+EPISODE_LENGTHS = [[5, 3, 7, 2], [1, 6, 4], [8, 2]]
+
+
+@pytest.mark.parametrize('size_per_buffer', [20, 9])
+def test_episode_indices_are_the_stored_steps_of_the_episodes(size_per_buffer):
+    buffer = fill_buffer(EPISODE_LENGTHS, size_per_buffer, group_size=4)
+    index = buffer.sample_indices(0)
+    episodes = buffer.episode_indices(index)
+
+    for i, row in zip(index, episodes):
+        steps = row[row >= 0]
+        # the stored steps of the episode of the transition, consecutive and in order
+        assert (row[len(steps):] == -1).all()
+        assert i in steps
+        assert (buffer.obs.episode[steps] == buffer.obs.episode[i]).all()
+        assert (np.diff(buffer.obs.step[steps]) == 1).all()
+        same_episode = np.flatnonzero(buffer.obs.episode[index] == buffer.obs.episode[i])
+        assert sorted(steps) == sorted(index[same_episode])
+
+
+@pytest.mark.parametrize('size_per_buffer', [20, 9])
+@pytest.mark.parametrize('group_size, batch_size', [(1, 16), (3, 12), (4, 10), (4, 3), (3, 60)])
+def test_grouped_samples_are_written_transitions_of_one_episode(size_per_buffer, group_size, batch_size):
+    np.random.seed(0)
+    buffer = fill_buffer(EPISODE_LENGTHS, size_per_buffer, group_size)
+    written = set(buffer.sample_indices(0))
+
+    for _ in range(20):
+        index = buffer.sample_indices(batch_size)
+        assert len(index) == batch_size
+        assert set(index) <= written
+        if group_size == 1:
+            continue
+        # groups of group_size transitions, the last one shorter when group_size does not divide batch_size
+        for start in range(0, batch_size, group_size):
+            group = index[start:start + group_size]
+            episode = buffer.obs.episode[group]
+            assert (episode == episode[0]).all()
+            # without replacement as long as the stored part of the episode is long enough
+            episode_length = (buffer.obs.episode[list(written)] == episode[0]).sum()
+            assert len(np.unique(group)) == min(len(group), episode_length)
+
+
+def test_more_groups_than_stored_episodes():
+    np.random.seed(0)
+    # 2 episodes of 3 and 2 steps, 8 groups of 4 transitions each
+    buffer = fill_buffer([[3], [2]], 10, group_size=4)
+    written = set(buffer.sample_indices(0))
+    index = buffer.sample_indices(30)
+
+    assert len(index) == 30
+    assert set(index) <= written
+    for start in range(0, 30, 4):
+        group = index[start:start + 4]
+        assert len(set(buffer.obs.episode[group])) == 1
+        # every step of the episode is in the group before any is repeated
+        assert len(np.unique(group)) == min(len(group), 3 if buffer.obs.episode[group[0]] == 0 else 2)
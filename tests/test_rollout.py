@@ -0,0 +1,127 @@
+import argparse
+import copy
+
+import numpy as np
+import pytest
+import torch
+
+import utils.rollout
+from nets.attention_model import AttentionModel
+from problems.op.op_env_optimized import OP_env_optimized
+from problems.tsp.tsp_env_optimized import TSP_env_optimized
+from utils import load_problem
+from utils.rollout import instances_from_obs, random_instances, rollout, greedy_costs, POMOBaseline, RolloutBaseline
+
+GRAPH_SIZE = 20  # the smallest graph size with an OP length budget
+ENV_CLASSES = {'tsp': TSP_env_optimized, 'op': OP_env_optimized}
+
+
+def create_actor(problem_name):
+    torch.manual_seed(0)
+    return AttentionModel(16, 16, load_problem(problem_name), n_encode_layers=1, normalization='instance')
+
+
+def env_rewards(envs, tours):
+    """Cumulative rewards of the envs for the actions of the tours, which must all be allowed by the envs"""
+    total_rewards = []
+    for env, tour in zip(envs, tours):
+        total_reward, done = 0., False
+        for action in tour:
+            assert not done
+            assert not env.get_obs()['action_mask'][0, action]
+            _, reward, done, _ = env.step(action)
+            total_reward += float(reward)
+            if done:
+                # OP tours stay at the depot after returning to it
+                break
+        assert done
+        total_rewards.append(total_reward)
+    return torch.tensor(total_rewards)
+
+
+@pytest.mark.parametrize('decode_type', ['greedy', 'sampling'])
+@pytest.mark.parametrize('problem_name', ['tsp', 'op'])
+def test_rollout_costs_match_env_rewards(problem_name, decode_type):
+    np.random.seed(0)
+    opts = argparse.Namespace(device=torch.device('cpu'), data_distribution=None)
+    envs = [ENV_CLASSES[problem_name](opts, GRAPH_SIZE) for _ in range(6)]
+    obs = [env.get_obs() for env in envs]
+    instances = instances_from_obs(problem_name, {key: torch.stack([o[key] for o in obs]) for key in obs[0]})
+
+    torch.manual_seed(1)
+    with torch.no_grad():
+        cost, log_likelihood, tours = rollout(create_actor(problem_name).eval(), problem_name, instances, decode_type)
+    assert cost.shape == log_likelihood.shape == (len(envs),)
+    assert (log_likelihood <= 0).all()
+    torch.testing.assert_close(cost, -env_rewards(envs, tours))
+
+
+def test_multi_start_rollout_costs_match_env_rewards():
+    np.random.seed(0)
+    opts = argparse.Namespace(device=torch.device('cpu'), data_distribution=None)
+    envs = [TSP_env_optimized(opts, GRAPH_SIZE) for _ in range(2)]
+    instances = instances_from_obs('tsp', {'loc': torch.stack([env.loc for env in envs])})
+
+    actor = create_actor('tsp').eval()
+    with torch.no_grad():
+        cost, _, tours = rollout(actor, 'tsp', instances, 'greedy', multi_start=True)
+    # rows by instance, then by start node
+    assert cost.shape == (2 * GRAPH_SIZE,)
+    torch.testing.assert_close(tours[:, 0], torch.arange(GRAPH_SIZE).repeat(2))
+    env_copies = [copy.deepcopy(env) for env in envs for _ in range(GRAPH_SIZE)]
+    torch.testing.assert_close(cost, -env_rewards(env_copies, tours))
+    torch.testing.assert_close(greedy_costs(actor, 'tsp', instances, multi_start=True),
+                               cost.view(2, GRAPH_SIZE).min(dim=1)[0])
+    torch.testing.assert_close(POMOBaseline().eval(instances, cost),
+                               cost.view(2, GRAPH_SIZE).mean(dim=1).repeat_interleave(GRAPH_SIZE))
+
+
+GREEDY_COSTS = utils.rollout.greedy_costs
+
+
+def greedy_costs_shifted(model, problem_name, instances, multi_start=False):
+    # the greedy costs of the model, shifted by about cost_shift to make it a better or worse candidate than the baseline
+    costs = GREEDY_COSTS(model, problem_name, instances, multi_start)
+    if hasattr(model, 'cost_shift'):
+        costs = costs + model.cost_shift + 0.1 * (instances['loc'][:, 0, 0] - 0.5)
+    return costs
+
+
+@pytest.mark.parametrize('cost_shift, replaced', [(-0.05, True), (0., False), (0.05, False)])
+def test_rollout_baseline_is_replaced_only_by_a_significantly_better_candidate(monkeypatch, cost_shift, replaced):
+    monkeypatch.setattr(utils.rollout, 'greedy_costs', greedy_costs_shifted)
+    val_instance_sets = []
+
+    def val_instances_fn():
+        torch.manual_seed(len(val_instance_sets))
+        val_instance_sets.append([random_instances('tsp', 32, GRAPH_SIZE) for _ in range(2)])
+        return val_instance_sets[-1]
+
+    baseline = RolloutBaseline(create_actor('tsp'), 'tsp', val_instances_fn)
+    baseline_model, val_costs = baseline.model, baseline.val_costs
+    assert val_costs.shape == (64,) and not baseline_model.training
+
+    # the baseline's actor, with greedy costs shifted by cost_shift plus noise
+    candidate = create_actor('tsp').train()
+    candidate.cost_shift = cost_shift
+    diff = torch.cat([greedy_costs_shifted(candidate.eval(), 'tsp', instances) for instances in val_instance_sets[0]])
+    diff = diff - val_costs
+    t_statistic = diff.mean() / (diff.std() / np.sqrt(diff.numel()))
+    assert (t_statistic < -baseline.critical_value) == replaced
+
+    candidate.train()
+    baseline.epoch_callback(candidate)
+    assert candidate.training
+    if not replaced:
+        assert baseline.model is baseline_model and baseline.val_costs is val_costs and len(val_instance_sets) == 1
+        return
+
+    # a frozen copy of the candidate, evaluated on a new validation set
+    assert baseline.model is not candidate and baseline.model.cost_shift == cost_shift
+    assert not baseline.model.training
+    assert len(val_instance_sets) == 2
+    expected_val_costs = torch.cat([greedy_costs_shifted(candidate.eval(), 'tsp', instances)
+                                    for instances in val_instance_sets[1]])
+    torch.testing.assert_close(baseline.val_costs, expected_val_costs)
+    instances = val_instance_sets[1][0]
+    torch.testing.assert_close(baseline.eval(instances, None), greedy_costs_shifted(candidate, 'tsp', instances))
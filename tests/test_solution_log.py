@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+import torch
+
+from utils.solution_log import SolutionLogWriter, SolutionLog
+
+N_ENVS, GRAPH_SIZE = 3, 5
+
+
+def random_run():
+    """Coordinates and per step env ids, action distributions and actions, the envs are done after 5, 3 and 4 steps"""
+    coordinates = torch.rand(N_ENVS, GRAPH_SIZE, 2)
+    steps = []
+    for step in range(5):
+        env_ids = np.array([env for env, n_steps in enumerate((5, 3, 4)) if step < n_steps])
+        probs = torch.softmax(torch.randn(len(env_ids), GRAPH_SIZE), dim=-1)
+        steps.append((env_ids, probs, probs.argmax(-1)))
+    return coordinates, steps
+
+
+def write_runs(path, top_k, runs):
+    writer = SolutionLogWriter(str(path), top_k=top_k)
+    for coordinates, steps in runs:
+        writer.start_run(coordinates, n_actions=GRAPH_SIZE)
+        for env_ids, probs, actions in steps:
+            writer.log_step(env_ids, probs, actions)
+        writer.end_run()
+
+
+@pytest.mark.parametrize('top_k', [None, 2])
+def test_solution_log_roundtrip(tmp_path, top_k):
+    torch.manual_seed(0)
+    runs = [random_run(), (torch.rand(N_ENVS, GRAPH_SIZE, 2), []), random_run()]
+    write_runs(tmp_path, top_k, runs)
+
+    log = SolutionLog(str(tmp_path))
+    assert len(log) == 3 and log.top_k == top_k
+    for arrays, (coordinates, steps) in zip(log, runs):
+        np.testing.assert_array_equal(arrays['coordinates'], coordinates.numpy())
+        assert arrays['tour_indices'].shape == (len(steps), N_ENVS)
+        assert arrays['tour_probs'].shape == (len(steps), N_ENVS, GRAPH_SIZE)
+        for step, (env_ids, probs, actions) in enumerate(steps):
+            tour_indices = np.full(N_ENVS, -1)
+            tour_indices[env_ids] = actions.numpy()
+            np.testing.assert_array_equal(arrays['tour_indices'][step], tour_indices)
+
+            expected = np.zeros((N_ENVS, GRAPH_SIZE), dtype=np.float16)
+            if top_k is None:
+                expected[env_ids] = probs.numpy()
+            else:
+                # densified from the top k, all other actions get 0
+                topk_probs, topk_indices = probs.topk(top_k, dim=-1)
+                expected_rows = expected[env_ids]
+                np.put_along_axis(expected_rows, topk_indices.numpy(), topk_probs.numpy(), axis=-1)
+                expected[env_ids] = expected_rows
+            np.testing.assert_array_equal(arrays['tour_probs'][step], expected)
+
+    # the envs of all runs as instances, the tours padded to the longest run
+    coordinates, tours, probs = log.instances()
+    assert coordinates.shape == (3 * N_ENVS, GRAPH_SIZE, 2)
+    assert tours.shape == (3 * N_ENVS, 5) and probs.shape == (3 * N_ENVS, 5, GRAPH_SIZE)
+    assert (tours[N_ENVS:2 * N_ENVS] == -1).all() and (probs[N_ENVS:2 * N_ENVS] == 0).all()
+    np.testing.assert_array_equal(tours[:N_ENVS], log[0]['tour_indices'].T)
+
+
+def test_solution_log_loads_runs_lazily(tmp_path, monkeypatch):
+    torch.manual_seed(0)
+    write_runs(tmp_path, None, [random_run() for _ in range(3)])
+
+    loaded = []
+    load = np.load
+    monkeypatch.setattr(np, 'load', lambda file, *args, **kwargs: loaded.append(file) or load(file, *args, **kwargs))
+    log = SolutionLog(str(tmp_path))
+    assert len(log) == 3 and loaded == []
+    log[1]
+    assert len(loaded) == 1 and loaded[0].endswith('run_00001.npz')
@@ -0,0 +1,16 @@
+import subprocess
+import sys
+
+from benchmark import STARTUP_IMPORTS
+
+
+def imported_modules(statement):
+    # a fresh interpreter, as modules imported by other tests would be in sys.modules already
+    return set(subprocess.run([sys.executable, '-c', statement + '; import sys; print(" ".join(sys.modules))'],
+                              check=True, capture_output=True, text=True).stdout.split())
+
+
+def test_importing_run_defers_the_subcommand_imports():
+    # modules that torch imports itself are loaded anyway
+    imported = imported_modules('import run') - imported_modules('import torch')
+    assert sorted(set(STARTUP_IMPORTS['eager imports']) & imported) == []
@@ -0,0 +1,76 @@
+import pytest
+import torch
+
+from nets.v_estimator import V_Estimator, critic_node_features
+from utils import load_problem
+from utils.random_data import random_obs
+
+GRAPH_SIZE = 10
+
+
+def baseline_node_features(obs, is_orienteering, invert_visited=False):
+    """The inputs that V_Estimator.forward built before critic_node_features, one hot encodings by row masks"""
+    if is_orienteering:
+        loc = torch.cat((obs['depot'][:, None, :], obs['loc']), dim=1)
+        batch_size, n_loc, _ = loc.shape
+        visited = obs['visited'].view(batch_size, -1, 1)
+        if invert_visited:
+            visited = torch.logical_not(visited)
+        prev_a = torch.nn.functional.one_hot(obs['prev_a'].view(batch_size, -1), num_classes=n_loc) \
+            .view(-1, n_loc, 1).type(torch.float)
+        is_depot = torch.zeros((batch_size, n_loc, 1), dtype=torch.float)
+        is_depot[:, 0, 0] = 1
+        remaining_len = obs['remaining_length'][:, None, None].expand(-1, n_loc, -1)
+        return torch.cat((loc, is_depot, visited, prev_a, remaining_len), 2)
+
+    loc = obs['loc']
+    batch_size, n_loc, _ = loc.shape
+    visited = obs['visited'].view(batch_size, -1, 1)
+    if invert_visited:
+        visited = torch.logical_not(visited)
+    prev_a_idx = obs['prev_a'].view(batch_size, -1)
+    first_a_idx = obs['first_a'].view(batch_size, -1)
+    prev_a = torch.zeros((batch_size, n_loc, 1), dtype=torch.float)
+    first_a = torch.zeros((batch_size, n_loc, 1), dtype=torch.float)
+    mask = prev_a_idx.squeeze() != -1
+    prev_a[mask] = torch.nn.functional.one_hot(prev_a_idx[mask], num_classes=n_loc).view(-1, n_loc, 1).type(torch.float)
+    first_a[mask] = torch.nn.functional.one_hot(first_a_idx[mask], num_classes=n_loc).view(-1, n_loc, 1).type(torch.float)
+    return torch.cat((loc, visited, first_a, prev_a), 2)
+
+
+def mixed_obs(problem_name):
+    """Observations of the first step (without a previous action in the TSP), of a later step and of the last one"""
+    torch.manual_seed(0)
+    steps = [random_obs(problem_name, 3, GRAPH_SIZE, step) for step in (0, 4, GRAPH_SIZE - 1)]
+    return {key: torch.cat([obs[key] for obs in steps]) for key in steps[0]}
+
+
+@pytest.mark.parametrize('invert_visited', [False, True])
+@pytest.mark.parametrize('problem_name', ['tsp', 'op'])
+def test_node_features_of_single_observations_match_the_baseline_layout(problem_name, invert_visited):
+    obs = mixed_obs(problem_name)
+    is_orienteering = problem_name == 'op'
+    expected = baseline_node_features(obs, is_orienteering, invert_visited)
+    torch.testing.assert_close(critic_node_features(obs, is_orienteering, invert_visited), expected)
+
+    # batches of a single observation, e.g. of a single test env, where squeezing the row mask removed the batch
+    # dimension
+    for row in range(len(expected)):
+        single_obs = {key: value[row:row + 1] for key, value in obs.items()}
+        torch.testing.assert_close(critic_node_features(single_obs, is_orienteering, invert_visited),
+                                   expected[row:row + 1])
+
+
+@pytest.mark.parametrize('q_outputs', [False, True])
+@pytest.mark.parametrize('problem_name', ['tsp', 'op'])
+def test_critic_outputs_of_single_observations(problem_name, q_outputs):
+    torch.manual_seed(0)
+    critic = V_Estimator(embedding_dim=16, problem=load_problem(problem_name), n_encode_layers=1,
+                         q_outputs=q_outputs).eval()
+    obs = mixed_obs(problem_name)
+    with torch.no_grad():
+        outputs = critic(obs)
+        for row in range(len(outputs)):
+            single_outputs = critic({key: value[row:row + 1] for key, value in obs.items()})
+            assert single_outputs.shape == (1, *outputs.shape[1:])
+            torch.testing.assert_close(single_outputs, outputs[row:row + 1])
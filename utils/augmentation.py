@@ -0,0 +1,60 @@
+import math
+
+import torch
+
+
+# The 8 symmetries of the unit square as affine maps x -> Mx + b, the identity first
+DIHEDRAL_MATRICES = torch.tensor([
+    [[1., 0.], [0., 1.]],    # (x, y)
+    [[0., 1.], [1., 0.]],    # (y, x)
+    [[-1., 0.], [0., 1.]],   # (1 - x, y)
+    [[0., 1.], [-1., 0.]],   # (y, 1 - x)
+    [[1., 0.], [0., -1.]],   # (x, 1 - y)
+    [[0., -1.], [1., 0.]],   # (1 - y, x)
+    [[-1., 0.], [0., -1.]],  # (1 - x, 1 - y)
+    [[0., -1.], [-1., 0.]],  # (1 - y, 1 - x)
+])
+DIHEDRAL_OFFSETS = torch.tensor([[0., 0.], [0., 0.], [1., 0.], [0., 1.], [0., 1.], [1., 0.], [1., 1.], [1., 1.]])
+
+
+def augmentation_transforms(n_rotations=0, generator=None):
+    """
+    Affine maps of the 8 dihedral transforms, followed by n_rotations random rotations about the center of the square.
+    All of them are isometries, so tour lengths and the length constraints of the OP are the same in every view.
+
+    :return: matrices (n_views, 2, 2) and offsets (n_views, 2)
+    """
+    angles = torch.rand(n_rotations, generator=generator) * 2 * math.pi
+    cos, sin = torch.cos(angles), torch.sin(angles)
+    rotations = torch.stack((torch.stack((cos, -sin), -1), torch.stack((sin, cos), -1)), -2)
+    center = torch.full((2,), 0.5)
+    matrices = torch.cat((DIHEDRAL_MATRICES, rotations))
+    offsets = torch.cat((DIHEDRAL_OFFSETS, center - rotations @ center))
+    return matrices, offsets
+
+
+def augment(instances, n_rotations=0, generator=None):
+    """
+    Applies all augmentation transforms to the coordinates ('loc' and 'depot') of a batch of instances or of env
+    observations in one batched operation, the other fields are repeated for every view.
+    The views are stacked along the batch dimension, view major, i.e. row v * batch_size + i is view v of instance i.
+    """
+    matrices, offsets = augmentation_transforms(n_rotations, generator)
+    n_views = matrices.size(0)
+    augmented = {}
+    for key, value in instances.items():
+        if key in ('loc', 'depot'):
+            matrices_, offsets_ = matrices.to(value), offsets.to(value)
+            # (n_views, batch_size, ..., 2)
+            coords = torch.einsum('vij,...j->v...i', matrices_, value) + offsets_.view(n_views, *([1] * (value.dim() - 1)), 2)
+            augmented[key] = coords.reshape(-1, *value.size()[1:])
+        else:
+            augmented[key] = value.repeat(n_views, *([1] * (value.dim() - 1)))
+    return augmented
+
+
+def best_of_views(costs, batch_size):
+    """
+    Minimum cost and index of the best view of each instance, for costs of augmented instances (n_views * batch_size,)
+    """
+    return costs.view(-1, batch_size).min(dim=0)
@@ -4,9 +4,6 @@ import torch
 import numpy as np
 import os
 import json
-from tqdm import tqdm
-from multiprocessing.dummy import Pool as ThreadPool
-from multiprocessing import Pool
 import torch.nn.functional as F
 
 
@@ -30,6 +27,51 @@ def move_to(var, device):
     return var.to(device)
 
 
+def compile_model(model, **compile_kwargs):
+    """
+    Compiles the graph encoder and the single step decoder of an actor or critic in place using torch.compile.
+    Parameters are not wrapped, so state dicts stay compatible with eager models and saved policies.
+    """
+    model.debug_checks = False  # data dependent asserts would break the compiled graphs
+    model.embedder.compile(**compile_kwargs)
+    if hasattr(model, '_get_logits'):
+        model._get_logits = torch.compile(model._get_logits, **compile_kwargs)
+    return model
+
+
+def compile_policy(policy, **compile_kwargs):
+    """
+    Compiles all networks of a tianshou policy, including target copies.
+    Has to be called after the policy was created, as compiled methods do not survive the policy's deepcopies.
+    """
+    for network in policy.children():
+        if hasattr(network, 'embedder'):
+            compile_model(network, **compile_kwargs)
+    return policy
+
+
+def quantize_for_inference(model, quantize_attention=False):
+    """
+    Applies dynamic int8 quantization to the nn.Linear layers of a model in place, for CPU inference only.
+    The input embeddings of the raw coordinates stay in fp32, they are cheap and the most sensitive to rounding.
+    With quantize_attention, the weight tensors of the encoder's MultiHeadAttention are quantized as well.
+    """
+    from nets.graph_encoder import SkipConnection, MultiHeadAttention, LinearMultiHeadAttention
+
+    if quantize_attention:
+        for module in model.modules():
+            if isinstance(module, SkipConnection) and isinstance(module.module, MultiHeadAttention):
+                module.module = LinearMultiHeadAttention(module.module)
+
+    qconfig_spec = {
+        name: torch.ao.quantization.default_dynamic_qconfig
+        for name, module in model.named_modules()
+        if isinstance(module, torch.nn.Linear) and not name.startswith('init_embed')
+    }
+    model.eval()
+    return torch.ao.quantization.quantize_dynamic(model, qconfig_spec, dtype=torch.qint8, inplace=True)
+
+
 def _load_model_file(load_path, model):
     """Loads the model with parameters from the file and returns optimizer state dict if it is in the file"""
 
@@ -131,6 +173,10 @@ def parse_softmax_temperature(raw_temp):
 
 
 def run_all_in_pool(func, directory, dataset, opts, use_multiprocessing=True):
+    from tqdm import tqdm
+    from multiprocessing.dummy import Pool as ThreadPool
+    from multiprocessing import Pool
+
     # # Test
     # res = func((directory, 'test', *dataset[0]))
     # return [res]
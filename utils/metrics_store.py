@@ -0,0 +1,219 @@
+import os
+import json
+import struct
+from multiprocessing import Pool
+
+import numpy as np
+
+
+COLUMNS = ('run', 'tag', 'step', 'value', 'wall_time')
+
+
+def read_scalar_events(path, offset=0):
+    """
+    Reads the scalars of a TensorBoard event file from byte offset on, parsing the TFRecord framing directly, so
+    previously exported parts of the (append only) file are skipped. A trailing record that is still being written
+    is left for the next call.
+
+    :return: tags, steps, values, wall times and the offset after the last complete record
+    """
+    from tensorboard.compat.proto.event_pb2 import Event
+    from tensorboard.util.tensor_util import make_ndarray
+
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+
+    tags, steps, values, wall_times = [], [], [], []
+    position = 0
+    # record: uint64 length, uint32 crc of length, data, uint32 crc of data
+    while position + 12 <= len(data):
+        length, = struct.unpack_from('<Q', data, position)
+        end = position + 12 + length + 4
+        if end > len(data):
+            break
+        event = Event.FromString(data[position + 12:position + 12 + length])
+        position = end
+        for value in event.summary.value:
+            if value.HasField('simple_value'):
+                scalar = value.simple_value
+            elif value.HasField('tensor') and value.metadata.plugin_data.plugin_name == 'scalars':
+                scalar = float(make_ndarray(value.tensor))
+            else:
+                continue
+            tags.append(value.tag)
+            steps.append(event.step)
+            values.append(scalar)
+            wall_times.append(event.wall_time)
+    return tags, steps, values, wall_times, offset + position
+
+
+def _read_scalar_events(args):
+    return read_scalar_events(*args)
+
+
+def tag_csv_name(tag):
+    # names of the csv directories, e.g. test/reward -> testreward
+    return tag.replace('/', '')
+
+
+class MetricsStore(object):
+    """
+    Columnar store of all scalars logged to the TensorBoard event files below a log directory, kept in
+    <log_dir>/metrics/metrics.npz with one array per column (run, tag, step, value, wall_time) and the run and tag
+    names as string arrays indexed by the run and tag columns.
+    <log_dir>/metrics/index.json keeps how far each event file has been exported.
+    """
+
+    def __init__(self, log_dir='log_dir'):
+        self.log_dir = log_dir
+        self.path = os.path.join(log_dir, 'metrics')
+        self.run_names, self.tag_names = [], []
+        self.columns = {name: np.zeros(0, dtype=dtype) for name, dtype in
+                        zip(COLUMNS, (np.int32, np.int32, np.int64, np.float64, np.float64))}
+        self.offsets = {}
+
+        if os.path.isfile(os.path.join(self.path, 'metrics.npz')):
+            with np.load(os.path.join(self.path, 'metrics.npz')) as data:
+                self.run_names = data['run_names'].tolist()
+                self.tag_names = data['tag_names'].tolist()
+                self.columns = {name: data[name] for name in COLUMNS}
+            with open(os.path.join(self.path, 'index.json')) as f:
+                self.offsets = json.load(f)
+
+    def event_files(self):
+        for directory, _, filenames in os.walk(self.log_dir):
+            for filename in filenames:
+                if filename.startswith('events.out.tfevents'):
+                    yield os.path.relpath(os.path.join(directory, filename), self.log_dir)
+
+    def update(self, processes=None):
+        """
+        Exports the events appended to the event files since the last update, parsing the files in parallel
+
+        :return: names of the runs with new scalars
+        """
+        pending = [event_file for event_file in sorted(self.event_files())
+                   if os.path.getsize(os.path.join(self.log_dir, event_file)) > self.offsets.get(event_file, 0)]
+        if len(pending) == 0:
+            return []
+
+        args = [(os.path.join(self.log_dir, event_file), self.offsets.get(event_file, 0)) for event_file in pending]
+        if processes == 1 or len(pending) == 1:
+            results = list(map(_read_scalar_events, args))
+        else:
+            with Pool(processes) as pool:
+                results = pool.map(_read_scalar_events, args)
+
+        new_columns = {name: [self.columns[name]] for name in COLUMNS}
+        updated_runs = set()
+        for event_file, (tags, steps, values, wall_times, offset) in zip(pending, results):
+            self.offsets[event_file] = offset
+            if len(tags) == 0:
+                continue
+            run = self._index(self.run_names, os.path.dirname(event_file))
+            updated_runs.add(self.run_names[run])
+            new_columns['run'].append(np.full(len(tags), run, dtype=np.int32))
+            new_columns['tag'].append(np.array([self._index(self.tag_names, tag) for tag in tags], dtype=np.int32))
+            new_columns['step'].append(np.array(steps, dtype=np.int64))
+            new_columns['value'].append(np.array(values, dtype=np.float64))
+            new_columns['wall_time'].append(np.array(wall_times, dtype=np.float64))
+        self.columns = {name: np.concatenate(arrays) for name, arrays in new_columns.items()}
+        self.save()
+        return sorted(updated_runs)
+
+    @staticmethod
+    def _index(names, name):
+        if name not in names:
+            names.append(name)
+        return names.index(name)
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        # write to temporary files first, so readers never see a partial store
+        tmp_path = os.path.join(self.path, 'metrics.tmp.npz')
+        np.savez_compressed(tmp_path, run_names=np.array(self.run_names, dtype=str),
+                            tag_names=np.array(self.tag_names, dtype=str), **self.columns)
+        os.replace(tmp_path, os.path.join(self.path, 'metrics.npz'))
+        with open(os.path.join(self.path, 'index.tmp.json'), 'w') as f:
+            json.dump(self.offsets, f)
+        os.replace(os.path.join(self.path, 'index.tmp.json'), os.path.join(self.path, 'index.json'))
+
+    def tags(self, run_name):
+        rows = self.columns['run'] == self.run_names.index(run_name)
+        return [self.tag_names[tag] for tag in np.unique(self.columns['tag'][rows])]
+
+    def query(self, run_name, tag):
+        """
+        Scalars of one tag of a run, ordered by wall time, with the column names of the exported csvs
+
+        :return: dict with the arrays tag, 'Steps' and 'Wall_Time'
+        """
+        if run_name not in self.run_names or tag not in self.tag_names:
+            raise KeyError("No scalars {} of run {} in {}".format(tag, run_name, self.path))
+        rows = np.flatnonzero((self.columns['run'] == self.run_names.index(run_name))
+                              & (self.columns['tag'] == self.tag_names.index(tag)))
+        rows = rows[np.argsort(self.columns['wall_time'][rows], kind='stable')]
+        return {
+            tag: self.columns['value'][rows],
+            'Steps': self.columns['step'][rows],
+            'Wall_Time': self.columns['wall_time'][rows]
+        }
+
+    def write_csvs(self, run_names, csv_dir=None):
+        """
+        Writes the scalars of the runs to <csv_dir>/<tag without slashes>/<run_name>.csv, in the format of the csvs
+        that plotting.ipynb reads (semicolon separated, index, value, Steps and Wall_Time columns)
+        """
+        csv_dir = os.path.join(self.log_dir, 'csvs') if csv_dir is None else csv_dir
+        for run_name in run_names:
+            for tag in self.tags(run_name):
+                scalars = self.query(run_name, tag)
+                path = os.path.join(csv_dir, tag_csv_name(tag), run_name + '.csv')
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w') as f:
+                    f.write(';{};Steps;Wall_Time\n'.format(tag))
+                    for i, (value, step, wall_time) in enumerate(zip(scalars[tag], scalars['Steps'], scalars['Wall_Time'])):
+                        f.write('{};{};{};{}\n'.format(i, repr(float(value)), step, repr(float(wall_time))))
+
+
+def read_csv(path):
+    """
+    Reads a csv in the exported format into a dict of arrays, without the index column
+    """
+    with open(path) as f:
+        header = f.readline().rstrip('\n').split(';')
+        rows = [line.rstrip('\n').split(';') for line in f if line.strip()]
+    columns = {name: np.array([float(row[i]) for row in rows]) for i, name in enumerate(header) if i > 0}
+    if 'Steps' in columns:
+        columns['Steps'] = columns['Steps'].astype(np.int64)
+    return columns
+
+
+def figure_scalars(figure_meta, stores=None, load_csv=read_csv):
+    """
+    Scalars of each line of a figure_metas spec, by run name from the metrics store of the log directory of its
+    key path (<log_dir>/csvs/<tag>), and from the csv at the key path for runs that are not in the store
+
+    :param stores: optional dict of already loaded MetricsStores by log directory, extended by this function
+    :param load_csv: function reading a csv into a dict of arrays, e.g. with a cache
+    :return: list with a dict of arrays per line, as returned by MetricsStore.query
+    """
+    run_names = figure_meta['run_names']
+    if len(figure_meta.get('key_paths', [])) > 0:
+        key_paths, tags = figure_meta['key_paths'], figure_meta['y_df_labels']
+    else:
+        key_paths, tags = [figure_meta['key_path']] * len(run_names), [figure_meta['y_df_label']] * len(run_names)
+
+    stores = {} if stores is None else stores
+    lines = []
+    for key_path, tag, run_name in zip(key_paths, tags, run_names):
+        log_dir = os.path.dirname(os.path.dirname(os.path.normpath(key_path)))
+        if log_dir not in stores:
+            stores[log_dir] = MetricsStore(log_dir)
+        store = stores[log_dir]
+        if run_name in store.run_names and tag in store.tags(run_name):
+            lines.append(store.query(run_name, tag))
+        else:
+            lines.append(load_csv(os.path.join(key_path, run_name + '.csv')))
+    return lines
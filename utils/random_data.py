@@ -0,0 +1,49 @@
+import torch
+
+
+def random_obs(problem_name, batch_size, graph_size, step):
+    """
+    Creates a batch of observations like the ones returned by the optimized envs, after `step` random actions
+    """
+    if problem_name == 'tsp':
+        loc = torch.rand(batch_size, graph_size, 2)
+        tours = torch.rand(batch_size, graph_size).argsort(dim=1)
+        visited = torch.zeros(batch_size, graph_size, dtype=torch.uint8)
+        visited.scatter_(1, tours[:, :step], 1)
+        no_action = torch.full((batch_size,), -1, dtype=torch.long)
+        return {
+            'loc': loc,
+            'first_a': tours[:, 0] if step > 0 else no_action,
+            'prev_a': tours[:, step - 1] if step > 0 else no_action,
+            'visited': visited,
+            'action_mask': (visited > 0)[:, None, :]
+        }
+
+    # OP, node 0 is the depot and tours start there
+    coords = torch.rand(batch_size, graph_size + 1, 2)
+    tours = torch.rand(batch_size, graph_size).argsort(dim=1) + 1
+    visited = torch.zeros(batch_size, graph_size + 1, dtype=torch.uint8)
+    visited.scatter_(1, tours[:, :step], 1)
+    return {
+        'loc': coords[:, 1:],
+        'depot': coords[:, 0],
+        'prize': torch.rand(batch_size, graph_size),
+        'prev_a': tours[:, step - 1] if step > 0 else torch.zeros(batch_size, dtype=torch.long),
+        'visited': visited,
+        'remaining_length': torch.rand(batch_size) * 2,
+        'action_mask': (visited > 0)[:, None, :]
+    }
+
+
+def random_episodes(problem_name, n_episodes, graph_size):
+    """
+    Observations of all graph_size steps of n_episodes random episodes, like a learner batch of the on-policy
+    algorithms, step major
+    """
+    seed = torch.randint(2**31, ()).item()
+    steps = []
+    for step in range(graph_size):
+        # the same instances and tours in every step
+        torch.manual_seed(seed)
+        steps.append(random_obs(problem_name, n_episodes, graph_size, step))
+    return {key: torch.cat([obs[key] for obs in steps]) for key in steps[0]}
@@ -0,0 +1,262 @@
+import copy
+import math
+
+import torch
+
+from nets.attention_model import AttentionModelFixed
+from problems.tsp.state_tsp import StateTSP
+from problems.op.state_op import StateOP
+
+
+def random_instances(problem_name, batch_size, graph_size, distribution=None, device='cpu'):
+    """
+    Generates a batch of random instances on the device at once, with the same distributions as the datasets of the envs
+    """
+    loc = torch.rand(batch_size, graph_size, 2, device=device)
+    if problem_name == 'tsp':
+        return {'loc': loc}
+
+    from problems.op.problem_op import MAX_LENGTHS
+    depot = torch.rand(batch_size, 2, device=device)
+    # Methods taken from Fischetti et al. 1998, see generate_instance of the OP
+    if distribution == 'const':
+        prize = torch.ones(batch_size, graph_size, device=device)
+    elif distribution == 'unif':
+        prize = (1 + torch.randint(0, 100, size=(batch_size, graph_size), device=device)) / 100.
+    else:  # Based on distance to depot
+        prize_ = (depot[:, None, :] - loc).norm(p=2, dim=-1)
+        prize = (1 + (prize_ / prize_.max(dim=-1, keepdim=True)[0] * 99).int()).float() / 100.
+    return {
+        'loc': loc,
+        'depot': depot,
+        'prize': prize,
+        'max_length': torch.full((batch_size,), MAX_LENGTHS[graph_size], device=device)
+    }
+
+
+def instances_from_obs(problem_name, obs, device='cpu'):
+    """
+    Instances of a batch of initial observations of the optimized envs
+    """
+    instances = {'loc': torch.as_tensor(obs['loc'], dtype=torch.float, device=device)}
+    if problem_name == 'op':
+        instances['depot'] = torch.as_tensor(obs['depot'], dtype=torch.float, device=device)
+        instances['prize'] = torch.as_tensor(obs['prize'], dtype=torch.float, device=device)
+        # nothing has been travelled yet
+        instances['max_length'] = torch.as_tensor(obs['remaining_length'], dtype=torch.float, device=device).view(-1)
+    return instances
+
+
+def initial_state(problem_name, instances):
+    if problem_name == 'tsp':
+        return StateTSP.initialize(instances['loc'])
+    return StateOP.initialize(instances)
+
+
+def state_obs(problem_name, state, instances):
+    """
+    Observations of a whole batch of states in the format of the optimized envs, as expected by the actor
+    """
+    if problem_name == 'tsp':
+        visited = state.visited_[:, 0]
+        return {
+            'loc': instances['loc'],
+            'first_a': state.first_a[:, 0],
+            'prev_a': state.prev_a[:, 0],
+            'visited': visited,
+            'action_mask': (visited > 0)[:, None, :]
+        }
+
+    # Same as StateOP.get_mask, which only supports a single instance after removing the steps dimension
+    visited = state.visited_
+    exceeds_length = (
+        state.lengths[:, :, None] + (state.coords[state.ids, :, :] - state.cur_coord[:, :, None, :]).norm(p=2, dim=-1)
+        > state.max_length[state.ids, :]
+    )
+    mask = visited.to(exceeds_length.dtype) | visited[:, :, 0:1].to(exceeds_length.dtype) | exceeds_length
+    # Depot can always be visited, finished tours stay there without prize and with a log probability of 0
+    mask[:, :, 0] = 0
+    return {
+        'loc': instances['loc'],
+        'depot': instances['depot'],
+        'prize': instances['prize'],
+        'prev_a': state.prev_a[:, 0],
+        'visited': visited[:, 0],
+        'remaining_length': state.get_remaining_length()[:, 0],
+        'action_mask': mask
+    }
+
+
+def compact_nodes(fixed, mask):
+    """
+    Restricts the glimpse keys and values and the logit keys of the decoder to the nodes that are not masked, padded
+    with masked nodes to the largest number of unmasked nodes of the batch. Masked nodes stay masked for the rest of
+    the tour (visited nodes and, as the travelled length only grows, OP nodes out of reach), so the compacted nodes
+    can be reused for the following steps.
+
+    :param mask: (batch_size, 1, graph_size) action mask of the current step
+    :return: nodes of the compacted keys (batch_size, n_active), fixed with the compacted keys and values
+    """
+    mask = mask[:, 0]
+    n_active = int((~mask).sum(-1).max())
+    # unmasked nodes first, in their original order
+    node_index = mask.to(torch.uint8).argsort(dim=-1, stable=True)[:, :n_active]
+    n_heads, batch_size, num_steps, _, head_dim = fixed.glimpse_key.size()
+    heads_index = node_index[None, :, None, :, None].expand(n_heads, batch_size, num_steps, n_active, head_dim)
+    logit_index = node_index[:, None, :, None].expand(batch_size, num_steps, n_active, fixed.logit_key.size(-1))
+    return node_index, fixed._replace(
+        glimpse_key=fixed.glimpse_key.gather(3, heads_index),
+        glimpse_val=fixed.glimpse_val.gather(3, heads_index),
+        logit_key=fixed.logit_key.gather(2, logit_index)
+    )
+
+
+def rollout(model, problem_name, instances, decode_type='sampling', multi_start=False):
+    """
+    Constructs the tours of a batch of instances with the actor, fully on tensors without any env.
+    The instances are encoded and their node projections precomputed once, then the decoder is applied step by step.
+    With the actor's fold_projections, the step context and output projections are folded into the precomputation.
+    With multi_start (POMO, TSP only), each instance is rolled out from every node as forced first action, all sharing
+    the encoding of the instance. The rows of the results are ordered by instance, then by start node.
+
+    :return: costs (batch_size,) as in the problems' get_costs, summed log likelihoods of the tours (batch_size,)
+        and the tours (batch_size, num_steps), where batch_size is multiplied by graph_size with multi_start
+    """
+    state = initial_state(problem_name, instances)
+    obs = state_obs(problem_name, state, instances)
+    embeddings, knn = model.encode_with_candidates(obs)
+    fixed = model._precompute(embeddings, knn=knn, fold_projections=model.fold_projections)
+
+    log_likelihood = 0
+    actions = []
+    if multi_start:
+        assert problem_name == 'tsp', "Multi-start rollouts are only supported for the TSP"
+        batch_size, graph_size, _ = instances['loc'].size()
+        rows = torch.arange(batch_size, device=fixed.node_embeddings.device).repeat_interleave(graph_size)
+        # the state keeps the instances once and indexes them by its ids. The heads of the replicated node projections
+        # are made contiguous once, instead of being copied by the matmuls of every step
+        fixed = AttentionModelFixed(*(tensor.contiguous() if tensor is not None else None for tensor in fixed[rows]))
+        state = state[rows]
+        instances = {key: value[rows] for key, value in instances.items()}
+        # the forced start nodes are not part of the log likelihood
+        selected = torch.arange(graph_size, device=rows.device).repeat(batch_size)
+        actions.append(selected)
+        state = state.update(selected)
+
+    compact_every = model.compact_every
+    assert compact_every == 0 or fixed.knn is None, "Compacted rollouts do not support decoding candidates"
+    step, node_index = 0, None
+    while not state.all_finished():
+        obs = state_obs(problem_name, state, instances)
+        if compact_every > 0 and step % compact_every == 0:
+            # the keys of the nodes that can still be selected, so the cost of a step shrinks as the tours progress
+            node_index, compact_fixed = compact_nodes(fixed, obs['action_mask'])
+        if node_index is not None:
+            obs['action_mask'] = obs['action_mask'].gather(-1, node_index[:, None, :])
+        logits, _ = model._get_logits(fixed if node_index is None else compact_fixed, obs)
+        log_p = torch.log_softmax(logits[:, 0].float(), dim=-1)
+        if decode_type == 'greedy':
+            selected = log_p.argmax(dim=-1)
+        else:
+            selected = torch.multinomial(log_p.exp(), 1)[:, 0]
+        log_likelihood = log_likelihood + log_p.gather(1, selected[:, None])[:, 0]
+        if node_index is not None:
+            selected = node_index.gather(1, selected[:, None])[:, 0]
+        actions.append(selected)
+        state = state.update(selected)
+        step += 1
+
+    cost = state.get_final_cost()[:, 0] if problem_name == 'tsp' else -state.cur_total_prize[:, 0]
+    return cost, log_likelihood, torch.stack(actions, 1)
+
+
+@torch.no_grad()
+def greedy_costs(model, problem_name, instances, multi_start=False):
+    """
+    Costs of the greedy tours of the instances, the best over all start nodes with multi_start
+    """
+    cost = rollout(model, problem_name, instances, 'greedy', multi_start)[0]
+    if multi_start:
+        cost = cost.view(-1, instances['loc'].size(-2)).min(dim=1)[0]
+    return cost
+
+
+class NoBaseline(object):
+
+    def eval(self, instances, cost):
+        return torch.zeros_like(cost)
+
+    def epoch_callback(self, model):
+        pass
+
+
+class ExponentialBaseline(object):
+    """
+    Exponential moving average of the mean cost of the batches
+    """
+
+    def __init__(self, beta):
+        self.beta = beta
+        self.v = None
+
+    def eval(self, instances, cost):
+        mean_cost = cost.detach().mean()
+        self.v = mean_cost if self.v is None else self.beta * self.v + (1. - self.beta) * mean_cost
+        return self.v.expand_as(cost)
+
+    def epoch_callback(self, model):
+        pass
+
+
+class POMOBaseline(object):
+    """
+    Shared baseline of multi-start rollouts, the mean cost over all start nodes of the same instance (Kwon et al. 2020)
+    """
+
+    def eval(self, instances, cost):
+        graph_size = instances['loc'].size(-2)
+        return cost.detach().view(-1, graph_size).mean(dim=1, keepdim=True).expand(-1, graph_size).reshape(-1)
+
+    def epoch_callback(self, model):
+        pass
+
+
+class RolloutBaseline(object):
+    """
+    Greedy rollout of a frozen copy of the actor (Kool et al. 2019). After each epoch the copy is replaced by the actor
+    if its greedy costs on a validation set are significantly lower, by a one-sided paired t-test at level alpha.
+    The validation sets are large enough to use the normal approximation of the t distribution.
+    """
+
+    # one-sided critical values of the standard normal distribution
+    CRITICAL_VALUES = {0.1: 1.282, 0.05: 1.645, 0.01: 2.326}
+
+    def __init__(self, model, problem_name, val_instances_fn, alpha=0.05):
+        self.problem_name = problem_name
+        self.val_instances_fn = val_instances_fn
+        self.critical_value = self.CRITICAL_VALUES[alpha]
+        self._update_model(model)
+
+    def _update_model(self, model):
+        self.model = copy.deepcopy(model).eval()
+        self.val_instances = self.val_instances_fn()  # new validation set to prevent overfitting to it
+        self.val_costs = self._greedy_costs(self.model)
+
+    def _greedy_costs(self, model):
+        return torch.cat([greedy_costs(model, self.problem_name, instances) for instances in self.val_instances])
+
+    def eval(self, instances, cost):
+        return greedy_costs(self.model, self.problem_name, instances)
+
+    def epoch_callback(self, model):
+        was_training = model.training
+        candidate_costs = self._greedy_costs(model.eval())
+        model.train(was_training)
+
+        diff = (candidate_costs - self.val_costs).float()
+        t_statistic = diff.mean() / (diff.std() / math.sqrt(diff.numel()))
+        print(f"Rollout baseline: candidate mean {candidate_costs.mean().item():.4f}, "
+              f"baseline mean {self.val_costs.mean().item():.4f}, t = {t_statistic.item():.3f}")
+        if t_statistic < -self.critical_value:
+            print("Rollout baseline: updating baseline model")
+            self._update_model(model)
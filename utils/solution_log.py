@@ -0,0 +1,128 @@
+import os
+import json
+
+import numpy as np
+import torch
+
+
+class SolutionLogWriter(object):
+    """
+    Streams the solutions of evaluation runs to a directory with one compressed npz file per run,
+    so only the current run is kept in memory. Per run, the files contain
+      coordinates (n_envs, graph_size, 2),
+      tour_indices (n_steps, n_envs), -1 after an env is done,
+    and either the full action distributions
+      tour_probs (n_steps, n_envs, n_actions) in float16,
+    or with top_k only the k most likely actions of each step
+      tour_topk_probs (n_steps, n_envs, k) in float16 and tour_topk_indices (n_steps, n_envs, k).
+    """
+
+    def __init__(self, path, top_k=None):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.top_k = top_k
+        self.num_runs = 0
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'top_k': top_k}, f)
+
+    def start_run(self, coordinates, n_actions=None):
+        """
+        :param coordinates: (n_envs, graph_size, 2) node coordinates of the instances
+        :param n_actions: size of the action distributions, defaults to graph_size
+        """
+        self.coordinates = np.asarray(coordinates, dtype=np.float32)
+        self.num_envs = self.coordinates.shape[0]
+        self.n_actions = self.coordinates.shape[1] if n_actions is None else n_actions
+        self.steps = []
+
+    def log_step(self, env_ids, probs, actions):
+        """
+        :param env_ids: indices of the envs that were not done before the step
+        :param probs: (len(env_ids), n_actions) action distributions
+        :param actions: (len(env_ids),) selected actions
+        """
+        probs = probs.detach()
+        self.n_actions = probs.size(-1)
+        if self.top_k is not None:
+            probs, indices = probs.topk(min(self.top_k, probs.size(-1)), dim=-1)
+            indices = indices.to(torch.int16).cpu().numpy()
+        else:
+            indices = None
+        self.steps.append((np.asarray(env_ids), probs.to(torch.float16).cpu().numpy(), indices,
+                           torch.as_tensor(actions).cpu().numpy()))
+
+    def end_run(self):
+        n_steps = len(self.steps)
+        # runs without steps (e.g. all envs done at the start) get records with 0 steps
+        if n_steps > 0:
+            n_probs = self.steps[0][1].shape[-1]
+        else:
+            n_probs = self.n_actions if self.top_k is None else min(self.top_k, self.n_actions)
+        tour_indices = np.full((n_steps, self.num_envs), -1, dtype=np.int16)
+        probs = np.zeros((n_steps, self.num_envs, n_probs), dtype=np.float16)
+        topk_indices = np.zeros((n_steps, self.num_envs, n_probs), dtype=np.int16) if self.top_k is not None else None
+        for step, (env_ids, step_probs, step_indices, actions) in enumerate(self.steps):
+            tour_indices[step, env_ids] = actions
+            probs[step, env_ids] = step_probs
+            if topk_indices is not None:
+                topk_indices[step, env_ids] = step_indices
+
+        arrays = {'coordinates': self.coordinates, 'tour_indices': tour_indices, 'n_actions': np.array(self.n_actions)}
+        if topk_indices is None:
+            arrays['tour_probs'] = probs
+        else:
+            arrays['tour_topk_probs'] = probs
+            arrays['tour_topk_indices'] = topk_indices
+        np.savez_compressed(os.path.join(self.path, f"run_{self.num_runs:05d}.npz"), **arrays)
+        self.num_runs += 1
+        self.steps = []
+
+
+class SolutionLog(object):
+    """
+    Lazy reader of the solution logs of SolutionLogWriter, runs are only loaded from disk when they are accessed
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.top_k = json.load(f)['top_k']
+        self.files = sorted(filename for filename in os.listdir(path) if filename.endswith('.npz'))
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getitem__(self, run):
+        """
+        Arrays of one run as in the files, with tour_probs densified from the top k probabilities if necessary
+        """
+        with np.load(os.path.join(self.path, self.files[run])) as data:
+            arrays = {name: data[name] for name in data.files}
+        if 'tour_topk_probs' in arrays:
+            topk_probs, topk_indices = arrays.pop('tour_topk_probs'), arrays.pop('tour_topk_indices')
+            n_steps, n_envs, _ = topk_probs.shape
+            tour_probs = np.zeros((n_steps, n_envs, int(arrays['n_actions'])), dtype=np.float16)
+            np.put_along_axis(tour_probs, topk_indices.astype(np.int64), topk_probs, axis=-1)
+            arrays['tour_probs'] = tour_probs
+        return arrays
+
+    def __iter__(self):
+        return (self[run] for run in range(len(self)))
+
+    def instances(self, runs=None):
+        """
+        Coordinates (n_instances, graph_size, 2), tours (n_instances, n_steps) and action distributions
+        (n_instances, n_steps, n_actions) of the selected runs (default all), with the envs of all runs as instances
+        """
+        runs = range(len(self)) if runs is None else runs
+        coordinates, tours, probs = [], [], []
+        for run in runs:
+            arrays = self[run]
+            coordinates.append(arrays['coordinates'])
+            tours.append(arrays['tour_indices'].T)
+            probs.append(arrays['tour_probs'].transpose(1, 0, 2))
+        # OP tours of different runs can have different numbers of steps
+        n_steps = max(tour.shape[1] for tour in tours)
+        tours = [np.pad(tour, ((0, 0), (0, n_steps - tour.shape[1])), constant_values=-1) for tour in tours]
+        probs = [np.pad(prob, ((0, 0), (0, n_steps - prob.shape[1]), (0, 0))) for prob in probs]
+        return np.concatenate(coordinates), np.concatenate(tours), np.concatenate(probs)